@@ -0,0 +1,130 @@
+#!/usr/bin/python
+"""
+Benchmark bluechips.model.types.Currency against the original
+SmartSubclass-based implementation.
+
+Usage: python benchmarks/currency.py [OPS] [SEED]
+
+The two implementations are first checked against each other on a
+batch of random operands, then timed on OPS (1000000 by default)
+additions, multiplications, divisions and conversions to strings.
+"""
+
+import locale
+import random
+import sys
+import time
+from decimal import Decimal
+from weakref import WeakValueDictionary
+
+from bluechips.lib.subclass import SmartSubclass
+from bluechips.model.types import Currency
+
+
+class LegacyCurrency(object):
+    "Currency as it was before the rewrite."
+    __metaclass__ = SmartSubclass(int)
+    __old_values__ = WeakValueDictionary()
+    def __new__(cls, value):
+        if value is None:
+            value = 0
+        elif isinstance(value, str):
+            value = int(float(value) * 100)
+        else:
+            value = int(value)
+
+        if value not in cls.__old_values__:
+            new_object = super(cls, cls).__new__(cls)
+            new_object.value = value
+            cls.__old_values__[value] = new_object
+            return new_object
+        else:
+            return cls.__old_values__[value]
+
+    def __int__(self):
+        return self.value
+    def __float__(self):
+        return float(self.value)
+    def __long__(self):
+        return long(self.value)
+
+    def __cmp__(self, other):
+        if other == '':
+            return 1
+        else:
+            return self.value.__cmp__(int(other))
+
+    def __mul__(self, other):
+        return LegacyCurrency(self.value * other)
+    def __rmul__(self, other):
+        return self.__mul__(other)
+    def __div__(self, other):
+        return LegacyCurrency(self.value / other)
+    def __truediv__(self, other):
+        return LegacyCurrency(self.value / other)
+
+    def __repr__(self):
+        return '%s("%s")' % (self.__class__.__name__, str(self))
+    def __str__(self):
+        return locale.currency(self.value / 100., grouping=True)
+
+
+def check_equivalence(rng, rounds=10000):
+    for i in xrange(rounds):
+        a = rng.randint(-10 ** 6, 10 ** 6)
+        b = rng.choice([rng.randint(1, 1000),
+                        Decimal(rng.randint(1, 1000)) / 7])
+        new, old = Currency(a), LegacyCurrency(a)
+        for op in (lambda x: x + int(b), lambda x: int(b) + x,
+                   lambda x: x - int(b), lambda x: x * b, lambda x: b * x,
+                   lambda x: x / b, lambda x: -x, lambda x: abs(x),
+                   lambda x: cmp(x, int(b)), lambda x: cmp(x, '')):
+            expected, actual = op(old), op(new)
+            if str(actual) != str(expected):
+                raise AssertionError('Implementations disagree on %r, %r:'
+                                     '\n%r\n%r' % (a, b, expected, actual))
+
+
+def timed(stmt, *args):
+    start = time.time()
+    stmt(*args)
+    return time.time() - start
+
+
+def bench_sum(values):
+    sum(values)
+
+def bench_muldiv(values):
+    for v in values:
+        v * 3 / 4
+
+def bench_format(values):
+    for v in values:
+        str(v)
+
+
+def main(argv):
+    ops = int(argv[1]) if len(argv) > 1 else 1000000
+    seed = int(argv[2]) if len(argv) > 2 else 0
+    rng = random.Random(seed)
+
+    check_equivalence(rng)
+    print 'Equivalence check passed'
+
+    amounts = [rng.randint(-10 ** 6, 10 ** 6) for i in xrange(ops)]
+    legacy = [LegacyCurrency(a) for a in amounts]
+    new = [Currency(a) for a in amounts]
+
+    print '%d operations each' % ops
+    print '%-8s %10s %10s %8s' % ('', 'legacy', 'new', 'speedup')
+    for name, bench in (('sum', bench_sum),
+                        ('mul/div', bench_muldiv),
+                        ('format', bench_format)):
+        legacy_time = timed(bench, legacy)
+        new_time = timed(bench, new)
+        print '%-8s %9.3fs %9.3fs %7.1fx' % (name, legacy_time, new_time,
+                                             legacy_time / max(new_time, 1e-9))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
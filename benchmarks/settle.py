@@ -0,0 +1,107 @@
+#!/usr/bin/python
+"""
+Benchmark bluechips.lib.totals.settle against the original
+sort-every-iteration implementation.
+
+Usage: python benchmarks/settle.py [USERS] [SEED]
+
+Both implementations are first checked against each other on a batch
+of small, tie-heavy random books, then timed on one set of books with
+USERS synthetic users (10000 by default).
+"""
+
+import random
+import sys
+import time
+
+from bluechips.lib.totals import settle, DirtyBooks
+
+
+def legacy_settle(debts_dict):
+    "settle() as it was before the heap-based rewrite."
+    debts_list = [dict(who=user, amount=amount) for user, amount in \
+                      debts_dict.iteritems()]
+    
+    owes_list = [debt for debt in debts_list if debt['amount'] > 0]
+    owed_list = [debt for debt in debts_list if debt['amount'] < 0]
+    
+    settle_list = []
+    
+    while len(owes_list) > 0 and len(owed_list) > 0:
+        owes_list.sort(reverse=True, key=(lambda x: abs(x['amount'])))
+        owed_list.sort(reverse=True, key=(lambda x: abs(x['amount'])))
+
+        owes = owes_list[0]
+        owed = owed_list[0]
+        
+        sum = owes['amount'] + owed['amount']
+        if sum == 0:
+            owes_list.pop(0)
+            owed_list.pop(0)
+            val = owes['amount']
+        elif sum > 0:
+            owes['amount'] += owed['amount']
+            owed_list.pop(0)
+            val = -owed['amount']
+        else:
+            owed['amount'] += owes['amount']
+            owes_list.pop(0)
+            val = owes['amount']
+        
+        settle_list.append((owes['who'], owed['who'], val))
+    
+    if len(owes_list) > 0:
+        raise DirtyBooks, ("People still owe money", owes_list)
+    if len(owed_list) > 0:
+        raise DirtyBooks, ("People are still owed money", owed_list)
+    
+    return settle_list
+
+
+def make_books(rng, users, scale):
+    "Return a balanced debts dict with ``users`` entries."
+    debts = dict(('user%d' % i, rng.randint(-scale, scale))
+                 for i in xrange(users - 1))
+    debts['user%d' % (users - 1)] = -sum(debts.itervalues())
+    return debts
+
+
+def check_equivalence(rng, rounds=2000):
+    for i in xrange(rounds):
+        # Small amounts make for lots of ties, which is where the two
+        # implementations could plausibly disagree
+        books = make_books(rng, rng.randint(2, 30), rng.choice([3, 10, 1000]))
+        expected = legacy_settle(books)
+        actual = settle(books)
+        if actual != expected:
+            raise AssertionError('Implementations disagree on %r:\n%r\n%r' %
+                                 (books, expected, actual))
+
+
+def timed(func, books):
+    start = time.time()
+    result = func(books)
+    return result, time.time() - start
+
+
+def main(argv):
+    users = int(argv[1]) if len(argv) > 1 else 10000
+    seed = int(argv[2]) if len(argv) > 2 else 0
+    rng = random.Random(seed)
+
+    check_equivalence(rng)
+    print 'Equivalence check passed'
+
+    books = make_books(rng, users, 100000)
+    legacy_result, legacy_time = timed(legacy_settle, books)
+    heap_result, heap_time = timed(settle, books)
+    assert legacy_result == heap_result
+
+    print '%d users, %d transfers' % (users, len(heap_result))
+    print 'legacy settle: %8.3fs' % legacy_time
+    print 'heap settle:   %8.3fs' % heap_time
+    print 'speedup:       %8.1fx' % (legacy_time / max(heap_time, 1e-9))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
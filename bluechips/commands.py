@@ -0,0 +1,293 @@
+"""
+paster commands for maintaining a BlueChips installation
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+from paste.deploy import appconfig
+from paste.script.command import Command, BadCommand
+
+
+class BlueChipsCommand(Command):
+    """
+    Base class for commands which need the BlueChips environment (and
+    in particular the database) set up from a config file.
+    """
+    min_args = 1
+    max_args = 1
+    usage = 'CONFIG_FILE'
+    group_name = 'bluechips'
+
+    def load_environment(self):
+        config_file = self.args[0]
+        if not os.path.isfile(config_file):
+            raise BadCommand('Config file %s does not exist' % config_file)
+        conf = appconfig('config:%s' % os.path.abspath(config_file))
+
+        from bluechips.config.environment import load_environment
+        load_environment(conf.global_conf, conf.local_conf)
+
+
+class RebuildBalancesCommand(BlueChipsCommand):
+    """
+    Rebuild the balances table from the full history of the books.
+
+    With --check, only compare the stored balances against a full
+    recalculation and report any differences.
+    """
+    summary = __doc__.strip().splitlines()[0]
+
+    parser = Command.standard_parser(verbose=True)
+    parser.add_option('--check',
+                      action='store_true',
+                      dest='check',
+                      help="Don't change anything; just verify the table")
+
+    def command(self):
+        self.load_environment()
+
+        from bluechips.lib import totals
+        from bluechips.model import meta
+
+        if not self.options.check:
+            totals.rebuild_balances()
+            meta.Session.commit()
+            if self.verbose:
+                print 'Rebuilt the balances table'
+
+        mismatches = totals.verify_balances()
+        for user_id, (stored, computed) in sorted(mismatches.items()):
+            print 'User %d: stored %s, computed %s' % (user_id, stored,
+                                                        computed)
+        if mismatches:
+            sys.exit(1)
+        elif self.verbose:
+            print 'All balances are correct'
+
+
+class RebuildRollupCommand(BlueChipsCommand):
+    """
+    Rebuild the per-tag, per-month spending rollup from scratch.
+
+    The rollup is kept up to date as the books change, so this is only
+    needed if it's been damaged or changed by hand.
+    """
+    summary = __doc__.strip().splitlines()[0]
+
+    parser = Command.standard_parser(verbose=True)
+
+    def command(self):
+        self.load_environment()
+
+        from bluechips.model import meta
+        from bluechips.model.rollup import rebuild_rollup
+
+        rebuild_rollup(meta.Session)
+        meta.Session.commit()
+        if self.verbose:
+            print 'Rebuilt the tag rollup table'
+
+
+class RebuildSearchIndexCommand(BlueChipsCommand):
+    """
+    Rebuild the search index from every expenditure and transfer.
+
+    The index is kept up to date as the books change, so this is only
+    needed to build it for the first time, after switching search
+    backends, or if it's been damaged.
+    """
+    summary = __doc__.strip().splitlines()[0]
+
+    parser = Command.standard_parser(verbose=True)
+
+    def command(self):
+        self.load_environment()
+
+        from bluechips.model import meta
+
+        meta.search.rebuild(meta.Session)
+        meta.Session.commit()
+        if self.verbose:
+            print 'Rebuilt the search index'
+
+
+class CheckpointBalancesCommand(BlueChipsCommand):
+    """
+    Record everyone's balance at the end of each month.
+
+    Checkpoints are filled in for every month since the books began,
+    through the last complete month (or the last month ending by
+    --through), skipping months which already have one. Run this from cron to keep
+    historical balance queries fast.
+    """
+    summary = __doc__.strip().splitlines()[0]
+
+    parser = Command.standard_parser(verbose=True)
+    parser.add_option('--through',
+                      dest='through',
+                      metavar='YYYY-MM-DD',
+                      help='Checkpoint months ending on or before this date')
+
+    def command(self):
+        self.load_environment()
+
+        import sqlalchemy as sa
+        from bluechips import model
+        from bluechips.lib import totals
+        from bluechips.model import meta
+
+        if self.options.through:
+            through = datetime.strptime(self.options.through,
+                                        '%Y-%m-%d').date()
+        else:
+            through = date.today()
+
+        starts = [meta.Session.execute(sa.select([sa.func.min(column)])).\
+                      scalar()
+                  for column in (model.expenditures.c.date,
+                                 model.transfers.c.date)]
+        starts = [start for start in starts if start is not None]
+        if not starts:
+            return
+
+        existing = set(d for (d,) in meta.Session.execute(
+                sa.select([model.balance_checkpoints.c.date]).distinct()))
+
+        month = min(starts).replace(day=1)
+        while True:
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            month_end = next_month - timedelta(days=1)
+            if month_end > through:
+                break
+            if month_end not in existing:
+                totals.create_checkpoint(month_end)
+                if self.verbose:
+                    print 'Checkpointed balances as of %s' % month_end
+            month = next_month
+
+        meta.Session.commit()
+
+
+class ImportExpendituresCommand(BlueChipsCommand):
+    """
+    Import expenditures from a CSV or OFX file.
+
+    Every row is checked before anything is saved, and nothing is
+    imported if any row is bad. Everybody involved gets a single email
+    about the whole import.
+    """
+    summary = __doc__.strip().splitlines()[0]
+    min_args = 2
+    max_args = 2
+    usage = 'CONFIG_FILE IMPORT_FILE'
+
+    parser = Command.standard_parser(verbose=True)
+    parser.add_option('--format',
+                      dest='format',
+                      help='csv or ofx (default: guess from the file name)')
+    parser.add_option('--spender',
+                      dest='spender',
+                      metavar='USERNAME',
+                      help="Who paid, for rows which don't say")
+    parser.add_option('--batch-size',
+                      dest='batch_size',
+                      type='int',
+                      default=100,
+                      help='Expenditures to save at a time')
+    parser.add_option('--no-email',
+                      action='store_true',
+                      dest='no_email',
+                      help="Don't send a notification email")
+
+    def command(self):
+        self.load_environment()
+
+        from pylons import config
+        from bluechips import model
+        from bluechips.lib import importer
+        from bluechips.model import meta
+
+        filename = self.args[1]
+        format = self.options.format or \
+            os.path.splitext(filename)[1][1:].lower()
+        if format not in importer.parsers:
+            raise BadCommand('Unknown import format %r' % format)
+
+        spender = None
+        if self.options.spender:
+            spender = meta.Session.query(model.User).\
+                filter_by(username=self.options.spender.decode('utf-8')).\
+                first()
+            if spender is None:
+                raise BadCommand('No such user %s' % self.options.spender)
+
+        f = open(filename, 'rb')
+        try:
+            rows = importer.parsers[format](f)
+            try:
+                expenditures = importer.import_expenditures(
+                    rows, spender, self.options.batch_size)
+            except importer.InvalidImport, e:
+                for line_num, error in e.errors:
+                    for field, message in sorted(error.items()):
+                        print 'Line %d: %s: %s' % (line_num, field, message)
+                sys.exit(1)
+        finally:
+            f.close()
+
+        if self.verbose:
+            print 'Imported %d expenditures' % len(expenditures)
+        if not self.options.no_email:
+            from bluechips.lib import outbox
+            importer.send_digest(config['pylons.app_globals'], expenditures)
+            meta.Session.commit()
+            # Don't leave the email waiting for the web server's worker
+            outbox.worker_from_config(config).drain()
+
+
+class SendMailCommand(BlueChipsCommand):
+    """
+    Send the notification email waiting in the outbox.
+
+    The web server normally does this itself, in a background thread;
+    use this instead if mailer.worker is turned off. With --daemon,
+    keep checking for new messages every mailer.poll_interval seconds
+    rather than stopping once the outbox is empty. With --retry-dead,
+    first put messages which were given up on back in the queue.
+    """
+    summary = __doc__.strip().splitlines()[0]
+
+    parser = Command.standard_parser(verbose=True)
+    parser.add_option('--daemon',
+                      action='store_true',
+                      dest='daemon',
+                      help='Keep running, sending new messages as they come')
+    parser.add_option('--retry-dead',
+                      action='store_true',
+                      dest='retry_dead',
+                      help='Retry messages which have been given up on')
+
+    def command(self):
+        self.load_environment()
+
+        import time
+        from pylons import config
+        from bluechips.lib import outbox
+        from bluechips.model import meta
+
+        if self.options.retry_dead:
+            retried = outbox.retry_dead(meta.Session)
+            meta.Session.commit()
+            if self.verbose:
+                print 'Retrying %d dead messages' % retried
+
+        worker = outbox.worker_from_config(config)
+        while True:
+            sent = worker.drain()
+            if self.verbose and sent:
+                print 'Sent %d messages' % sent
+            if not self.options.daemon:
+                break
+            time.sleep(worker.poll_interval)
@@ -4,7 +4,6 @@ import os
 from mako.lookup import TemplateLookup
 from pylons import config
 from sqlalchemy import engine_from_config
-from mailer import Mailer
 
 import bluechips.lib.app_globals as app_globals
 import bluechips.lib.helpers
@@ -39,9 +38,8 @@ def load_environment(global_conf, app_conf):
     
     # Setup SQLAlchemy database engine
     engine = engine_from_config(config, 'sqlalchemy.')
-    init_model(engine)
+    init_model(engine, config.get('search.backend'),
+               float(config.get('users.check_interval', '1')))
     
     # CONFIGURATION OPTIONS HERE (note: all config options will override
     # any Pylons config options)
-    config['pylons.app_globals'].mailer = Mailer(config.get('mailer.host',
-                                                            '127.0.0.1'))
@@ -13,9 +13,10 @@ from routes.middleware import RoutesMiddleware
 import authkit.authorize
 
 from bluechips.config.environment import load_environment
+from bluechips.lib.outbox import start_worker
 
 from bluechips.lib.permissions import (BlueChipUser, DummyAuthenticate,
-                                       authenticate)
+                                       CredentialCache)
 
 def make_app(global_conf, full_stack=True, **app_conf):
     """Create a Pylons WSGI application and return it
@@ -38,6 +39,9 @@ def make_app(global_conf, full_stack=True, **app_conf):
     # Configure the Pylons environment
     load_environment(global_conf, app_conf)
 
+    # Send queued notification email in the background
+    start_worker(config)
+
     # The Pylons WSGI app
     app = PylonsApp()
     
@@ -67,6 +71,10 @@ def make_app(global_conf, full_stack=True, **app_conf):
     # server is handling this static content, remove the following 3 lines)
     static_app = StaticURLParser(config['pylons.paths']['static_files'])
     app = Cascade([static_app, app])
-    app = AuthBasicHandler(app, 'BlueChips', authenticate)
+    credentials = CredentialCache(size=int(config.get('auth.cache_size',
+                                                      '1000')),
+                                  ttl=int(config.get('auth.cache_ttl',
+                                                     '300')))
+    app = AuthBasicHandler(app, 'BlueChips', credentials)
     app = DummyAuthenticate(app, app_conf)
     return app
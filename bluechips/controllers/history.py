@@ -3,35 +3,115 @@ Display old transactions
 """
 
 import logging
-from pylons import request
+from pylons import config, request
+from pylons.controllers.util import abort
+from pylons.decorators import jsonify
 
 from bluechips.lib.base import *
+from bluechips.lib.pagination import keyset_page
 from bluechips.lib.totals import *
+from bluechips.model.types import Currency
 
 import sqlalchemy as sa
-from sqlalchemy import orm
 
 log = logging.getLogger(__name__)
 
+def _page(query, table, name):
+    """
+    Return the page of ``query`` requested by the ``<name>_after`` or
+    ``<name>_before`` parameter, in the mappers' usual order.
+    """
+    try:
+        return keyset_page(query,
+                           [table.c.date, table.c.entered_time, table.c.id],
+                           after=request.GET.get('%s_after' % name),
+                           before=request.GET.get('%s_before' % name),
+                           page_size=int(config.get('history.page_size',
+                                                    '50')))
+    except ValueError:
+        abort(400)
+
 class HistoryController(BaseController):
+    conditional_actions = ('index', 'tag', 'full', 'balances')
+
     def index(self):
         c.title = 'History'
         
         c.tags = meta.Session.query(model.Tag).order_by([sa.func.lower(model.Tag.name)])
-        c.expenditures = meta.Session.query(model.Expenditure).\
-                options(orm.eagerload('splits')).all()
-        c.transfers = meta.Session.query(model.Transfer).all()
+        c.expenditures = _page(with_shares(meta.Session.query(model.Expenditure),
+                                           request.environ['user']),
+                               model.expenditures, 'expenditures')
+        c.transfers = _page(meta.Session.query(model.Transfer),
+                            model.transfers, 'transfers')
 
         return render('/history/index.mako')
 
 
+    def full(self):
+        """
+        The whole history on one page, for printing or auditing. It's
+        sent as it's read from the database, so it doesn't need to fit
+        in memory.
+        """
+        c.title = 'Full History'
+
+        expenditures = with_shares(meta.Session.query(model.Expenditure),
+                                   request.environ['user']).yield_per(100)
+        transfers = meta.Session.query(model.Transfer).yield_per(100)
+
+        return render_stream('/history/full.mako',
+                             dict(expenditures=expenditures,
+                                  transfers=transfers))
+
+
     def tag(self, id=None):
         c.title = 'History'
 
         c.tags = meta.Session.query(model.Tag).order_by([sa.func.lower(model.Tag.name)])
-        c.tag = meta.Session.query(model.Tag).filter_by(id=id).all()[0]
-        c.expenditures = c.tag.expenditures
-        c.total = sum([e.amount for e in c.expenditures])
-        c.share = sum([e.share(request.environ['user']) for e in c.expenditures])
+        try:
+            c.tag = meta.Session.query(model.Tag).get(int(id))
+        except (TypeError, ValueError):
+            c.tag = None
+        if c.tag is None:
+            abort(404)
+
+        tagged = model.Expenditure.id.in_(
+            sa.select([model.tag_to_expense_map.c.expenditure_id],
+                      model.tag_to_expense_map.c.tag_id == c.tag.id))
+        c.expenditures = _page(
+            with_shares(meta.Session.query(model.Expenditure).filter(tagged),
+                        request.environ['user']),
+            model.expenditures, 'expenditures')
+
+        # The totals cover every tagged expenditure, not just this page
+        c.total, c.share = tag_totals(request.environ['user'],
+                                      [c.tag.id]).\
+            get(c.tag.id, (Currency(0), Currency(0)))
 
         return render('/history/tag.mako')
+
+
+    @jsonify
+    def balances(self, id=None):
+        """
+        Everybody's balance over time, for charting: a list of [date,
+        cents] points per user, with one point for each day on which
+        their balance changed. Pass a user ID to get just their series.
+        """
+        if id is not None:
+            try:
+                id = int(id)
+            except ValueError:
+                abort(404)
+            if meta.directory.get(meta.Session, id) is None:
+                abort(404)
+        series = dict((user.id, dict(name=user.name, balances=[]))
+                      for user in meta.directory.all(meta.Session)
+                      if id is None or user.id == id)
+        for date, user_id, balance in balance_history(user_id=id):
+            if user_id in series:
+                series[user_id]['balances'].append([date.isoformat(),
+                                                    int(balance)])
+        
+        return dict(users=[dict(id=user_id, **data)
+                           for user_id, data in sorted(series.items())])
@@ -0,0 +1,60 @@
+"""
+Report on spending by tag and month
+"""
+
+import logging
+from datetime import date
+
+from pylons import request
+from pylons.controllers.util import abort
+
+from bluechips.lib.base import *
+
+import sqlalchemy as sa
+
+log = logging.getLogger(__name__)
+
+class ReportController(BaseController):
+    conditional_actions = ('index',)
+
+    def index(self):
+        """
+        Spending for each tag in each month of a year, and everybody's
+        share of it, read straight from the rollup table.
+        """
+        c.title = 'Reports'
+        rollup = model.tag_month_rollup
+
+        months = meta.Session.execute(sa.select([rollup.c.month]).distinct())
+        c.years = sorted(set(month.year for (month,) in months), reverse=True)
+        try:
+            c.year = int(request.params.get('year',
+                                            c.years and c.years[0] or
+                                            date.today().year))
+        except ValueError:
+            abort(400)
+
+        rows = meta.Session.execute(sa.select(
+                [rollup.c.month, rollup.c.tag_id, rollup.c.user_id,
+                 rollup.c.share, rollup.c.paid],
+                sa.and_(rollup.c.month >= date(c.year, 1, 1),
+                        rollup.c.month <= date(c.year, 12, 1)))).fetchall()
+
+        tags = dict(meta.Session.query(model.Tag.id, model.Tag.name).\
+                        filter(model.Tag.id.in_(set(r.tag_id for r in rows))))
+        user_ids = set(r.user_id for r in rows)
+        c.users = sorted([user for user in meta.directory.all(meta.Session)
+                          if user.id in user_ids],
+                         key=lambda user: user.name)
+
+        months = {}
+        for month, tag_id, user_id, share, paid in rows:
+            tag = months.setdefault(month, {}).setdefault(
+                tag_id, dict(name=tags[tag_id], total=0, shares={}))
+            tag['total'] += paid
+            tag['shares'][user_id] = share
+        c.months = [(month, sorted(months[month].values(),
+                                   key=lambda tag: tag['name'].lower()))
+                    for month in sorted(months, reverse=True)]
+
+        return render('/report/index.mako')
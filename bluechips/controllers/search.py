@@ -0,0 +1,79 @@
+"""
+Search expenditure and transfer descriptions
+"""
+
+import logging
+from pylons import config, request
+from pylons.controllers.util import abort
+
+from bluechips.lib.base import *
+from bluechips.lib.pagination import Page
+from bluechips.lib.totals import with_shares
+from bluechips.model.search import search_terms
+
+log = logging.getLogger(__name__)
+
+def _matches(cls, terms, name):
+    """
+    Return the page of IDs of ``cls`` instances matching ``terms``
+    requested by the ``<name>_after`` or ``<name>_before`` parameter,
+    along with the cursors for the pages either side.
+
+    Results are ranked rather than in date order, so the cursors are
+    just offsets into the results.
+    """
+    page_size = int(config.get('history.page_size', '50'))
+    try:
+        if '%s_before' % name in request.GET:
+            offset = int(request.GET['%s_before' % name]) - page_size
+            offset = max(offset, 0)
+        else:
+            offset = int(request.GET.get('%s_after' % name, 0))
+    except ValueError:
+        abort(400)
+    if offset < 0:
+        abort(400)
+
+    ids = meta.search.search(meta.Session, cls, terms, offset,
+                             page_size + 1)
+    older = None
+    if len(ids) > page_size:
+        older = str(offset + page_size)
+    newer = None
+    if offset > 0:
+        newer = str(offset)
+    return ids[:page_size], older, newer
+
+def _ranked(rows, ids, key=lambda row: row.id):
+    order = dict((id, i) for i, id in enumerate(ids))
+    return sorted(rows, key=lambda row: order[key(row)])
+
+class SearchController(BaseController):
+    conditional_actions = ('index',)
+
+    def index(self):
+        c.title = 'Search'
+
+        c.query = request.params.get('q', u'').strip()
+        terms = search_terms(c.query)
+        if not terms:
+            return render('/search/index.mako')
+
+        ids, older, newer = _matches(model.Expenditure, terms,
+                                     'expenditures')
+        rows = []
+        if ids:
+            rows = with_shares(meta.Session.query(model.Expenditure).\
+                                   filter(model.Expenditure.id.in_(ids)),
+                               request.environ['user']).all()
+        c.expenditures = Page(_ranked(rows, ids, key=lambda row: row[0].id),
+                              older, newer)
+
+        ids, older, newer = _matches(model.Transfer, terms, 'transfers')
+        rows = []
+        if ids:
+            rows = meta.Session.query(model.Transfer).\
+                filter(model.Transfer.id.in_(ids)).all()
+        c.transfers = Page(_ranked(rows, ids), older, newer)
+
+        return render('/search/index.mako')
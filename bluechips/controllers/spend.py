@@ -2,99 +2,35 @@
 Handle expenditures
 """
 
-from __future__ import division
 import logging
 
-import re
-import string
 from decimal import Decimal, InvalidOperation
 
 from bluechips.lib.base import *
+from bluechips.lib import importer
+from bluechips.lib.schemas import ExpenditureSchema
+from bluechips.model.tag import prune_tags
 
 from pylons import request, app_globals as g
 from pylons.decorators import validate
 from pylons.decorators.secure import authenticate_form
 from pylons.controllers.util import abort
 
-import formencode
-from formencode import validators, Schema
-from formencode.foreach import ForEach
-from formencode.variabledecode import NestedVariables
-from formencode.schema import SimpleFormValidator
-
 from mailer import Message
 
 log = logging.getLogger(__name__)
 
-class ExpenditureExpression(validators.FancyValidator):
-    goodChars = set('1234567890.+-/*() ')
-
-    def _to_python(self, value, state):
-        if (not set(value) <= self.goodChars or
-            re.search(r'([\+\-\*\/])\1', value)):
-            raise formencode.Invalid("Expression contains illegal characters", value, state)
-
-        if value == '':
-            return value, Decimal("0")
-
-        try:
-            number = eval(value)
-            return value, Decimal(str(number))
-        except:
-            raise formencode.Invalid("Not a valid mathematical expression", value, state)
-
-class TagValidator(validators.FancyValidator):
-    def _to_python(self, value,state):
-        try:
-            return set(map(string.strip, value.split(',')))
-        except:
-            raise formencode.Invalid("Unable to parse tags", value, state)
-
-class ShareSchema(Schema):
-    "Validate individual user shares."
-    allow_extra_fields = False
-    user_id = validators.Int(not_empty=True)
-    amount = ExpenditureExpression()
-
-
-def validate_state(value_dict, state, validator):
-    if all(s['amount'] == 0 for s in value_dict['shares']):
-        return {'shares-0.amount': 'Need at least one non-zero share'}
-ValidateNotAllZero = SimpleFormValidator(validate_state)
-
-
-def prune_tags():
-    for tag in meta.Session.query(model.Tag).all():
-        if not tag.expenditures:
-            meta.Session.delete(tag)
-    meta.Session.commit()
-
-class ExpenditureSchema(Schema):
-    "Validate an expenditure."
-    allow_extra_fields = False
-    pre_validators = [NestedVariables()]
-    spender_id = validators.Int(not_empty=True)
-    amount = model.types.CurrencyValidator(not_empty=True)
-    description = validators.UnicodeString(not_empty=True)
-    tags = TagValidator()
-    date = validators.DateConverter()
-    shares = ForEach(ShareSchema)
-    chained_validators = [ValidateNotAllZero]
-    
-
 class SpendController(BaseController):
     def index(self):
         return self.edit()
     
     def edit(self, id=None):
-        c.users = meta.Session.query(model.User.id, model.User)
+        c.users = meta.directory.items(meta.Session)
         if id is None:
             c.title = 'Add a New Expenditure'
             c.expenditure = model.Expenditure()
             c.expenditure.spender_id = request.environ['user'].id
 
-            num_residents = meta.Session.query(model.User).\
-                    filter_by(resident=True).count()
             # Pre-populate split percentages for an even split.
             c.values = {}
             for ii, user_row in enumerate(c.users):
@@ -129,18 +65,20 @@ class SpendController(BaseController):
             e = model.Expenditure()
             meta.Session.add(e)
             op = 'created'
+            old_tag_ids = set()
         else:
             e = meta.Session.query(model.Expenditure).get(id)
             if e is None:
                 abort(404)
             op = 'updated'
+            old_tag_ids = set(tag.id for tag in e._tags)
         
         # Set the fields that were submitted
         shares = self.form_result.pop('shares')
         tags = self.form_result.pop('tags') or set()
         update_sar(e, self.form_result)
 
-        users = dict(meta.Session.query(model.User.id, model.User).all())
+        users = dict(meta.directory.items(meta.Session))
         split_dict = {}
         split_text_dict = {}
         for share_params in shares:
@@ -152,8 +90,12 @@ class SpendController(BaseController):
         e.tags.clear()
         e.tags |= tags
 
-        meta.Session.commit()
-       
+        # Reload the expenditure as saved, so that the notification
+        # sees its new spender and splits
+        meta.Session.flush()
+        meta.Session.expire(e)
+        prune_tags(meta.Session, old_tag_ids)
+
         show = ("Expenditure of %s paid for by %s %s." %
                 (e.amount, e.spender, op))
         h.flash(show)
@@ -161,12 +103,12 @@ class SpendController(BaseController):
         # Send email notification to involved users if they have an email set.
         involved_users = set(sp.user for sp in e.splits if sp.share != 0)
         involved_users.add(e.spender)
-        body = render('/emails/expenditure.txt',
-                      extra_vars={'expenditure': e,
-                                  'op': op})
+        body = lambda: render('/emails/expenditure.txt',
+                              extra_vars={'expenditure': e,
+                                          'op': op})
         g.handle_notification(involved_users, show, body)
 
-        prune_tags()
+        meta.Session.commit()
 
         return h.redirect_to('/')
 
@@ -187,9 +129,6 @@ class SpendController(BaseController):
             abort(404)
 
         if 'delete' in request.params:
-            meta.Session.delete(e)
-
-            meta.Session.commit()
             show = ("Expenditure of %s paid for by %s deleted." %
                     (e.amount, e.spender))
             h.flash(show)
@@ -199,8 +138,46 @@ class SpendController(BaseController):
             body = render('/emails/expenditure.txt',
                           extra_vars={'expenditure': e,
                                       'op': 'deleted'})
+            tag_ids = set(tag.id for tag in e._tags)
+
+            meta.Session.delete(e)
+            meta.Session.flush()
+            prune_tags(meta.Session, tag_ids)
             g.handle_notification(involved_users, show, body)
+            meta.Session.commit()
+
+        return h.redirect_to('/')
+
+    def upload(self):
+        c.title = 'Import Expenditures'
+        c.users = meta.directory.items(meta.Session)
+        c.spender_id = request.environ['user'].id
+        c.errors = []
+        return render('/spend/upload.mako')
+
+    @redirect_on_get('upload')
+    @authenticate_form
+    def import_file(self):
+        upload = request.POST.get('file')
+        format = request.POST.get('format', 'csv')
+        if not hasattr(upload, 'file') or format not in importer.parsers:
+            abort(400)
+        spender_id = request.POST.get('spender_id', '')
+        spender = spender_id.isdigit() and \
+            meta.directory.get(meta.Session, int(spender_id)) or None
 
-            prune_tags()
+        try:
+            expenditures = importer.import_expenditures(
+                importer.parsers[format](upload.file), spender)
+        except importer.InvalidImport, e:
+            c.title = 'Import Expenditures'
+            c.users = meta.directory.items(meta.Session)
+            c.spender_id = spender and spender.id
+            c.errors = e.errors
+            return render('/spend/upload.mako')
+
+        h.flash("%d expenditures imported." % len(expenditures))
+        importer.send_digest(g, expenditures)
+        meta.Session.commit()
 
         return h.redirect_to('/')
@@ -8,20 +8,43 @@ from bluechips.lib.base import *
 from bluechips.lib.totals import *
 
 import sqlalchemy
-from sqlalchemy import orm
 
 from datetime import date, timedelta
 
 from bluechips.model.types import Currency
 
-from pylons import request
+from pylons import config, request, response, app_globals as g
 
 log = logging.getLogger(__name__)
 
+def periods(today):
+    """
+    The periods the dashboard shows totals for, as (name, start, end)
+    triples for bluechips.lib.totals.period_totals.
+    """
+    month_start = today.replace(day=1)
+    return [('Total', None, None),
+            ('Past year', today - timedelta(days=365), None),
+            ('Year to date', today.replace(month=1, day=1), None),
+            ('Month to date', month_start, None),
+            ('Last month', (today - timedelta(days=30)).replace(day=1),
+             month_start)]
+
 class StatusController(BaseController):
+    conditional_actions = ('index',)
+
     def index(self):
-        c.debts = debts()
-        c.settle = settle(c.debts)
+        c.settle_strategy = request.params.get(
+            'settle', config.get('settle.strategy', 'greedy'))
+        if c.settle_strategy not in settle_strategies:
+            c.settle_strategy = 'greedy'
+
+        balances, transfers = self._settlement(c.settle_strategy)
+        user = lambda user_id: meta.directory.get(meta.Session, user_id)
+        c.debts = dict((user(user_id), Currency(amount))
+                       for user_id, amount in balances.iteritems())
+        c.settle = [(user(from_id), user(to_id), Currency(amount))
+                    for from_id, to_id, amount in transfers]
 
         c.net = 0
         for from_user, to_user, amount in c.settle:
@@ -30,64 +53,42 @@ class StatusController(BaseController):
             elif to_user == request.environ['user']:
                 c.net += amount
         
-        periods = {}
-        periods['Total'] = (None, None)
-        periods['Past year'] = (date.today() - timedelta(days=365), None)
-        periods['Year to date'] = (date.today().replace(month=1, day=1), None)
-        periods['Month to date'] = (date.today().replace(day=1), None)
-        periods['Last month'] = ((date.today() -
-                                  timedelta(days=30)).replace(day=1),
-                                 periods['Month to date'][0])
-        
-        c.totals = {}
-        for period in periods.keys():
-            c.totals[period] = {}
-            start, end = periods[period]
-            conds = []
-            if start is not None:
-                conds.append(model.Expenditure.date >= start)
-            if end is not None:
-                conds.append(model.Expenditure.date < end)
-            if len(conds) > 1:
-                conds = sqlalchemy.and_(*conds)
-            elif len(conds) > 0:
-                conds = conds[0]
-            else:
-                conds = None
-
-            for scope in ('all', 'mine'):
-                meth = getattr(self, '_total_%s' % scope)
-                c.totals[period][scope] = meth(conds)
+        c.periods = periods(date.today())
+        c.totals = period_totals(c.periods, request.environ['user'])
 
-        c.expenditures = meta.Session.query(model.Expenditure).\
-                filter(sqlalchemy.or_(
-                    model.Expenditure.spender == request.environ['user'],
-                    model.Expenditure.splits.any(
-                        sqlalchemy.and_(
-                            model.Split.user == request.environ['user'],
-                            model.Split.share != 0)))).\
-                options(orm.eagerload('splits')).\
+        c.expenditures = with_shares(meta.Session.query(model.Expenditure),
+                                     request.environ['user'],
+                                     only_involved=True).\
                 limit(10).all()
         c.transfers = meta.Session.query(model.Transfer).\
             filter(sqlalchemy.or_(
                 model.Transfer.debtor==request.environ['user'],
                 model.Transfer.creditor==request.environ['user'])).\
                 limit(10).all()
-        c.users = meta.Session.query(model.User.id, model.User)
+        c.users = meta.directory.items(meta.Session)
         
         return render('/status/index.mako')
     
-    def _total_all(self, conditions=None):
-        q = meta.Session.query(sqlalchemy.func.SUM(
-            model.Expenditure.amount))
-        if conditions is not None:
-            q = q.filter(conditions)
-        return q.scalar()
+    def cache(self):
+        """
+        Report how well the settlement cache and the user directory
+        are working in this process.
+        """
+        response.headers['Content-Type'] = 'text/plain'
+        caches = g.cache_stats.items() + [('users', meta.directory.stats)]
+        return ''.join('%s: %d hits, %d misses\n' %
+                       (namespace, stats['hits'], stats['misses'])
+                       for namespace, stats in sorted(caches))
 
-    def _total_mine(self, conditions=None):
-        q = meta.Session.query(sqlalchemy.func.SUM(
-            model.Split.share)).join(model.Split.expenditure).\
-                filter(model.Split.user == request.environ['user'])
-        if conditions is not None:
-            q = q.filter(conditions)
-        return q.scalar()
+    def _settlement(self, strategy):
+        """
+        Compute the settlement for the current state of the books, or
+        fetch it from the cache if nothing has changed since it was
+        last computed.
+        """
+        time_budget = float(config.get('settle.time_budget', '0.05'))
+        version = request_ledger_version()
+        if version is None:
+            return settlement(strategy, time_budget)
+        return g.cached('settlement', strategy, version,
+                        lambda: settlement(strategy, time_budget))
@@ -35,7 +35,8 @@ class TransferController(BaseController):
        return self.edit()
     
     def edit(self, id=None):
-        c.users = meta.Session.query(model.User.id, model.User.name)
+        c.users = [(user.id, user.name)
+                   for user in meta.directory.all(meta.Session)]
         if id is None:
             c.title = 'Add a New Transfer'
             c.transfer = model.Transfer()
@@ -63,17 +64,23 @@ class TransferController(BaseController):
             op = 'updated'
         
         update_sar(t, self.form_result)
-        meta.Session.commit()
-       
+
+        # Reload the transfer as saved, so that the notification sees
+        # its new debtor and creditor
+        meta.Session.flush()
+        meta.Session.expire(t)
+
         show = ('Transfer of %s from %s to %s %s.' %
                 (t.amount, t.debtor, t.creditor, op))
         h.flash(show)
 
         # Send email notification to involved users if they have an email set.
-        body = render('/emails/transfer.txt', extra_vars={'transfer': t,
-                                                          'op': op})
+        body = lambda: render('/emails/transfer.txt',
+                              extra_vars={'transfer': t, 'op': op})
         g.handle_notification((t.debtor, t.creditor), show, body)
 
+        meta.Session.commit()
+
         return h.redirect_to('/')
 
     def delete(self, id):
@@ -92,9 +99,6 @@ class TransferController(BaseController):
             abort(404)
 
         if 'delete' in request.params:
-            meta.Session.delete(t)
-
-            meta.Session.commit()
             show = ("Transfer of %s from %s to %s deleted." %
                     (t.amount, t.debtor, t.creditor))
             h.flash(show)
@@ -102,6 +106,9 @@ class TransferController(BaseController):
             body = render('/emails/transfer.txt',
                           extra_vars={'transfer': t,
                                       'op': 'deleted'})
+
+            meta.Session.delete(t)
             g.handle_notification((t.debtor, t.creditor), show, body)
+            meta.Session.commit()
 
         return h.redirect_to('/')
@@ -25,6 +25,7 @@ class EmailSchema(Schema):
     "Validate email updates."
     allow_extra_fields = False
     new_email = validators.Email()
+    digest = validators.StringBoolean(if_missing=False)
 
 
 class UniqueUsername(FancyValidator):
@@ -66,6 +67,7 @@ class UserController(BaseController):
     def update(self):
         new_email = self.form_result['new_email']
         request.environ['user'].email = new_email
+        request.environ['user'].digest = self.form_result['digest']
         meta.Session.commit()
         if new_email is None:
             h.flash("Removed email address.")
@@ -91,7 +93,7 @@ class UserController(BaseController):
             u.name = self.form_result['username']
 
         if self.form_result['password'] is not None:
-            u.password = self.form_result['password']
+            u.set_password(self.form_result['password'])
 
         meta.Session.add(u)
         meta.Session.commit()
@@ -0,0 +1,54 @@
+"""
+Divide an amount of money into shares of whole cents
+"""
+
+import random
+from fractions import Fraction
+
+from bluechips.model.types import Currency
+
+
+def largest_remainder(amount, weights, seed=None):
+    """
+    Divide ``amount`` in proportion to ``weights`` using the
+    largest-remainder (Hamilton) method.
+
+    ``weights`` is a sequence of (key, weight) pairs, where each weight
+    is anything Fraction understands (e.g. an int or a Decimal), and
+    the result is a list of (key, Currency) pairs in the same order.
+    The shares always add up to exactly ``amount``.
+
+    Everybody first gets their exact share rounded down. The pennies
+    left over then go, one each, to whoever lost the most to
+    rounding. Ties are broken at random; pass a ``seed`` to get the
+    same answer every time for the same ``weights``.
+    """
+    weights = [(key, Fraction(weight)) for key, weight in weights]
+    total = sum(weight for key, weight in weights)
+    if total == 0:
+        raise ValueError("Can't divide an amount among shares totalling 0")
+
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(seed)
+
+    amount = int(amount)
+    shares = []
+    remainders = []
+    for i, (key, weight) in enumerate(weights):
+        quota = amount * weight / total
+        share = quota.numerator // quota.denominator
+        shares.append(share)
+        remainders.append((quota - share, rng.random(), i))
+
+    leftover = amount - sum(shares)
+    remainders.sort(reverse=True)
+    for remainder, tiebreak, i in remainders[:leftover]:
+        shares[i] += 1
+
+    return [(key, Currency(share))
+            for (key, weight), share in zip(weights, shares)]
+
+
+__all__ = ['largest_remainder']
@@ -1,11 +1,17 @@
 """The application's Globals object"""
 
 import logging
+import threading
 
+from beaker.cache import CacheManager
+from beaker.util import parse_cache_config_options
 from pylons import config, request
 from paste.deploy.converters import asbool
 from mailer import Message
 
+from bluechips.lib import notifications, outbox
+from bluechips.model import meta
+
 log = logging.getLogger(__name__)
 
 class Globals(object):
@@ -18,30 +24,90 @@ class Globals(object):
         initialization and is available during requests via the 'g'
         variable
         """
-        pass
+        cache_options = parse_cache_config_options(config)
+        # Things cached in the ledger region are stored under one key
+        # apiece along with the ledger version they were computed at, so
+        # they're replaced rather than piling up as the books change. If
+        # it isn't configured, cache within this process.
+        cache_options.setdefault('cache_regions', {}).\
+            setdefault('ledger', dict(type='memory', expire=None,
+                                      enabled=cache_options['enabled']))
+        self.cache = CacheManager(**cache_options)
+
+        self.cache_stats = {}
+        self._cache_stats_lock = threading.Lock()
+
+    def cached(self, namespace, key, version, createfunc):
+        """
+        Look ``key`` up in the ledger cache region, calling
+        ``createfunc`` to fill it in if it's missing or was stored for
+        a ledger version other than ``version``.
+
+        Hits and misses are counted per namespace in cache_stats.
+        """
+        cache = self.cache.get_cache_region(namespace, 'ledger')
+        try:
+            stored_version, value = cache.get_value(key)
+            missed = stored_version != version
+        except KeyError:
+            missed = True
+        if missed:
+            value = createfunc()
+            cache.set_value(key, (version, value))
+
+        self._cache_stats_lock.acquire()
+        try:
+            stats = self.cache_stats.setdefault(namespace,
+                                                dict(hits=0, misses=0))
+            if missed:
+                stats['misses'] += 1
+            else:
+                stats['hits'] += 1
+        finally:
+            self._cache_stats_lock.release()
+
+        return value
 
     def send_message(self, msg):
         """
-        Wrap the call to mailer.send() so that we can do stuff like defer mail
-        sending, wrap in a test fixture, selectively disable mailing in certain
-        environments, etc.
+        Queue ``msg`` in the outbox as part of the current database
+        transaction, to be sent once that commits (see
+        bluechips.lib.outbox).
+
+        In testing and network_free mode, the message is also kept in
+        the request environment (if there is a request), where tests
+        can look at it.
         """
         if asbool(config.get('testing')) or asbool(config.get('network_free')):
-            if 'mailer.messages' not in request.environ:
-                request.environ['mailer.messages'] = []
-            request.environ['mailer.messages'].append(msg)
-            log.info("From: %s\nTo: %s\nSubject: %s\n\n%s",
-                     msg.From, msg.To, msg.Subject, msg.Body)
-        else:
-            self.mailer.send(msg) # pragma: nocover
+            try:
+                environ = request.environ
+            except TypeError:
+                # Not handling a request, e.g. in a paster command
+                environ = None
+            if environ is not None:
+                environ.setdefault('mailer.messages', []).append(msg)
+        outbox.enqueue(meta.Session, msg)
 
     def handle_notification(self, users, subject, body):
-        "Send a notification email."
-        recipients = [u.email for u in users if u.email is not None]
+        """
+        Send a notification email. It's queued as part of the current
+        transaction, so call this before committing.
+
+        Users who want digests just get ``subject`` saved for their next
+        one. ``body`` can be a function returning the text, so that it
+        isn't rendered unless somebody will get it.
+        """
+        users = [u for u in users if u.email is not None]
+        digests = [u for u in users if u.digest]
+        if digests:
+            notifications.queue(meta.Session, digests, subject)
+        recipients = [u.email for u in users if not u.digest]
         if len(recipients) > 0:
             msg = Message(From=config.get('mailer.from',
                                           'root@localhost'),
                           To=recipients)
             msg.Subject = "BlueChips: %s" % subject
+            if callable(body):
+                body = body()
             msg.Body = body
             self.send_message(msg)
@@ -3,14 +3,23 @@
 Provides the BaseController class for subclassing.
 """
 
+import re
+import uuid
+from datetime import date
+from hashlib import sha1
+from itertools import islice
+
+import pkg_resources
 from decorator import decorator
 
-from pylons import request, session, tmpl_context as c
+from pylons import request, response, session, tmpl_context as c
 from pylons.controllers import WSGIController
+from pylons.controllers.util import abort
 from pylons.i18n import _, ungettext, N_
-from pylons.templating import render_mako
+from pylons.templating import pylons_globals, render_mako
 
 from mako.exceptions import TopLevelLookupException
+from webhelpers.html.secure_form import token_key
 
 import bluechips.lib.helpers as h
 from bluechips import model
@@ -18,6 +27,15 @@ from bluechips.model import meta
 
 
 class BaseController(WSGIController):
+    # Actions which only display the books. They get an ETag, and
+    # conditional GETs for them are answered before any real work is
+    # done.
+    conditional_actions = ()
+
+    def __before__(self, action):
+        if (action in self.conditional_actions and
+            request.method in ('GET', 'HEAD')):
+            conditional_get()
 
     def __call__(self, environ, start_response):
         """Invoke the Controller"""
@@ -27,7 +45,10 @@ class BaseController(WSGIController):
         try:
             return WSGIController.__call__(self, environ, start_response)
         finally:
-            meta.Session.remove()
+            # Streamed responses still need the session while they're
+            # being sent, and remove it themselves
+            if not environ.get('bluechips.streaming'):
+                meta.Session.remove()
 
 def update_sar(record, form_result):
     """
@@ -51,8 +72,11 @@ def redirect_on_get(action):
             return func(*args, **kwargs)
     return redirect_on_get_wrap
 
+def _mobile_user_agent():
+    return any([x in request.user_agent for x in ('iPhone','webOS')])
+
 def render(name, *args, **kwargs):
-    if any([x in request.user_agent for x in ('iPhone','webOS')]):
+    if _mobile_user_agent():
         if 'use_non_mobile' in request.params:
             session['use_non_mobile'] = (request.params['use_non_mobile'] ==
                                          'yes')
@@ -67,5 +91,121 @@ def render(name, *args, **kwargs):
                 c.mobile_client = False
     return render_mako(name, *args, **kwargs)
 
-__all__ = ['c', 'h', 'render', 'model', 'meta', '_', 'ungettext', 'N_',
-           'BaseController', 'update_sar', 'redirect_on_get']
+try:
+    _app_version = pkg_resources.get_distribution('BlueChips').version
+except pkg_resources.DistributionNotFound:
+    _app_version = ''
+
+def request_ledger_version():
+    """
+    Return the ledger version, reading it at most once per request.
+
+    Only for use by read-only actions, since it won't notice the
+    request's own changes.
+    """
+    if 'bluechips.ledger_version' not in request.environ:
+        from bluechips.lib.totals import ledger_version
+        request.environ['bluechips.ledger_version'] = ledger_version()
+    return request.environ['bluechips.ledger_version']
+
+def page_etag():
+    """
+    Return an entity tag for the page being requested, or None if it
+    mustn't be cached.
+
+    The tag covers everything a read-only page depends on: the ledger
+    version (which changes whenever the books do), who's asking, the
+    session's form authentication token if it has one (the mobile
+    pages embed it), whether they get the mobile templates, the date
+    (for pages which default to today) and the version of BlueChips
+    itself.
+    """
+    if h.flash.session_key in session or 'use_non_mobile' in request.params:
+        # The page will show (and use up) a flash message, or change
+        # the session
+        return None
+
+    epoch, version = request_ledger_version() or ('', 0)
+    mobile = _mobile_user_agent() and not session.get('use_non_mobile')
+    # Don't create a session (and a token) just to work out the tag
+    token = session.get(token_key, '')
+    key = u'%s %d %d %s %s %s %s' % (epoch, version,
+                                     request.environ['user'].id, token,
+                                     bool(mobile), date.today().isoformat(),
+                                     _app_version)
+    return sha1(key.encode('utf-8')).hexdigest()
+
+def conditional_get():
+    """
+    Tag the response with page_etag, and answer with a 304 straight
+    away if the client already has this version of the page.
+    """
+    etag = page_etag()
+    if etag is None:
+        return
+    headers = [('ETag', '"%s"' % etag),
+               ('Cache-Control', 'private, no-cache')]
+    if etag in request.if_none_match:
+        abort(304, headers=headers)
+    for name, value in headers:
+        response.headers[name] = value
+
+class StreamingResponse(object):
+    """
+    A WSGI iterable which removes the database session once it's been
+    sent (or the client goes away).
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.chunks.next()
+
+    def close(self):
+        try:
+            self.chunks.close()
+        finally:
+            meta.Session.remove()
+
+def render_stream(name, streams, chunk_size=100):
+    """
+    Render the template ``name`` a piece at a time, for pages too big
+    to build in memory.
+
+    ``streams`` maps the names of defs in the template to iterables of
+    rows. Wherever the template outputs ``${stream('name')}``, the def
+    ``name`` is called with successive lists of up to ``chunk_size``
+    rows, and each piece of the page is sent as soon as it's rendered.
+
+    Return the result from the controller action.
+    """
+    globs = pylons_globals()
+    template = globs['app_globals'].mako_lookup.get_template(name)
+
+    token = uuid.uuid4().hex
+    globs['stream'] = lambda key: h.literal(u'<!--%s %s-->' % (token, key))
+    pieces = re.split(u'<!--%s (\\w+)-->' % token,
+                      template.render_unicode(**globs))
+
+    def chunks():
+        yield pieces[0].encode('utf-8')
+        for key, text in zip(pieces[1::2], pieces[2::2]):
+            render_rows = template.get_def(key)
+            rows = iter(streams[key])
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                yield render_rows.render_unicode(rows=chunk, **globs).\
+                    encode('utf-8')
+            yield text.encode('utf-8')
+
+    request.environ['bluechips.streaming'] = True
+    return StreamingResponse(chunks())
+
+__all__ = ['c', 'h', 'render', 'render_stream', 'model', 'meta', '_',
+           'ungettext', 'N_', 'BaseController', 'update_sar',
+           'redirect_on_get', 'conditional_get', 'request_ledger_version']
@@ -14,6 +14,8 @@ from webhelpers.html.secure_form import *
 
 from webhelpers.pylonslib import Flash as _Flash
 
+from bluechips.model.types import format_currency
+
 
 def currency(name, value, *args, **kwargs):
     if 'class_' not in kwargs:
@@ -36,4 +38,20 @@ def grab(obj, attr):
         else:
             return ''
 
+def page_url(name, direction, cursor):
+    """
+    Link to the same page with the ``name`` listing moved to the page
+    ``direction`` ('after' or 'before') ``cursor``, leaving any other
+    listings where they are.
+    """
+    params = dict(request.GET)
+    params.pop('%s_after' % name, None)
+    params.pop('%s_before' % name, None)
+    params['%s_%s' % (name, direction)] = cursor
+    routes = request.environ['pylons.routes_dict']
+    return url_for(controller=routes['controller'],
+                   action=routes['action'],
+                   id=routes.get('id'),
+                   **params)
+
 flash = _Flash()
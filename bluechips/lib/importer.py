@@ -0,0 +1,260 @@
+"""
+Import expenditures in bulk from CSV or OFX files
+
+Rows are parsed one at a time and turned into the same fields the
+spend form submits, so they're validated by ExpenditureSchema and
+split with Expenditure.split just like expenditures entered by hand.
+"""
+
+import csv
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from formencode import Invalid
+from sqlalchemy.orm import attributes, eagerload, eagerload_all
+
+from bluechips import model
+from bluechips.lib.schemas import ExpenditureSchema
+from bluechips.model import meta
+
+
+class InvalidImport(Exception):
+    """
+    Raised when an import file has problems; ``errors`` is a list of
+    (line number, error) pairs covering every bad row, where each
+    error is a dict mapping field names to messages.
+    """
+    def __init__(self, errors):
+        Exception.__init__(self, '%d bad rows' % len(errors))
+        self.errors = errors
+
+
+def _form_date(value):
+    "Accept YYYY-MM-DD as well as the form's MM/DD/YYYY."
+    value = value.strip()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%m/%d/%Y')
+    except ValueError:
+        return value
+
+def _decode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def parse_csv(fileobj):
+    """
+    Generate (line number, row) pairs from a CSV file.
+
+    The first row is a header. The date, amount, description, spender
+    (a username) and tags (comma-separated) columns are understood;
+    any other column named after a username holds that user's share,
+    as it would be entered in the spend form.
+    """
+    reader = csv.DictReader(fileobj)
+    for row in reader:
+        row = dict((_decode(key).strip(), _decode(value or ''))
+                   for key, value in row.iteritems() if key is not None)
+        yield reader.line_num, row
+
+
+_ofx_tag = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+def parse_ofx(fileobj):
+    """
+    Generate (line number, row) pairs from the transactions in an OFX
+    statement.
+
+    Both SGML (OFX 1.x) and XML files are read a line at a time, so
+    they don't need to fit in memory. Payments out of the account
+    become positive expenditures; credits (refunds) become negative
+    ones.
+    """
+    transaction = None
+    for line_num, line in enumerate(fileobj):
+        for match in _ofx_tag.finditer(line):
+            closing, tag, value = match.groups()
+            tag = tag.upper()
+            value = value.strip()
+            if tag == 'STMTTRN':
+                if closing:
+                    if transaction is not None:
+                        yield start, _ofx_row(transaction)
+                    transaction = None
+                else:
+                    transaction = {}
+                    start = line_num + 1
+            elif transaction is not None and not closing and value:
+                transaction[tag] = _decode(value)
+
+def _ofx_row(transaction):
+    row = {}
+    try:
+        row['amount'] = unicode(-Decimal(transaction.get('TRNAMT', '')))
+    except InvalidOperation:
+        row['amount'] = transaction.get('TRNAMT', u'')
+    posted = transaction.get('DTPOSTED', u'')[:8]
+    try:
+        posted = datetime.strptime(posted, '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    row['date'] = unicode(posted)
+    description = [transaction[field] for field in ('NAME', 'MEMO')
+                   if transaction.get(field)]
+    row['description'] = u' - '.join(description)
+    return row
+
+
+parsers = {'csv': parse_csv,
+           'ofx': parse_ofx,
+           'qfx': parse_ofx}
+
+
+def _form_fields(row, users, default_spender):
+    """
+    Turn a parsed row into the fields the spend form would have
+    submitted.
+    """
+    fields = {'amount': row.get('amount', u'').strip(),
+              'description': row.get('description', u'').strip(),
+              'date': _form_date(row.get('date', u'')),
+              'tags': row.get('tags', u'')}
+
+    spender = row.get('spender', u'').strip()
+    if spender:
+        if spender not in users:
+            raise Invalid('No such user', spender, None,
+                          error_dict={'spender': 'No such user'})
+        fields['spender_id'] = users[spender].id
+    elif default_spender is not None:
+        fields['spender_id'] = default_spender.id
+    else:
+        fields['spender_id'] = u''
+
+    explicit = [username for username in users if username in row]
+    for ii, (username, user) in enumerate(sorted(users.iteritems())):
+        fields['shares-%d.user_id' % ii] = user.id
+        if explicit:
+            fields['shares-%d.amount' % ii] = row.get(username, u'').strip()
+        else:
+            fields['shares-%d.amount' % ii] = user.resident and u'1' or u''
+    return fields
+
+
+def _save_batch(results, users, tags):
+    """
+    Add the expenditures for a batch of validated rows to the session
+    and flush them, looking up (or creating) any of their tags that
+    aren't already in ``tags`` in one go.
+    """
+    names = set()
+    for result in results:
+        result['tags'] = set(unicode(tag) for tag in result['tags'] or ()
+                             if tag)
+        names |= result['tags']
+    names -= set(tags)
+    if names:
+        tags.update((tag.name, tag) for tag in
+                    meta.Session.query(model.Tag).\
+                        filter(model.Tag.name.in_(names)))
+    for name in names - set(tags):
+        tags[name] = model.Tag(name)
+
+    expenditures = []
+    for result in results:
+        e = model.Expenditure(users[result['spender_id']],
+                              result['amount'], result['description'])
+        if result['date'] is not None:
+            e.date = result['date']
+        meta.Session.add(e)
+        split_dict = {}
+        split_text_dict = {}
+        for share in result['shares']:
+            user = users[share['user_id']]
+            split_text_dict[user], split_dict[user] = \
+                share['amount'] or (u'', Decimal('0'))
+        e.split(split_dict, split_text_dict)
+        e._tags.update(tags[name] for name in result['tags'])
+        expenditures.append(e)
+    meta.Session.flush()
+    return expenditures
+
+
+def import_expenditures(rows, default_spender=None, batch_size=100):
+    """
+    Validate and save expenditures from ``rows``, an iterable of (line
+    number, row) pairs as generated by one of the parsers.
+
+    Rows are validated as they're read, and saved ``batch_size`` at a
+    time, so the file never has to be held in memory. Everything is
+    committed together at the end: if any row is bad, what was saved
+    is rolled back, the remaining rows are still checked, and an
+    InvalidImport listing all of the bad ones is raised.
+
+    Returns the list of new expenditures.
+    """
+    users = dict((user.username, user)
+                 for user in meta.directory.all(meta.Session))
+    users_by_id = dict((user.id, user) for user in users.itervalues())
+    schema = ExpenditureSchema()
+
+    tags = {}
+    batch = []
+    expenditures = []
+    errors = []
+    for line_num, row in rows:
+        try:
+            fields = _form_fields(row, users, default_spender)
+            result = schema.to_python(fields)
+        except Invalid, e:
+            errors.append((line_num, e.unpack_errors()))
+            continue
+        # Once a row is bad nothing will be saved, so just check the rest
+        if not errors:
+            batch.append(result)
+            if len(batch) == batch_size:
+                expenditures.extend(_save_batch(batch, users_by_id, tags))
+                batch = []
+    if errors:
+        meta.Session.rollback()
+        raise InvalidImport(errors)
+
+    if batch:
+        expenditures.extend(_save_batch(batch, users_by_id, tags))
+    meta.Session.commit()
+
+    return expenditures
+
+
+def send_digest(g, expenditures):
+    """
+    Send one email about a whole import to everybody involved in any
+    of ``expenditures``, using the app globals ``g``.
+
+    The expenditures are loaded again, along with their spenders and
+    splits, a few hundred at a time.
+    """
+    if not expenditures:
+        return
+    ids = [attributes.instance_state(e).key[1][0] for e in expenditures]
+    expenditures = []
+    for i in xrange(0, len(ids), 500):
+        expenditures.extend(meta.Session.query(model.Expenditure).\
+            options(eagerload('spender'), eagerload_all('splits.user')).\
+            filter(model.Expenditure.id.in_(ids[i:i + 500])).\
+            order_by(model.Expenditure.id))
+
+    users = set()
+    for e in expenditures:
+        users.add(e.spender)
+        users.update(sp.user for sp in e.splits if sp.share != 0)
+    body = g.mako_lookup.get_template('/emails/import.txt').\
+        render(expenditures=expenditures)
+    g.handle_notification(users, '%d expenditures imported' %
+                          len(expenditures), body)
+
+
+__all__ = ['InvalidImport', 'parse_csv', 'parse_ofx', 'parsers',
+           'import_expenditures', 'send_digest']
@@ -0,0 +1,88 @@
+"""
+Collect notifications into digests
+
+Users who ask for digests don't get an email for every change that
+involves them. Instead, a one-line summary of each change is kept in
+the pending_notifications table, and once the oldest of them has been
+waiting for mailer.digest_window seconds, they're all sent in one
+message along with the user's balance. The outbox worker sends
+digests as it goes (see bluechips.lib.outbox).
+"""
+
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from mailer import Message
+
+from bluechips import model
+from bluechips.lib import outbox
+from bluechips.lib.totals import debts
+from bluechips.model import meta
+from bluechips.model.types import Currency
+
+def queue(session, users, summary):
+    "Save ``summary`` for the next digest sent to each of ``users``."
+    session.execute(model.pending_notifications.insert(),
+                    [dict(user_id=user.id, summary=unicode(summary))
+                     for user in users])
+
+def send_digests(session, lookup, sender, window, now=None):
+    """
+    Queue a digest in the outbox for each user whose oldest pending
+    notification is at least ``window`` seconds old, rendering them
+    with the Mako TemplateLookup ``lookup``. Returns how many were
+    queued.
+    """
+    pending = model.pending_notifications
+    if now is None:
+        now = datetime.utcnow()
+    due = [user_id for (user_id,) in session.execute(sa.select(
+                [pending.c.user_id],
+                group_by=[pending.c.user_id],
+                having=sa.func.min(pending.c.created) <=
+                now - timedelta(seconds=window)))]
+    if not due:
+        return 0
+
+    balances = dict((user.id, balance)
+                    for user, balance in debts().iteritems())
+    template = lookup.get_template('/emails/digest.txt')
+    sent = 0
+    for user_id in due:
+        rows = session.execute(sa.select(
+                [pending.c.id, pending.c.summary],
+                pending.c.user_id == user_id,
+                order_by=[pending.c.id])).fetchall()
+        user = meta.directory.get(session, user_id)
+        if user is not None and user.email:
+            msg = Message(From=sender, To=[user.email])
+            msg.Subject = 'BlueChips: %d %s' % (
+                len(rows), len(rows) == 1 and 'change' or 'changes')
+            msg.Body = template.render(
+                changes=[row.summary for row in rows],
+                balance=balances.get(user_id, Currency(0)))
+            outbox.enqueue(session, msg)
+            sent += 1
+        session.execute(pending.delete().where(sa.and_(
+                    pending.c.user_id == user_id,
+                    pending.c.id <= rows[-1].id)))
+    return sent
+
+def digest_sender(config):
+    """
+    Return a function which queues the digests that are due, for the
+    outbox worker to call before sending mail.
+    """
+    lookup = config['pylons.app_globals'].mako_lookup
+    sender = config.get('mailer.from', 'root@localhost')
+    window = int(config.get('mailer.digest_window', '3600'))
+    def send():
+        try:
+            send_digests(meta.Session, lookup, sender, window)
+            meta.Session.commit()
+        finally:
+            meta.Session.remove()
+    return send
+
+
+__all__ = ['queue', 'send_digests', 'digest_sender']
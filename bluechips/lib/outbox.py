@@ -0,0 +1,315 @@
+"""
+Send notification email from an outbox table, in the background
+
+Requests never talk to the mail server. g.send_message adds each
+message to the outbox table as part of the request's own transaction,
+so it's only sent if the change it describes is committed. An
+OutboxWorker sends it afterwards, either from a thread in the web
+server process (unless mailer.worker is turned off) or from ``paster
+send-mail``.
+
+The worker sends everything that's due over one SMTP connection. A
+message which can't be sent is retried later, waiting twice as long
+after each failure. Once it has failed mailer.max_attempts times, or
+the mail server rejects it outright, it's marked dead and left in the
+table for somebody to look at; ``paster send-mail --retry-dead`` puts
+dead messages back in the queue.
+"""
+
+import logging
+import smtplib
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from paste.deploy.converters import asbool
+
+from bluechips import model
+from bluechips.model import meta
+
+log = logging.getLogger(__name__)
+
+PENDING = u'pending'
+SENDING = u'sending'
+DEAD = u'dead'
+
+# Errors which mean the connection to the mail server is no good, rather
+# than that there's anything wrong with the message being sent
+connection_errors = (socket.error, smtplib.SMTPServerDisconnected,
+                     smtplib.SMTPConnectError, smtplib.SMTPHeloError,
+                     smtplib.SMTPAuthenticationError)
+
+def _permanent(error):
+    "Would retrying the message never get past ``error``?"
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600
+                   for code, message in error.recipients.values())
+    return (isinstance(error, smtplib.SMTPResponseException) and
+            500 <= error.smtp_code < 600)
+
+def _describe(error):
+    return u'%s: %s' % (error.__class__.__name__,
+                        str(error).decode('utf-8', 'replace'))
+
+
+def enqueue(session, msg):
+    """
+    Add ``msg``, a mailer.Message, to the outbox as part of
+    ``session``'s transaction.
+    """
+    if isinstance(msg.To, basestring):
+        recipients = [msg.To]
+    else:
+        recipients = list(msg.To)
+    session.execute(model.outbox.insert().values(
+            sender=unicode(msg.From),
+            recipients=u'\n'.join(unicode(r) for r in recipients),
+            subject=msg.Subject is not None and unicode(msg.Subject) or None,
+            message=msg.as_string().decode('utf-8')))
+
+def retry_dead(session):
+    "Put every dead message back in the queue. Returns how many."
+    outbox = model.outbox
+    return session.execute(outbox.update().
+                           where(outbox.c.status == DEAD).
+                           values(status=PENDING, attempts=0,
+                                  next_attempt=datetime.utcnow())).rowcount
+
+
+class SMTPTransport(object):
+    """
+    Send messages through an SMTP server, connecting when the first
+    one is sent and reusing the connection until close() is called.
+    """
+    def __init__(self, host='localhost', port=0, username=None,
+                 password=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._server = None
+
+    def send(self, sender, recipients, message):
+        if self._server is None:
+            server = smtplib.SMTP(self.host, self.port,
+                                  timeout=self.timeout)
+            if self.username and self.password:
+                server.login(self.username, self.password)
+            self._server = server
+        try:
+            self._server.sendmail(sender, recipients,
+                                  message.encode('utf-8'))
+        except connection_errors:
+            self.close()
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except connection_errors + (smtplib.SMTPException,):
+                pass
+            self._server = None
+
+
+class LogTransport(object):
+    "Log messages instead of sending them, for testing and network_free."
+    def send(self, sender, recipients, message):
+        log.info("From: %s\nTo: %s\n\n%s", sender, ', '.join(recipients),
+                 message)
+
+    def close(self):
+        pass
+
+
+class OutboxWorker(object):
+    """
+    Send messages from the outbox through ``transport``.
+
+    drain() sends everything that's due and returns; start() runs it
+    every ``poll_interval`` seconds in a background thread. If
+    ``collect`` is given, it's called at the start of each drain() to
+    queue any more messages that have come due, like digests.
+    """
+    def __init__(self, transport, batch_size=50, max_attempts=8,
+                 retry_delay=60, poll_interval=10, stale_after=600,
+                 collect=None):
+        self.transport = transport
+        self.collect = collect
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _claim(self, conn, now):
+        outbox = model.outbox
+        # Messages claimed by a worker which died before sending them go
+        # back in the queue
+        conn.execute(outbox.update().
+                     where(sa.and_(outbox.c.status == SENDING,
+                                   outbox.c.next_attempt <
+                                   now - timedelta(seconds=self.stale_after))).
+                     values(status=PENDING))
+
+        rows = conn.execute(sa.select(
+                [outbox], sa.and_(outbox.c.status == PENDING,
+                                  outbox.c.next_attempt <= now),
+                order_by=[outbox.c.id], limit=self.batch_size)).fetchall()
+        claimed = []
+        for row in rows:
+            # Another worker may have got there first
+            if conn.execute(outbox.update().
+                            where(sa.and_(outbox.c.id == row.id,
+                                          outbox.c.status == PENDING)).
+                            values(status=SENDING,
+                                   next_attempt=now)).rowcount == 1:
+                claimed.append(row)
+        return len(rows), claimed
+
+    def _failed(self, conn, row, error, now):
+        "Record a failed attempt, and return when to retry (if ever)."
+        outbox = model.outbox
+        attempts = row.attempts + 1
+        values = dict(attempts=attempts, last_error=_describe(error))
+        if attempts >= self.max_attempts or _permanent(error):
+            log.error('Giving up on mail %d to %s: %s', row.id,
+                      row.recipients.replace(u'\n', u', '), values['last_error'])
+            values.update(status=DEAD)
+            retry = None
+        else:
+            retry = now + timedelta(seconds=self.retry_delay *
+                                    2 ** (attempts - 1))
+            log.warning('Mail %d to %s failed, will retry at %s: %s',
+                        row.id, row.recipients.replace(u'\n', u', '), retry,
+                        values['last_error'])
+            values.update(status=PENDING, next_attempt=retry)
+        conn.execute(outbox.update().where(outbox.c.id == row.id).
+                     values(**values))
+        return retry
+
+    def _send_batch(self, conn, now):
+        """
+        Send one batch of due messages. Returns how many rows were due
+        and how many messages were sent, or None for the second if the
+        connection to the mail server failed.
+        """
+        outbox = model.outbox
+        due, claimed = self._claim(conn, now)
+        sent = 0
+        for i, row in enumerate(claimed):
+            try:
+                self.transport.send(row.sender, row.recipients.split(u'\n'),
+                                    row.message)
+            except connection_errors, e:
+                retry = self._failed(conn, row, e, now) or now
+                # There's no point trying the rest over a broken
+                # connection, so they wait as long as this one does
+                # without it counting against them
+                rest = [r.id for r in claimed[i + 1:]]
+                if rest:
+                    conn.execute(outbox.update().
+                                 where(outbox.c.id.in_(rest)).
+                                 values(status=PENDING, next_attempt=retry))
+                return due, None
+            except smtplib.SMTPException, e:
+                self._failed(conn, row, e, now)
+            else:
+                conn.execute(outbox.delete().where(outbox.c.id == row.id))
+                sent += 1
+        return due, sent
+
+    def drain(self, now=None):
+        "Send every message that's due. Returns how many were sent."
+        if self.collect is not None:
+            self.collect()
+        total = 0
+        conn = meta.engine.connect()
+        try:
+            while True:
+                due, sent = self._send_batch(conn, now or datetime.utcnow())
+                if sent is None:
+                    break
+                total += sent
+                if due < self.batch_size:
+                    break
+        finally:
+            self.transport.close()
+            conn.close()
+        return total
+
+    def _run(self):
+        while not self._stop.isSet():
+            try:
+                self.drain()
+            except Exception:
+                log.exception('Error sending mail from the outbox')
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        "Start draining the outbox in a background thread."
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='bluechips-outbox')
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def transport_from_config(config):
+    "Return the mail transport the mailer.* options describe."
+    if asbool(config.get('testing')) or asbool(config.get('network_free')):
+        return LogTransport()
+    return SMTPTransport(config.get('mailer.host', '127.0.0.1'),
+                         int(config.get('mailer.port', '0')),
+                         config.get('mailer.username'),
+                         config.get('mailer.password'))
+
+def worker_from_config(config):
+    "Return an OutboxWorker set up from the mailer.* options."
+    from bluechips.lib.notifications import digest_sender
+    return OutboxWorker(transport_from_config(config),
+                        batch_size=int(config.get('mailer.batch_size', '50')),
+                        max_attempts=int(config.get('mailer.max_attempts',
+                                                    '8')),
+                        retry_delay=int(config.get('mailer.retry_delay',
+                                                   '60')),
+                        poll_interval=float(config.get('mailer.poll_interval',
+                                                       '10')),
+                        collect=digest_sender(config))
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_worker(config):
+    """
+    Start this process's background OutboxWorker, unless it's already
+    running or mailer.worker is off. Tests never start one.
+    """
+    global _worker
+    if (asbool(config.get('testing')) or
+        not asbool(config.get('mailer.worker', 'true'))):
+        return None
+    _worker_lock.acquire()
+    try:
+        if _worker is None:
+            _worker = worker_from_config(config).start()
+        return _worker
+    finally:
+        _worker_lock.release()
+
+
+__all__ = ['enqueue', 'retry_dead', 'SMTPTransport', 'LogTransport',
+           'OutboxWorker', 'transport_from_config', 'worker_from_config',
+           'start_worker']
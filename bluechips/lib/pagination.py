@@ -0,0 +1,139 @@
+"""
+Page through long listings by key rather than by offset
+
+A page is found by filtering on the sort key of the last row of the
+previous page, so fetching page 100 is as cheap as fetching page 1,
+and rows being added while someone is paging don't shift what they
+see.
+"""
+
+from datetime import date, datetime
+
+import sqlalchemy as sa
+
+
+class Page(object):
+    """
+    One page of a listing.
+
+    Iterating over a Page gives its rows. ``older`` and ``newer`` are
+    cursors for the neighbouring pages, or None at either end.
+    """
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _parse_value(column, value):
+    if isinstance(column.type, sa.types.DateTime):
+        if not value:
+            return None
+        for format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return datetime.strptime(value, format)
+            except ValueError:
+                pass
+        raise ValueError('Bad timestamp %r' % value)
+    elif isinstance(column.type, sa.types.Date):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    else:
+        return int(value)
+
+def format_cursor(values):
+    return ','.join(_format_value(value) for value in values)
+
+def parse_cursor(columns, cursor):
+    """
+    Turn a cursor back into the values of ``columns`` it was made
+    from, raising ValueError if it's malformed.
+    """
+    values = cursor.split(',')
+    if len(values) != len(columns):
+        raise ValueError('Bad cursor %r' % cursor)
+    return [_parse_value(column, value)
+            for column, value in zip(columns, values)]
+
+
+def _beyond(columns, values, older):
+    """
+    Return a clause matching rows which sort strictly after
+    ``values`` in a listing ordered by ``columns``, descending (or
+    strictly before, if not ``older``).
+
+    NULLs sort as the smallest value, as they do in SQLite and MySQL.
+    """
+    column, value = columns[0], values[0]
+    clauses = []
+    if value is None:
+        if not older:
+            clauses.append(column != None)
+        same = column == None
+    else:
+        if older:
+            clauses.append(sa.or_(column < value, column == None))
+        else:
+            clauses.append(column > value)
+        same = column == value
+
+    if len(columns) > 1:
+        clauses.append(sa.and_(same, _beyond(columns[1:], values[1:], older)))
+    return sa.or_(*clauses)
+
+def keyset_page(query, columns, after=None, before=None, page_size=50):
+    """
+    Return a Page from ``query``, ordered by ``columns``, descending.
+
+    The last of ``columns`` must be unique, so that rows never tie.
+    ``after`` and ``before`` are cursors from the ``older`` and
+    ``newer`` attributes of another Page. Without either you get the
+    first (newest) page.
+
+    If ``query`` returns tuples, the sort key is read from the first
+    entity in each.
+    """
+    def key(row):
+        if isinstance(row, tuple):
+            row = row[0]
+        return [getattr(row, column.key) for column in columns]
+
+    query = query.order_by(None)
+    if before is not None:
+        values = parse_cursor(columns, before)
+        rows = query.filter(_beyond(columns, values, older=False)).\
+            order_by(*[column.asc() for column in columns]).\
+            limit(page_size + 1).all()
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        older = rows and format_cursor(key(rows[-1])) or None
+        newer = more and format_cursor(key(rows[0])) or None
+        return Page(rows, older, newer)
+
+    if after is not None:
+        values = parse_cursor(columns, after)
+        query = query.filter(_beyond(columns, values, older=True))
+    rows = query.order_by(*[column.desc() for column in columns]).\
+        limit(page_size + 1).all()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    older = more and format_cursor(key(rows[-1])) or None
+    newer = (after is not None and rows and
+             format_cursor(key(rows[0])) or None)
+    return Page(rows, older, newer)
+
+
+__all__ = ['Page', 'keyset_page', 'format_cursor', 'parse_cursor']
@@ -0,0 +1,60 @@
+"""
+Hash and check users' passwords
+
+Passwords are stored as salted PBKDF2-SHA256 hashes, in the form
+``pbkdf2_sha256$<iterations>$<salt>$<hash>``, so that the work factor
+can be raised later without invalidating existing hashes. Passwords
+stored before hashing was introduced are plain text; they're still
+accepted, and should be rehashed as soon as they've been checked.
+"""
+
+import hmac
+import os
+from base64 import b64encode, b64decode
+from hashlib import pbkdf2_hmac
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = 100000
+SALT_BYTES = 16
+
+def _pbkdf2(password, salt, iterations):
+    return pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+def hash_password(password, iterations=ITERATIONS):
+    "Return a freshly salted hash of ``password``, for storing."
+    salt = os.urandom(SALT_BYTES)
+    return u'%s$%d$%s$%s' % (ALGORITHM, iterations, b64encode(salt),
+                             b64encode(_pbkdf2(password, salt, iterations)))
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(ALGORITHM + '$')
+
+def check_password(password, stored):
+    """
+    Does ``password`` match ``stored``, a value from hash_password (or
+    a plain text password)?
+    """
+    if not stored:
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'),
+                                   stored.encode('utf-8'))
+    try:
+        algorithm, iterations, salt, hashed = stored.split('$')
+        iterations, salt, hashed = int(iterations), b64decode(salt), \
+            b64decode(hashed)
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(_pbkdf2(password, salt, iterations), hashed)
+
+def needs_rehash(stored):
+    "Should ``stored`` be replaced with a new hash_password?"
+    if not is_hashed(stored):
+        return True
+    try:
+        return int(stored.split('$')[1]) < ITERATIONS
+    except (IndexError, ValueError):
+        return True
+
+
+__all__ = ['hash_password', 'check_password', 'needs_rehash']
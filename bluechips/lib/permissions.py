@@ -2,20 +2,27 @@
 authkit authorization permission objects for BlueChips
 """
 
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
 from authkit.authenticate import AddDictToEnviron
 from authkit.authorize import NotAuthenticatedError, NotAuthorizedError
 from authkit.permissions import RequestPermission
 
 from bluechips import model
 from bluechips.model import meta
+from bluechips.lib.passwords import needs_rehash
 
 class BlueChipUser(RequestPermission):
     def check(self, app, environ, start_response):
         if 'REMOTE_USER' not in environ:
             raise NotAuthenticatedError('Not Authenticated') # pragma: nocover
-        environ['user'] = meta.Session.query(model.User).\
-            filter_by(username=unicode(environ['REMOTE_USER'])).\
-            first()
+        environ['user'] = meta.directory.by_username(
+            meta.Session, unicode(environ['REMOTE_USER']))
         if environ['user'] == None:
             raise NotAuthorizedError('You are not allowed access.') # pragma: nocover
         return app(environ, start_response)
@@ -45,9 +52,101 @@ class DummyAuthenticate(AddDictToEnviron):
 
 
 def authenticate(environ, username, password):
-    user = meta.Session.query(model.User).\
-            filter_by(username=unicode(username),
-                      password=unicode(password)).first()
-    return (user is not None)
+    user = meta.directory.by_username(meta.Session, unicode(username))
+    if user is None or not user.check_password(unicode(password)):
+        return False
+    if needs_rehash(user.password):
+        # Upgrade plain text passwords (and old hashes) on the way past
+        user.set_password(unicode(password))
+        meta.Session.commit()
+    return True
+
+
+class CredentialCache(object):
+    """
+    An authenticate function which remembers recently verified
+    credentials, so that password hashes don't have to be checked on
+    every request.
+
+    Credentials are remembered for ``ttl`` seconds, and at most
+    ``size`` of them are kept, dropping the least recently used
+    first. They're keyed on an HMAC of the username and password with
+    a secret that never leaves this process. Each entry also records
+    the password hash it was checked against, and is ignored once the
+    user's password has changed. The hash comes from the user
+    directory, so a hit costs no database queries, and a change made
+    by another process takes effect within users.check_interval
+    seconds.
+    """
+    def __init__(self, check=authenticate, size=1000, ttl=300):
+        self.check = check
+        self.size = size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0)
+
+    def _key(self, username, password):
+        return hmac.new(self._secret,
+                        (u'%s\0%s' % (username, password)).encode('utf-8'),
+                        sha256).digest()
+
+    def _lookup(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > time.time():
+                # Put it back at the most recently used end
+                self._entries[key] = entry
+                return entry[0]
+            return None
+        finally:
+            self._lock.release()
+
+    def _remember(self, key, stored):
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = (stored, time.time() + self.ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        "Forget every remembered credential."
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    def __call__(self, environ, username, password):
+        # This runs in front of everything, static files included, so
+        # nothing else will clean up the session after it
+        try:
+            return self._authenticate(environ, unicode(username),
+                                      unicode(password))
+        finally:
+            meta.Session.remove()
+
+    def _authenticate(self, environ, username, password):
+        key = self._key(username, password)
+        stored = self._lookup(key)
+        if stored is not None:
+            user = meta.directory.by_username(meta.Session, username)
+            if user is not None and user.password == stored:
+                self.stats['hits'] += 1
+                return True
+        self.stats['misses'] += 1
+
+        if not self.check(environ, username, password):
+            return False
+        user = meta.directory.by_username(meta.Session, username)
+        if user is not None:
+            self._remember(key, user.password)
+        return True
 
-__all__ = ['BlueChipUser', 'DummyAuthenticate', 'authenticate']
+__all__ = ['BlueChipUser', 'DummyAuthenticate', 'authenticate',
+           'CredentialCache']
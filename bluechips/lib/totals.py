@@ -4,8 +4,12 @@ Calculate the total state of the books
 
 from bluechips import model
 from bluechips.model import meta
+from bluechips.model.ledger import bump_version, current_version
 
-from bluechips.model.types import Currency
+from bluechips.model.types import Currency, DBCurrency
+
+import heapq
+import time
 
 import sqlalchemy
 
@@ -15,92 +19,490 @@ class DirtyBooks(Exception):
     """
     pass
 
-def debts():
+def debts(as_of=None):
     # In this scheme, negative numbers represent money the house owes
     # the user, and positive numbers represent money the user owes the
     # house
-    users = meta.Session.query(model.User)
+    #
+    # The balances table is kept up to date as the books change (see
+    # bluechips.model.ledger), so this is a single read
+    if as_of is not None:
+        balances = balances_as_of(as_of)
+    else:
+        balances = dict(meta.Session.execute(sqlalchemy.select(
+                    [model.balances.c.user_id,
+                     model.balances.c.balance])).fetchall())
+
+    return dict((user, Currency(balances.get(user.id, 0))) for user in
+                meta.directory.all(meta.Session))
+
+def ledger_version():
+    """
+    Return an (epoch, version) pair which changes whenever the books
+    do, or None if the books have never been written to.
+    """
+    return current_version(meta.Session)
+
+def settlement(strategy='greedy', time_budget=0.05):
+    """
+    Work out everyone's balance and the transfers needed to settle up,
+    in terms of user IDs rather than User objects so that the result
+    can be cached and shared between processes.
+
+    Returns a (debts, transfers) pair: a dict mapping user IDs to
+    cents, and a list of (from ID, to ID, cents) triples.
+    """
+    balances = dict((user_id, 0) for (user_id,) in
+                    meta.Session.execute(sqlalchemy.select(
+                [model.users.c.id])))
+    for user_id, balance in meta.Session.execute(sqlalchemy.select(
+            [model.balances.c.user_id, model.balances.c.balance])):
+        balances[user_id] = int(balance)
     
-    debts_dict = dict((u, Currency(0)) for u in users)
+    if strategy == 'minimal':
+        transfers = settle_minimal(balances, time_budget)
+    else:
+        transfers = settle(balances)
+    return balances, transfers
+
+def ledger_entries(after=None, through=None):
+    """
+    Return a selectable with one (user_id, amount, date) row for every
+    movement of money in the books, optionally limited to those dated
+    after ``after`` and up to and including ``through``.
+
+    Summing amount by user_id gives each user's balance, using the same
+    sign convention as debts().
+    """
+    e = model.expenditures
+    s = model.splits
+    t = model.transfers
+    
+    def dated(select, date_column):
+        if after is not None:
+            select = select.where(date_column > after)
+        if through is not None:
+            select = select.where(date_column <= through)
+        return select
+    
+    return sqlalchemy.union_all(
+        dated(sqlalchemy.select([e.c.spender_id.label('user_id'),
+                                 (0 - e.c.amount).label('amount'),
+                                 e.c.date.label('date')]),
+              e.c.date),
+        dated(sqlalchemy.select([s.c.user_id.label('user_id'),
+                                 s.c.share.label('amount'),
+                                 e.c.date.label('date')],
+                                from_obj=[s.join(e)]),
+              e.c.date),
+        dated(sqlalchemy.select([t.c.debtor_id.label('user_id'),
+                                 (0 - t.c.amount).label('amount'),
+                                 t.c.date.label('date')]),
+              t.c.date),
+        dated(sqlalchemy.select([t.c.creditor_id.label('user_id'),
+                                 t.c.amount.label('amount'),
+                                 t.c.date.label('date')]),
+              t.c.date)).alias('entries')
+
+def compute_balances(after=None, through=None):
+    """
+    Calculate every user's balance from scratch, as a dict mapping
+    user IDs to Currency objects.
+
+    This is a single aggregate over the entire history of the books,
+    so it's only meant for rebuilding or verifying the balances table.
+    If ``after`` or ``through`` are given, only the change in balances
+    over that range of dates is calculated.
+    """
+    balances = dict((user_id, Currency(0)) for (user_id,) in
+                    meta.Session.execute(sqlalchemy.select(
+                [model.users.c.id])))
     
-    # First, credit everyone for expenditures they've made
-    total_expenditures = meta.Session.query(model.Expenditure).\
-        add_column(sqlalchemy.func.sum(model.Expenditure.amount).label('total_spend')).\
-        group_by(model.Expenditure.spender_id)
-    for expenditure, total_spend in total_expenditures:
-        debts_dict[expenditure.spender] -= total_spend
+    entries = ledger_entries(after, through)
+    totals = meta.Session.execute(sqlalchemy.select(
+            [entries.c.user_id, sqlalchemy.func.sum(entries.c.amount)]).\
+            group_by(entries.c.user_id))
+    for user_id, total in totals:
+        balances[user_id] = Currency(total)
     
-    # Next, debit everyone for expenditures that they have an
-    # investment in (i.e. splits)
+    return balances
+
+def balances_as_of(as_of):
+    """
+    Calculate every user's balance at the end of the day ``as_of``, as
+    a dict mapping user IDs to Currency objects.
+
+    This starts from the latest balance checkpoint on or before
+    ``as_of`` and only aggregates what has happened since.
+    """
+    checkpoints = model.balance_checkpoints
+    checkpoint = meta.Session.execute(sqlalchemy.select(
+            [sqlalchemy.func.max(checkpoints.c.date)],
+            checkpoints.c.date <= as_of)).scalar()
     
-    total_splits = meta.Session.query(model.Split).\
-        add_column(sqlalchemy.func.sum(model.Split.share).label('total_split')).\
-        group_by(model.Split.user_id)
+    balances = compute_balances(after=checkpoint, through=as_of)
+    if checkpoint is not None:
+        for user_id, balance in meta.Session.execute(sqlalchemy.select(
+                [checkpoints.c.user_id, checkpoints.c.balance],
+                checkpoints.c.date == checkpoint)):
+            balances[user_id] = Currency(balances.get(user_id, 0) + balance)
+    return balances
+
+def create_checkpoint(date):
+    """
+    Record everyone's balance as of the end of ``date``, replacing any
+    existing checkpoint for that day.
+
+    The caller is responsible for committing.
+    """
+    checkpoints = model.balance_checkpoints
+    meta.Session.execute(checkpoints.delete().\
+                             where(checkpoints.c.date == date))
+    balances = balances_as_of(date)
+    for user_id, balance in balances.iteritems():
+        meta.Session.execute(checkpoints.insert().\
+                                 values(date=date, user_id=user_id,
+                                        balance=balance))
+
+def balance_history(user_id=None, chunk_size=1000):
+    """
+    Generate each user's running balance over time, as (date, user ID,
+    balance) triples in date order: one for every day on which a user's
+    balance changed, giving their balance at the end of that day.
+
+    This is a single streaming pass over every entry in the books, so
+    memory use doesn't grow with the size of the history.
+    """
+    entries = ledger_entries()
+    q = meta.Session.query(entries.c.date, entries.c.user_id,
+                           entries.c.amount).\
+        order_by(entries.c.date)
+    if user_id is not None:
+        q = q.filter(entries.c.user_id == user_id)
     
-    for split, total_cents in total_splits:
-        debts_dict[split.user] += total_cents
+    balances = {}
+    changed = set()
+    current = None
+    for date, entry_user_id, amount in q.yield_per(chunk_size):
+        if date != current:
+            for changed_id in sorted(changed):
+                yield current, changed_id, Currency(balances[changed_id])
+            changed.clear()
+            current = date
+        balances[entry_user_id] = balances.get(entry_user_id, 0) + amount
+        changed.add(entry_user_id)
+    for changed_id in sorted(changed):
+        yield current, changed_id, Currency(balances[changed_id])
+
+def with_shares(query, user, only_involved=False):
+    """
+    Add two columns to ``query``, a query for Expenditures: ``user``'s
+    share of each expenditure, and whether they're involved in it at
+    all (i.e. paid for it or have a non-zero share).
+
+    Both come from a single outer join on the splits table, so listing
+    expenditures doesn't have to load their splits. With
+    ``only_involved``, expenditures ``user`` isn't involved in are
+    left out.
+    """
+    expenditures = model.expenditures
+    my_splits = model.splits.alias('my_splits')
+    involved = sqlalchemy.or_(expenditures.c.spender_id == user.id,
+                              my_splits.c.share != 0)
     
-    # Finally, move transfers around appropriately
-    #
-    # To keep this from getting to be expensive, have SQL sum up
-    # transfers for us
+    query = query.outerjoin((my_splits, sqlalchemy.and_(
+                my_splits.c.expenditure_id == expenditures.c.id,
+                my_splits.c.user_id == user.id))).\
+        add_column(sqlalchemy.func.coalesce(my_splits.c.share, 0,
+                                            type_=DBCurrency).label('share')).\
+        add_column(sqlalchemy.case([(involved, True)],
+                                   else_=False).label('involved'))
+    if only_involved:
+        query = query.filter(involved)
+    return query
+
+def period_totals(periods, user):
+    """
+    Total up everyone's expenditures, and ``user``'s share of them,
+    over several periods at once.
+
+    ``periods`` is a sequence of (name, start, end) triples, covering
+    dates from ``start`` up to but not including ``end``; either may
+    be None to leave that end open. Returns a dict mapping each name
+    to a dict of Currency totals with keys 'all' and 'mine'.
+
+    However many periods there are, this is one query: each total is
+    a SUM(CASE ...) column over a single pass of the expenditures
+    outer-joined to ``user``'s splits.
+    """
+    expenditures = model.expenditures
+    my_splits = model.splits.alias('my_splits')
+    scopes = (('all', expenditures.c.amount),
+              ('mine', sqlalchemy.func.coalesce(my_splits.c.share, 0)))
+    
+    columns = []
+    for name, start, end in periods:
+        conds = []
+        if start is not None:
+            conds.append(expenditures.c.date >= start)
+        if end is not None:
+            conds.append(expenditures.c.date < end)
+        for scope, value in scopes:
+            if conds:
+                value = sqlalchemy.case([(sqlalchemy.and_(*conds), value)],
+                                        else_=0)
+            columns.append(sqlalchemy.func.sum(value))
+    
+    joined = expenditures.outerjoin(my_splits, sqlalchemy.and_(
+            my_splits.c.expenditure_id == expenditures.c.id,
+            my_splits.c.user_id == user.id))
+    row = meta.Session.execute(sqlalchemy.select(columns,
+                                                 from_obj=[joined])).fetchone()
+    
+    totals = {}
+    values = iter(row)
+    for name, start, end in periods:
+        totals[name] = dict((scope, Currency(values.next()))
+                            for scope, value in scopes)
+    return totals
+
+def tag_totals(user, tag_ids=None):
+    """
+    Total up the expenditures with each tag, along with ``user``'s
+    share of them, in one grouped query.
+
+    Returns a dict mapping tag IDs to (total, share) pairs. Pass
+    ``tag_ids`` to only total up those tags; tags with no expenditures
+    are left out.
+    """
+    tag_map = model.tag_to_expense_map
+    expenditures = model.expenditures
+    my_splits = model.splits.alias('my_splits')
     
-    transfer_q = meta.Session.query(model.Transfer).\
-        add_column(sqlalchemy.func.sum(model.Transfer.amount).label('total_amount'))
-    total_debits = transfer_q.group_by(model.Transfer.debtor_id)
-    total_credits = transfer_q.group_by(model.Transfer.creditor_id)
+    joined = tag_map.join(expenditures,
+                          tag_map.c.expenditure_id == expenditures.c.id).\
+        outerjoin(my_splits, sqlalchemy.and_(
+            my_splits.c.expenditure_id == expenditures.c.id,
+            my_splits.c.user_id == user.id))
+    query = sqlalchemy.select(
+        [tag_map.c.tag_id,
+         sqlalchemy.func.sum(expenditures.c.amount),
+         sqlalchemy.func.sum(sqlalchemy.func.coalesce(my_splits.c.share, 0,
+                                                      type_=DBCurrency))],
+        from_obj=[joined]).group_by(tag_map.c.tag_id)
+    if tag_ids is not None:
+        query = query.where(tag_map.c.tag_id.in_(tag_ids))
     
-    for transfer, total_amount in total_debits:
-        debts_dict[transfer.debtor] -= total_amount
-    for transfer, total_amount in total_credits:
-        debts_dict[transfer.creditor] += total_amount
+    return dict((tag_id, (Currency(total), Currency(share)))
+                for tag_id, total, share in meta.Session.execute(query))
+
+def verify_balances():
+    """
+    Compare the balances table against a from-scratch calculation.
+
+    Returns a dict mapping user IDs to (stored, computed) pairs for
+    every user whose stored balance is wrong.
+    """
+    stored = dict(meta.Session.query(model.Balance.user_id,
+                                     model.Balance.balance))
+    computed = compute_balances()
     
-    return debts_dict
+    mismatches = {}
+    for user_id in set(stored) | set(computed):
+        have = Currency(stored.get(user_id, 0))
+        want = Currency(computed.get(user_id, 0))
+        if have != want:
+            mismatches[user_id] = (have, want)
+    return mismatches
+
+def rebuild_balances():
+    """
+    Throw away the balances table and recreate it from scratch.
+
+    This also bumps the ledger version, creating the ledger row if
+    it's missing. The caller is responsible for committing.
+    """
+    meta.Session.execute(model.balances.delete())
+    for user_id, balance in compute_balances().iteritems():
+        meta.Session.execute(model.balances.insert().\
+                                 values(user_id=user_id, balance=balance))
+    bump_version(meta.Session)
 
 def settle(debts_dict):
     # This algorithm has been shamelessly stolen from Nelson Elhage's
     # <nelhage@mit.edu> implementation for our 2008 summer apartment.
+    #
+    # At each step, whoever owes the most pays whoever is owed the
+    # most. Rather than re-sorting both lists every time, each side is
+    # kept in a heap ordered by (largest amount, tie-breaker).
+    #
+    # The tie-breaker reproduces the order a stable re-sort would
+    # give: people are initially ranked in the order they came out of
+    # debts_dict, and someone whose balance was just reduced jumps
+    # ahead of everyone else with the same balance.
     
-    debts_list = [dict(who=user, amount=amount) for user, amount in \
-                      debts_dict.iteritems()]
-    #debts_list.sort(reverse=True, key=(lambda x: abs(x['amount'])))
-    
-    owes_list = [debt for debt in debts_list if debt['amount'] > 0]
-    owed_list = [debt for debt in debts_list if debt['amount'] < 0]
+    owes_heap = []
+    owed_heap = []
+    for user, amount in debts_dict.iteritems():
+        if amount > 0:
+            owes_heap.append((-abs(amount), len(owes_heap), user, amount))
+        elif amount < 0:
+            owed_heap.append((-abs(amount), len(owed_heap), user, amount))
+    heapq.heapify(owes_heap)
+    heapq.heapify(owed_heap)
     
     settle_list = []
+    rank = 0
     
-    while len(owes_list) > 0 and len(owed_list) > 0:
-        owes_list.sort(reverse=True, key=(lambda x: abs(x['amount'])))
-        owed_list.sort(reverse=True, key=(lambda x: abs(x['amount'])))
-
-        owes = owes_list[0]
-        owed = owed_list[0]
+    while len(owes_heap) > 0 and len(owed_heap) > 0:
+        owes_who, owes_amount = owes_heap[0][2:]
+        owed_who, owed_amount = owed_heap[0][2:]
         
-        sum = owes['amount'] + owed['amount']
-        if sum == 0:
+        total = owes_amount + owed_amount
+        rank -= 1
+        if total == 0:
             # Perfect balance!
-            owes_list.pop(0)
-            owed_list.pop(0)
-            val = owes['amount']
-        elif sum > 0:
+            heapq.heappop(owes_heap)
+            heapq.heappop(owed_heap)
+            val = owes_amount
+        elif total > 0:
             # person in owes still owes money
-            owes['amount'] += owed['amount']
-            owed_list.pop(0)
-            val = -owed['amount']
+            heapq.heapreplace(owes_heap, (-abs(total), rank, owes_who, total))
+            heapq.heappop(owed_heap)
+            val = -owed_amount
         else:
             # person in owed is owed more than owes has to give
-            owed['amount'] += owes['amount']
-            owes_list.pop(0)
-            val = owes['amount']
+            heapq.heapreplace(owed_heap, (-abs(total), rank, owed_who, total))
+            heapq.heappop(owes_heap)
+            val = owes_amount
         
-        settle_list.append((owes['who'], owed['who'], val))
+        settle_list.append((owes_who, owed_who, val))
     
-    if len(owes_list) > 0:
-        raise DirtyBooks, ("People still owe money", owes_list)
-    if len(owed_list) > 0:
-        raise DirtyBooks, ("People are still owed money", owed_list)
+    if len(owes_heap) > 0:
+        raise DirtyBooks, ("People still owe money",
+                           [dict(who=who, amount=amount) for
+                            _, _, who, amount in sorted(owes_heap)])
+    if len(owed_heap) > 0:
+        raise DirtyBooks, ("People are still owed money",
+                           [dict(who=who, amount=amount) for
+                            _, _, who, amount in sorted(owed_heap)])
     
     return settle_list
 
-__all__ = ['debts', 'settle']
+class _OutOfTime(Exception):
+    pass
+
+def _smallest_zero_sum(people, deadline):
+    """
+    Find the smallest non-empty proper subset of ``people`` (a list of
+    (who, amount) pairs which sums to zero) whose amounts also sum to
+    zero. Returns a set of indices into ``people``, or None.
+
+    Raises _OutOfTime if ``deadline`` passes before the search is done.
+    """
+    if time.time() > deadline:
+        raise _OutOfTime()
+    
+    n = len(people)
+    amounts = [amount for who, amount in people]
+    
+    # Pairs and triples are by far the most common, and can be found
+    # with a hash lookup
+    seen = {}
+    for i, amount in enumerate(amounts):
+        if -amount in seen:
+            return set([seen[-amount], i])
+        seen.setdefault(amount, i)
+    if n > 3:
+        for i in xrange(n):
+            if time.time() > deadline:
+                raise _OutOfTime()
+            for j in xrange(i + 1, n):
+                k = seen.get(-(amounts[i] + amounts[j]))
+                if k is not None and k != i and k != j:
+                    return set([i, j, k])
+    
+    # Otherwise, meet in the middle: tabulate the smallest subset of
+    # each half for every achievable sum, then look for halves which
+    # cancel out. The empty subset keeps the zero slot, so the smallest
+    # non-empty subset of a half which cancels out on its own is kept
+    # to one side.
+    def subset_sums(indices):
+        sums = {0: ()}
+        zero = None
+        for i in indices:
+            for count, (total, subset) in enumerate(sums.items()):
+                if count % 1024 == 0 and time.time() > deadline:
+                    raise _OutOfTime()
+                new_total = total + amounts[i]
+                new_subset = subset + (i,)
+                if new_total == 0:
+                    if zero is None or len(zero) > len(new_subset):
+                        zero = new_subset
+                elif (new_total not in sums or
+                      len(sums[new_total]) > len(new_subset)):
+                    sums[new_total] = new_subset
+        return sums, zero
+    
+    left, left_zero = subset_sums(range(n // 2))
+    right, right_zero = subset_sums(range(n // 2, n))
+    best = None
+    for candidate in (left_zero, right_zero):
+        if candidate is not None and (best is None or
+                                      len(candidate) < len(best)):
+            best = candidate
+    for total, subset in left.iteritems():
+        if -total in right:
+            candidate = subset + right[-total]
+            if 0 < len(candidate) < n and (best is None or
+                                           len(candidate) < len(best)):
+                best = candidate
+    if best is None:
+        return None
+    return set(best)
+
+def settle_minimal(debts_dict, time_budget=0.05):
+    """
+    Settle the books with as few transfers as we can find in
+    ``time_budget`` seconds.
+
+    Everyone is first partitioned into as many groups as possible that
+    owe each other exactly nothing overall, and each group is settled
+    on its own; n people in k such groups need at most n - k
+    transfers. If the search runs out of time, whatever is left over is
+    settled as a single group. The plain greedy result from settle() is
+    returned instead whenever it isn't beaten.
+    """
+    greedy = settle(debts_dict)
+    deadline = time.time() + time_budget
+    
+    remaining = [(who, amount) for who, amount in debts_dict.iteritems()
+                 if amount != 0]
+    groups = []
+    try:
+        while len(remaining) > 3:
+            subset = _smallest_zero_sum(remaining, deadline)
+            if subset is None:
+                break
+            groups.append([remaining[i] for i in sorted(subset)])
+            remaining = [person for i, person in enumerate(remaining)
+                         if i not in subset]
+    except _OutOfTime:
+        pass
+    groups.append(remaining)
+    
+    settle_list = []
+    for group in groups:
+        settle_list.extend(settle(dict(group)))
+    
+    if len(settle_list) < len(greedy):
+        return settle_list
+    else:
+        return greedy
+
+settle_strategies = {'greedy': settle,
+                     'minimal': settle_minimal}
+
+__all__ = ['balance_history', 'debts', 'settle', 'settle_minimal',
+           'settle_strategies', 'settlement', 'ledger_version',
+           'period_totals', 'tag_totals', 'with_shares']
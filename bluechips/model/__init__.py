@@ -8,16 +8,33 @@ from bluechips.model.split import Split
 from bluechips.model.subitem import Subitem
 from bluechips.model.transfer import Transfer
 from bluechips.model.tag import Tag
+from bluechips.model.balance import Balance
 
 from bluechips.model import meta
 from bluechips.model import types
+from bluechips.model.ledger import LedgerExtension
+from bluechips.model.rollup import RollupExtension
+from bluechips.model.search import SearchExtension, get_backend
+from bluechips.model.directory import UserDirectory, UserDirectoryExtension
 
 from datetime import datetime
 
-def init_model(engine):
-    """Call me before using any of the tables or classes in the model"""
+def init_model(engine, search_backend=None, users_check_interval=1):
+    """Call me before using any of the tables or classes in the model
 
-    sm = orm.sessionmaker(autoflush=True, bind=engine)
+    ``search_backend`` names the full-text search backend to use; see
+    bluechips.model.search. ``users_check_interval`` is how often, in
+    seconds, the user directory checks for changes made by other
+    processes; see bluechips.model.directory.
+    """
+
+    meta.search = get_backend(search_backend, engine)
+    meta.directory = UserDirectory(users_check_interval)
+    sm = orm.sessionmaker(autoflush=True, bind=engine,
+                          extension=[LedgerExtension(),
+                                     RollupExtension(),
+                                     SearchExtension(meta.search),
+                                     UserDirectoryExtension(meta.directory)])
 
     meta.engine = engine
     meta.Session = orm.scoped_session(sm)
@@ -30,7 +47,8 @@ users = sa.Table('users', meta.metadata,
                  sa.Column('name', sa.types.Unicode(64)),
                  sa.Column('resident', sa.types.Boolean, default=True),
                  sa.Column('email', sa.types.Unicode(64)),
-                 sa.Column('password', sa.types.Unicode(64)),
+                 sa.Column('password', sa.types.Unicode(128)),
+                 sa.Column('digest', sa.types.Boolean, default=False),
                  )
 
 expenditures = sa.Table('expenditures', meta.metadata,
@@ -64,7 +82,7 @@ tag_to_expense_map = sa.Table('tag_to_expense_map', meta.metadata,
                                         primary_key=True),
                               sa.Column('expenditure_id', sa.types.Integer,
                                         sa.ForeignKey('expenditures.id'),
-                                        primary_key=True))
+                                        primary_key=True, index=True))
 
 subitems = sa.Table('subitems', meta.metadata,
                     sa.Column('id', sa.types.Integer, primary_key=True),
@@ -88,6 +106,77 @@ transfers = sa.Table('transfers', meta.metadata,
                                default=datetime.utcnow)
                      )
 
+balances = sa.Table('balances', meta.metadata,
+                    sa.Column('user_id', sa.types.Integer,
+                              sa.ForeignKey('users.id'), primary_key=True),
+                    sa.Column('balance', types.DBCurrency, nullable=False,
+                              default=0)
+                    )
+
+balance_checkpoints = sa.Table('balance_checkpoints', meta.metadata,
+                               sa.Column('date', sa.types.Date,
+                                         primary_key=True),
+                               sa.Column('user_id', sa.types.Integer,
+                                         sa.ForeignKey('users.id'),
+                                         primary_key=True),
+                               sa.Column('balance', types.DBCurrency,
+                                         nullable=False)
+                               )
+
+ledger = sa.Table('ledger', meta.metadata,
+                  sa.Column('id', sa.types.Integer, primary_key=True),
+                  sa.Column('epoch', sa.types.Unicode(32), nullable=False),
+                  sa.Column('version', sa.types.Integer, nullable=False,
+                            default=0),
+                  sa.Column('users_version', sa.types.Integer, default=0)
+                  )
+
+tag_month_rollup = sa.Table('tag_month_rollup', meta.metadata,
+                            sa.Column('tag_id', sa.types.Integer,
+                                      sa.ForeignKey('tags.id'),
+                                      primary_key=True),
+                            sa.Column('month', sa.types.Date,
+                                      primary_key=True),
+                            sa.Column('user_id', sa.types.Integer,
+                                      sa.ForeignKey('users.id'),
+                                      primary_key=True),
+                            sa.Column('share', types.DBCurrency,
+                                      nullable=False, default=0),
+                            sa.Column('paid', types.DBCurrency,
+                                      nullable=False, default=0)
+                            )
+
+outbox = sa.Table('outbox', meta.metadata,
+                  sa.Column('id', sa.types.Integer, primary_key=True),
+                  sa.Column('created', sa.types.DateTime, nullable=False,
+                            default=datetime.utcnow),
+                  sa.Column('sender', sa.types.Unicode(64), nullable=False),
+                  sa.Column('recipients', sa.types.UnicodeText,
+                            nullable=False),
+                  sa.Column('subject', sa.types.UnicodeText),
+                  sa.Column('message', sa.types.UnicodeText, nullable=False),
+                  sa.Column('status', sa.types.Unicode(16), nullable=False,
+                            default=u'pending'),
+                  sa.Column('attempts', sa.types.Integer, nullable=False,
+                            default=0),
+                  sa.Column('next_attempt', sa.types.DateTime, nullable=False,
+                            default=datetime.utcnow, index=True),
+                  sa.Column('last_error', sa.types.UnicodeText)
+                  )
+
+pending_notifications = sa.Table('pending_notifications', meta.metadata,
+                                sa.Column('id', sa.types.Integer,
+                                          primary_key=True),
+                                sa.Column('user_id', sa.types.Integer,
+                                          sa.ForeignKey('users.id'),
+                                          nullable=False, index=True),
+                                sa.Column('created', sa.types.DateTime,
+                                          nullable=False,
+                                          default=datetime.utcnow),
+                                sa.Column('summary', sa.types.UnicodeText,
+                                          nullable=False)
+                                )
+
 ### DB/Class Mapping ###
 
 orm.mapper(User, users,
@@ -101,8 +190,10 @@ orm.mapper(Expenditure, expenditures,
            properties={
         'splits': orm.relation(Split, backref='expenditure',
                                cascade='all, delete'),
+        # Tags are shared, so deleting an expenditure mustn't delete
+        # them; prune_tags clears out the ones left unused
         '_tags': orm.relation(Tag, secondary=tag_to_expense_map,
-                             collection_class=set, cascade='all, delete'),
+                             collection_class=set),
         'subitems': orm.relation(Subitem, backref='expenditure',
                                  cascade='all, delete')
 })
@@ -129,6 +220,12 @@ orm.mapper(Transfer, transfers,
                                                   users.c.id))
 })
 
+orm.mapper(Balance, balances, properties={
+        'user': orm.relation(User)
+})
+
 __all__ = ['users', 'expenditures', 'splits', 'tags', 'subitems', 'transfers',
+           'balances', 'balance_checkpoints', 'ledger', 'tag_month_rollup',
+           'outbox', 'pending_notifications',
            'User', 'Expenditure', 'Split', 'Tag', 'Subitem', 'Transfer',
-           'meta']
+           'Balance', 'meta']
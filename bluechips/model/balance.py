@@ -0,0 +1,12 @@
+from types import Currency
+
+class Balance(object):
+    def __init__(self, user=None, balance=Currency(0)):
+        self.user = user
+        self.balance = balance
+
+    def __repr__(self):
+        return '<Balance: user: %s balance: %s>' % (self.user,
+                                                    self.balance)
+
+__all__ = ['Balance']
@@ -0,0 +1,178 @@
+"""
+An in-process cache of the users table.
+
+There are only ever a handful of users and they hardly ever change,
+but nearly every request looks them up, often several times over.
+UserDirectory loads them all once, and hands out copies merged into
+the caller's session without going back to the database. Because the
+copies sit in the session's identity map, lazy loads of an
+expenditure's spender or a transfer's debtor find them there too.
+
+Every write to the users table bumps ledger.users_version, and
+UserDirectoryExtension throws the cache away as soon as such a write
+commits in this process. Changes made by other processes are noticed
+by checking users_version, which is done at most once every
+``check_interval`` seconds; looking up an ID or username that isn't
+cached checks straight away, so new users are found immediately.
+"""
+
+import threading
+import time
+
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from bluechips.model.user import User
+from bluechips.model.ledger import bump_version, current_version
+from bluechips.model import meta
+
+
+def _attach(session, user):
+    # Users the session already has are left alone, rather than merged,
+    # so that changes it hasn't flushed yet aren't overwritten
+    key = session.identity_key(instance=user)
+    if key in session.identity_map:
+        return session.identity_map[key]
+    return session.merge(user, dont_load=True)
+
+
+class UserDirectory(object):
+    """
+    Every user, loaded once and kept until the users table changes.
+
+    Lookups are counted as hits or misses in ``stats``.
+    """
+    def __init__(self, check_interval=1):
+        self.check_interval = check_interval
+        self._users = None
+        self._index = {}
+        self._version = None
+        self._checked = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0)
+
+    def _load(self):
+        # Load with a session of our own, so that the cached users are
+        # never attached to (or expired along with) anybody's request
+        session = meta.Session.session_factory()
+        try:
+            return session.query(User).order_by(User.id).all()
+        finally:
+            session.close()
+
+    def _cached(self, session, recheck=False):
+        """
+        Return the cached users and a dict mapping each of 'id' and
+        'username' to a dict of them by that attribute, checking that
+        they're up to date if ``recheck`` is set or they haven't been
+        checked for ``check_interval`` seconds.
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if (self._users is not None and not recheck and
+                now - self._checked < self.check_interval):
+                self.stats['hits'] += 1
+                return self._users, self._index
+            generation = self._generation
+        finally:
+            self._lock.release()
+
+        version = current_version(session, 'users_version')
+
+        self._lock.acquire()
+        try:
+            if self._users is not None and self._version == version:
+                self._checked = now
+                self.stats['hits'] += 1
+                return self._users, self._index
+            self.stats['misses'] += 1
+        finally:
+            self._lock.release()
+
+        users = self._load()
+        index = dict((attr, dict((getattr(user, attr), user)
+                                 for user in users))
+                     for attr in ('id', 'username'))
+
+        self._lock.acquire()
+        try:
+            # Don't keep what we loaded if it was invalidated while we
+            # were loading it
+            if self._generation == generation:
+                self._users = users
+                self._index = index
+                self._version = version
+                self._checked = now
+        finally:
+            self._lock.release()
+        return users, index
+
+    def _lookup(self, session, attr, value):
+        user = self._cached(session)[1][attr].get(value)
+        if user is None:
+            # It may have been added since we last checked
+            user = self._cached(session, recheck=True)[1][attr].get(value)
+        return user is not None and _attach(session, user) or None
+
+    def invalidate(self):
+        "Throw away the cached users."
+        self._lock.acquire()
+        try:
+            self._users = None
+            self._version = None
+            self._generation += 1
+        finally:
+            self._lock.release()
+
+    def all(self, session):
+        "Return every user, in order of ID, as members of ``session``."
+        return [_attach(session, user) for user in self._cached(session)[0]]
+
+    def items(self, session):
+        "Return (ID, user) pairs for every user, in order of ID."
+        return [(user.id, user) for user in self.all(session)]
+
+    def get(self, session, id):
+        "Return the user with the given ID, or None."
+        return self._lookup(session, 'id', id)
+
+    def by_username(self, session, username):
+        "Return the user with the given username, or None."
+        return self._lookup(session, 'username', username)
+
+    def residents(self, session):
+        "Return the resident users, in order of ID."
+        return [_attach(session, user) for user in self._cached(session)[0]
+                if user.resident]
+
+
+class UserDirectoryExtension(SessionExtension):
+    """
+    Session extension which bumps ledger.users_version whenever the
+    users table is written to, and invalidates a UserDirectory when
+    the transaction commits.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._changed = set()
+
+    def after_flush(self, session, flush_context):
+        if ([obj for obj in list(session.new) + list(session.deleted)
+             if isinstance(obj, User)] or
+            [obj for obj in session.dirty
+             if (isinstance(obj, User) and
+                 session.is_modified(obj, include_collections=False))]):
+            bump_version(session, 'users_version')
+            self._changed.add(session)
+
+    def after_commit(self, session):
+        if session in self._changed:
+            self._changed.discard(session)
+            self.directory.invalidate()
+
+    def after_rollback(self, session):
+        self._changed.discard(session)
+
+
+__all__ = ['UserDirectory', 'UserDirectoryExtension']
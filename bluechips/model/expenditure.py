@@ -1,13 +1,14 @@
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes, class_mapper
 from sqlalchemy.ext.associationproxy import association_proxy
 
-from bluechips.model.user import User
 from bluechips.model.split import Split
 from bluechips.model import meta
 from bluechips.model.types import Currency
 from bluechips.model.tag import create_tag
+from bluechips.lib.allocation import largest_remainder
 from decimal import Decimal
 from datetime import datetime
-import random
 
 class Expenditure(object):
     def __init__(self, spender=None, amount=Currency(0), description=u"",
@@ -24,16 +25,18 @@ class Expenditure(object):
         return '<Expenditure: spender: %s spent: %s>' % (self.spender,
                                                          self.amount)
 
-    def even_split(self):
+    def even_split(self, seed=None):
         """
         Split up an expenditure evenly among the resident users
         """
         
-        residents = meta.Session.query(User).filter(User.resident==True)
-        split_percentage = Decimal(100) / Decimal(residents.count())
-        self.split(dict((resident, split_percentage) for resident in residents))
+        residents = meta.directory.residents(meta.Session)
+        split_percentage = Decimal(100) / Decimal(len(residents))
+        self.split(dict((resident, split_percentage)
+                        for resident in residents), seed=seed)
     
-    def split(self, split_dict, split_text_dict):
+    def split(self, split_dict, split_text_dict=None, seed=None,
+              allocate=largest_remainder):
         """
         Split up an expenditure.
         
@@ -43,41 +46,123 @@ class Expenditure(object):
         
         Percentages will be normalized to sum to 100%.
         
-        If the split leaks or gains money due to rounding errors, the
-        pennies will be randomly distributed to one of the users.
+        split_text_dict optionally maps the same users to the text
+        they entered for their share; it defaults to the amount of
+        their share in dollars.
+        
+        The shares are worked out in whole cents by ``allocate``
+        (largest_remainder unless you say otherwise), which is passed
+        the amount, a list of (user, percentage) pairs and ``seed``,
+        and decides where the pennies lost to rounding go.
         
         I mean, come on. You're already living together. Are you really
         going to squabble over a few pennies?
         """
         
-        map(meta.Session.delete, meta.Session.query(Split).\
-                filter_by(expenditure_id=self.id))
+        # Users are put in a fixed order so that seeded allocations
+        # are reproducible. Users with a zero share don't get a split
+        # at all.
+        weights = sorted(split_dict.iteritems(),
+                         key=lambda (user, share): user.id)
+        new_splits = []
+        for user, share in allocate(self.amount, weights, seed):
+            if split_dict[user] == 0:
+                continue
+            if split_text_dict is None:
+                share_text = unicode(Decimal(int(share)) / 100)
+            else:
+                share_text = split_text_dict[user]
+            new_splits.append((user, share, share_text))
+        
+        if attributes.instance_state(self).key is None:
+            # Nothing's been saved yet, so there's nothing to compare to
+            for user, share, share_text in new_splits:
+                meta.Session.add(Split(self, user, share, share_text))
+        else:
+            self._save_splits(new_splits)
+    
+    def _save_splits(self, new_splits):
+        """
+        Bring the stored splits into line with ``new_splits``, a list
+        of (user, share, share_text) triples.
+        
+        Rather than replacing every split, this compares them with
+        what's in the database and only touches the rows which need
+        to change, using one statement each for all of the deletes,
+        updates and inserts.
+        
+        Those statements go around the ORM, so they have to do the
+        bookkeeping that LedgerExtension and RollupExtension would
+        otherwise have done.
+        """
+        from bluechips.model.ledger import (adjust_balances, bump_version,
+                                            invalidate_checkpoints)
+        from bluechips.model.rollup import refresh_rollup, rollup_buckets
         
-        total = sum(split_dict.itervalues())
+        splits = class_mapper(Split).local_table
+        session = meta.Session()
         
-        for user, share in split_dict.items():
-            if share == 0:
-                del split_dict[user]
-            
-        amounts_dict = dict()
+        old = dict((user_id, (split_id, share, share_text))
+                   for split_id, user_id, share, share_text in
+                   session.execute(sa.select([splits.c.id, splits.c.user_id,
+                                              splits.c.share,
+                                              splits.c.share_text],
+                                             splits.c.expenditure_id ==
+                                             self.id)))
         
-        for user, share in split_dict.iteritems():
-            amounts_dict[user] = Currency((share * self.amount) / total)
+        deltas = {}
+        inserts = []
+        updates = []
+        for user, share, share_text in new_splits:
+            if user.id not in old:
+                inserts.append(dict(expenditure_id=self.id, user_id=user.id,
+                                    share=int(share), share_text=share_text))
+                deltas[user.id] = int(share)
+                continue
+            split_id, old_share, old_text = old.pop(user.id)
+            if share != old_share or share_text != old_text:
+                updates.append(dict(_id=split_id, _share=int(share),
+                                    _share_text=share_text))
+                deltas[user.id] = int(share) - int(old_share)
+        deletes = []
+        for user_id, (split_id, old_share, old_text) in old.iteritems():
+            deletes.append(split_id)
+            deltas[user_id] = -int(old_share)
         
-        difference = self.amount - sum(amounts_dict.itervalues())
+        if deletes:
+            session.execute(splits.delete().where(splits.c.id.in_(deletes)))
+        if updates:
+            session.execute(splits.update().\
+                    where(splits.c.id == sa.bindparam('_id')).\
+                    values(share=sa.bindparam('_share'),
+                           share_text=sa.bindparam('_share_text')),
+                            updates)
+        if inserts:
+            session.execute(splits.insert(), inserts)
         
-        if difference > 0:
-            for i in xrange(difference):
-                winner = random.choice(amounts_dict.keys())
-                amounts_dict[winner] += Currency(1)
-        elif difference < 0:
-            for i in xrange(-difference):
-                winner = random.choice(amounts_dict.keys())
-                amounts_dict[winner] -= Currency(1)
+        if not (deletes or updates or inserts):
+            return
+        adjust_balances(session, deltas)
+        bump_version(session)
+        date = self.date
+        if isinstance(date, datetime):
+            date = date.date()
+        invalidate_checkpoints(session, date)
+        refresh_rollup(session, rollup_buckets(session, [self.id]))
         
-        for user, share in amounts_dict.iteritems():
-            s = Split(self, user, share, split_text_dict[user])
-            meta.Session.add(s)
+        # Don't let anything we've already loaded go stale
+        mapper = class_mapper(Split)
+        for split_id in deletes:
+            obj = session.identity_map.get(
+                mapper.identity_key_from_primary_key([split_id]))
+            if obj is not None:
+                session.expunge(obj)
+        for params in updates:
+            obj = session.identity_map.get(
+                mapper.identity_key_from_primary_key([params['_id']]))
+            if obj is not None:
+                session.expire(obj)
+        session.expire(self, ['splits'])
 
     def involves(self, user):
         "Returns True if ``user`` is involved in this expenditure."
@@ -0,0 +1,252 @@
+"""
+Keep derived bookkeeping tables in step with the books.
+
+Every flush that touches an expenditure, split or transfer is turned
+into a set of per-user balance deltas, which are applied to the
+balances table before the flush's transaction commits. The same flush
+also bumps the ledger version, which anything caching numbers or pages
+derived from the books can use as a cache key, and throws away any
+balance checkpoints that the change invalidates.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes, class_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from bluechips.model.user import User
+from bluechips.model.expenditure import Expenditure
+from bluechips.model.split import Split
+from bluechips.model.transfer import Transfer
+from bluechips.model.balance import Balance
+from bluechips.model.tag import Tag
+from bluechips.model import meta
+
+# The columns of each ledger class that affect anybody's balance, or
+# when it changed
+ledger_columns = {Expenditure: ('spender_id', 'amount', 'date'),
+                  Split: ('user_id', 'share', 'expenditure_id'),
+                  Transfer: ('debtor_id', 'creditor_id', 'amount', 'date')}
+
+def contributions(cls, values):
+    """
+    Return a list of (user_id, cents) pairs describing how a ledger
+    row with the given column ``values`` moves each user's balance.
+
+    Negative numbers represent money the house owes the user, to match
+    bluechips.lib.totals.debts
+    """
+    if cls is Expenditure:
+        return [(values['spender_id'], -int(values['amount']))]
+    elif cls is Split:
+        return [(values['user_id'], int(values['share']))]
+    elif cls is Transfer:
+        return [(values['debtor_id'], -int(values['amount'])),
+                (values['creditor_id'], int(values['amount']))]
+    return []
+
+def adjust_balances(session, deltas):
+    """
+    Add ``deltas`` (a dict mapping user IDs to cents) to the stored
+    balances, creating rows for users who don't have one yet.
+
+    However many users are involved, this is at most three statements.
+    """
+    balances = class_mapper(Balance).local_table
+    deltas = dict((user_id, delta) for user_id, delta in deltas.iteritems()
+                  if delta != 0)
+    if not deltas:
+        return
+    
+    existing = set(user_id for (user_id,) in session.execute(
+            sa.select([balances.c.user_id],
+                      balances.c.user_id.in_(deltas.keys()))))
+    updates = [dict(_user_id=user_id, _delta=delta)
+               for user_id, delta in deltas.iteritems()
+               if user_id in existing]
+    inserts = [dict(user_id=user_id, balance=delta)
+               for user_id, delta in deltas.iteritems()
+               if user_id not in existing]
+    if updates:
+        session.execute(balances.update().\
+                where(balances.c.user_id == sa.bindparam('_user_id')).\
+                values(balance=balances.c.balance + sa.bindparam('_delta')),
+                        updates)
+    if inserts:
+        session.execute(balances.insert(), inserts)
+
+def current_version(session, column='version'):
+    """
+    Return the books' (epoch, version) pair, as it stands in
+    ``session``'s transaction, or None if they've never been written
+    to. Pass ``column='users_version'`` for the users table's version
+    instead.
+    """
+    ledger = meta.metadata.tables['ledger']
+    row = session.execute(sa.select([ledger.c.epoch, ledger.c[column]],
+                                    ledger.c.id == 1)).fetchone()
+    return row is not None and (row[0], row[1] or 0) or None
+
+def bump_version(session, column='version'):
+    """
+    Mark the books as changed.
+
+    The ledger table has a single row holding a random epoch (so that
+    caches can tell a recreated database from the old one) and a
+    version number which only ever goes up. setup-app creates the row;
+    if it's missing, the first change creates it.
+
+    The row also counts changes to the users table in users_version,
+    which can be bumped instead by passing that as ``column``.
+    """
+    ledger = meta.metadata.tables['ledger']
+    counter = ledger.c[column]
+    update = ledger.update().\
+        where(ledger.c.id == 1).\
+        values({counter: sa.func.coalesce(counter, 0) + 1})
+    if session.execute(update).rowcount == 0:
+        try:
+            session.execute(ledger.insert().values(
+                    {ledger.c.id: 1, ledger.c.epoch: unicode(uuid4().hex),
+                     counter: 1}))
+        except sa.exc.IntegrityError:
+            # Another process created it first
+            session.execute(update)
+
+def invalidate_checkpoints(session, since):
+    """
+    Throw away balance checkpoints which would be changed by an entry
+    dated ``since``.
+    """
+    checkpoints = meta.metadata.tables['balance_checkpoints']
+    session.execute(checkpoints.delete().where(checkpoints.c.date >= since))
+
+def _ledger_class(obj):
+    for cls in ledger_columns:
+        if isinstance(obj, cls):
+            return cls
+    return None
+
+def _primary_key(obj):
+    return attributes.instance_state(obj).key[1]
+
+def _stored_values(session, obj):
+    "Read the columns we care about for ``obj`` as they are in the database."
+    cls = _ledger_class(obj)
+    table = class_mapper(cls).local_table
+    names = ledger_columns[cls]
+    row = session.execute(sa.select([table.c[n] for n in names],
+                                    table.c.id == _primary_key(obj)[0])).\
+        fetchone()
+    if row is None:
+        return None
+    return dict(zip(names, row))
+
+# Attributes which never show up on any page, so changing them doesn't
+# count as touching the books
+hidden_attributes = {User: ('password',)}
+
+def _visibly_modified(obj):
+    """
+    Has ``obj`` changed in a way that shows up on pages? Collections
+    which haven't been loaded are taken not to have changed, rather
+    than loaded to check.
+    """
+    state = attributes.instance_state(obj)
+    hidden = hidden_attributes.get(type(obj), ())
+    for attr in state.manager.attributes:
+        if attr.key in hidden or not hasattr(attr.impl, 'get_history'):
+            continue
+        added, unchanged, deleted = attr.impl.get_history(state, state.dict,
+                                                          passive=True)
+        if added or deleted:
+            return True
+    return False
+
+def _current_values(obj):
+    cls = _ledger_class(obj)
+    return dict((n, getattr(obj, n)) for n in ledger_columns[cls])
+
+
+class LedgerExtension(SessionExtension):
+    """
+    Session extension which keeps the balances table consistent with
+    the expenditures, splits and transfers tables.
+
+    Old values are read from the database before the flush (the
+    in-memory history isn't reliable for expired objects), and new
+    values are taken from the objects after the flush, once foreign
+    keys have been populated.
+    """
+
+    def before_flush(self, session, flush_context, instances):
+        old = []
+        for obj in session.deleted:
+            if _ledger_class(obj) is not None:
+                old.append((obj, _stored_values(session, obj)))
+        for obj in session.dirty:
+            if (_ledger_class(obj) is not None and
+                session.is_modified(obj, include_collections=False)):
+                old.append((obj, _stored_values(session, obj)))
+        flush_context.attributes['bluechips.ledger.old'] = old
+
+        # Changes which don't move any balances but do show up on pages,
+        # like retagging an expenditure or renaming a user
+        flush_context.attributes['bluechips.ledger.touched'] = bool(
+            [obj for obj in list(session.new) + list(session.deleted)
+             if isinstance(obj, (User, Tag))] or
+            [obj for obj in session.dirty
+             if (isinstance(obj, (User, Tag, Expenditure)) and
+                 _visibly_modified(obj))])
+
+    def after_flush(self, session, flush_context):
+        deltas = {}
+        dates = []
+        expenditure_ids = set()
+        def add(cls, values, sign):
+            for user_id, cents in contributions(cls, values):
+                deltas[user_id] = deltas.get(user_id, 0) + sign * cents
+            date = values.get('date')
+            if isinstance(date, datetime):
+                date = date.date()
+            if date is not None:
+                dates.append(date)
+            if 'expenditure_id' in values:
+                expenditure_ids.add(values['expenditure_id'])
+
+        old = flush_context.attributes.get('bluechips.ledger.old', [])
+        for obj, values in old:
+            if values is not None:
+                add(_ledger_class(obj), values, -1)
+            if obj not in session.deleted:
+                add(_ledger_class(obj), _current_values(obj), 1)
+        for obj in session.new:
+            if _ledger_class(obj) is not None:
+                add(_ledger_class(obj), _current_values(obj), 1)
+
+        adjust_balances(session, deltas)
+        if (old or flush_context.attributes.get('bluechips.ledger.touched') or
+            [obj for obj in session.new if _ledger_class(obj) is not None]):
+            bump_version(session)
+
+        # A split is dated by its expenditure. If the expenditure is
+        # gone too, its own date has already been counted.
+        if expenditure_ids:
+            expenditures = class_mapper(Expenditure).local_table
+            dates.extend(date for (date,) in session.execute(
+                    sa.select([expenditures.c.date],
+                              expenditures.c.id.in_(expenditure_ids))))
+        if dates:
+            invalidate_checkpoints(session, min(dates))
+
+        balances = class_mapper(Balance).local_table
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                session.execute(balances.delete().\
+                        where(balances.c.user_id == _primary_key(obj)[0]))
+
+
+__all__ = ['LedgerExtension', 'adjust_balances', 'bump_version',
+           'current_version', 'contributions', 'invalidate_checkpoints']
@@ -8,8 +8,14 @@ engine = None
 # SQLAlchemy session manager.  Updated by model.init_model()
 Session = None
 
+# Full-text search backend.  Updated by model.init_model()
+search = None
+
+# Cache of the users table.  Updated by model.init_model()
+directory = None
+
 # Global metadata. If you have multiple databases with overlapping table
 # names, you'll need a metadata for each database
 metadata = MetaData()
 
-__all__ = ['engine', 'Session', 'metadata']
+__all__ = ['engine', 'Session', 'search', 'directory', 'metadata']
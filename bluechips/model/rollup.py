@@ -0,0 +1,173 @@
+"""
+Keep the per-tag, per-month spending rollup in step with the books.
+
+The tag_month_rollup table holds, for each tag, month and user, that
+user's share of the month's expenditures with the tag, and how much
+of them they paid for. Reports read it instead of joining
+expenditures, tags and splits.
+
+Whenever a flush touches an expenditure, its splits or its tags,
+RollupExtension works out which (tag, month) buckets it was in before
+and after, and recomputes just those buckets.
+"""
+
+from datetime import date, datetime
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes, class_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from bluechips.model.expenditure import Expenditure
+from bluechips.model.split import Split
+from bluechips.model.tag import Tag
+from bluechips.model import meta
+
+def month_of(d):
+    "Return the first day of the month containing ``d``."
+    if isinstance(d, datetime):
+        d = d.date()
+    return d.replace(day=1)
+
+def _next_month(month):
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+def _tables():
+    tables = meta.metadata.tables
+    return (tables['tag_month_rollup'], tables['tag_to_expense_map'],
+            class_mapper(Expenditure).local_table,
+            class_mapper(Split).local_table)
+
+def rollup_buckets(session, expenditure_ids):
+    """
+    Return the set of (tag ID, month) buckets the expenditures with
+    the given IDs are in, as they are in the database.
+    """
+    rollup, tag_map, expenditures, splits = _tables()
+    if not expenditure_ids:
+        return set()
+    return set((tag_id, month_of(d)) for tag_id, d in session.execute(
+            sa.select([tag_map.c.tag_id, expenditures.c.date],
+                      sa.and_(tag_map.c.expenditure_id == expenditures.c.id,
+                              expenditures.c.id.in_(expenditure_ids)))))
+
+def _compute(session, whereclause=None):
+    """
+    Total up shares and payments by (tag ID, month, user ID) for the
+    tagged expenditures matching ``whereclause``.
+
+    The database groups by date, and the dates are folded into months
+    here, which keeps the SQL portable.
+    """
+    rollup, tag_map, expenditures, splits = _tables()
+    totals = {}
+    def add(tag_id, d, user_id, column, amount):
+        key = (tag_id, month_of(d), user_id)
+        row = totals.setdefault(key, {'share': 0, 'paid': 0})
+        row[column] += int(amount)
+
+    tagged = tag_map.join(expenditures,
+                          tag_map.c.expenditure_id == expenditures.c.id)
+    group = [tag_map.c.tag_id, expenditures.c.date]
+    shares = sa.select(group + [splits.c.user_id,
+                                sa.func.sum(splits.c.share)],
+                       whereclause,
+                       from_obj=[tagged.join(splits, splits.c.expenditure_id ==
+                                             expenditures.c.id)],
+                       group_by=group + [splits.c.user_id])
+    for tag_id, d, user_id, share in session.execute(shares):
+        add(tag_id, d, user_id, 'share', share)
+    paid = sa.select(group + [expenditures.c.spender_id,
+                              sa.func.sum(expenditures.c.amount)],
+                     whereclause,
+                     from_obj=[tagged],
+                     group_by=group + [expenditures.c.spender_id])
+    for tag_id, d, user_id, amount in session.execute(paid):
+        add(tag_id, d, user_id, 'paid', amount)
+    return totals
+
+def _insert(session, totals):
+    rollup = _tables()[0]
+    rows = [dict(tag_id=tag_id, month=month, user_id=user_id, **values)
+            for (tag_id, month, user_id), values in totals.iteritems()
+            if values['share'] or values['paid']]
+    if rows:
+        session.execute(rollup.insert(), rows)
+
+def refresh_rollup(session, buckets):
+    """
+    Recompute the rollup rows for ``buckets``, a set of (tag ID,
+    month) pairs, from the expenditures, tags and splits tables.
+    """
+    rollup, tag_map, expenditures, splits = _tables()
+    if not buckets:
+        return
+    session.execute(rollup.delete().where(sa.and_(
+                rollup.c.tag_id == sa.bindparam('_tag_id'),
+                rollup.c.month == sa.bindparam('_month'))),
+                    [dict(_tag_id=tag_id, _month=month)
+                     for tag_id, month in buckets])
+    _insert(session, _compute(session, sa.or_(*[
+                    sa.and_(tag_map.c.tag_id == tag_id,
+                            expenditures.c.date >= month,
+                            expenditures.c.date < _next_month(month))
+                    for tag_id, month in buckets])))
+
+def rebuild_rollup(session):
+    "Throw away the rollup table's contents and recompute it all."
+    rollup = _tables()[0]
+    session.execute(rollup.delete())
+    _insert(session, _compute(session))
+
+
+def _expenditure_ids(objs):
+    ids = set()
+    for obj in objs:
+        if isinstance(obj, Expenditure):
+            state = attributes.instance_state(obj)
+            if state.key is not None:
+                ids.add(state.key[1][0])
+            elif obj.id is not None:
+                ids.add(obj.id)
+        elif isinstance(obj, Split):
+            # Catch splits moved from one expenditure to another, too
+            for values in attributes.get_history(obj, 'expenditure_id'):
+                ids.update(value for value in values or ()
+                           if value is not None)
+    return ids
+
+
+class RollupExtension(SessionExtension):
+    """
+    Session extension which keeps tag_month_rollup consistent with the
+    expenditures, splits and tag_to_expense_map tables.
+    """
+
+    def before_flush(self, session, flush_context, instances):
+        changed = [obj for obj in session.dirty
+                   if isinstance(obj, (Expenditure, Split)) and
+                   session.is_modified(obj)]
+        ids = _expenditure_ids(changed + list(session.deleted))
+        flush_context.attributes['bluechips.rollup.ids'] = ids
+        flush_context.attributes['bluechips.rollup.old'] = \
+            rollup_buckets(session, ids)
+        flush_context.attributes['bluechips.rollup.tags'] = \
+            [attributes.instance_state(obj).key[1][0]
+             for obj in session.deleted if isinstance(obj, Tag)]
+
+    def after_flush(self, session, flush_context):
+        ids = flush_context.attributes.get('bluechips.rollup.ids', set())
+        ids |= _expenditure_ids(session.new)
+        buckets = flush_context.attributes.get('bluechips.rollup.old', set())
+        buckets |= rollup_buckets(session, ids)
+        refresh_rollup(session, buckets)
+
+        tags = flush_context.attributes.get('bluechips.rollup.tags')
+        if tags:
+            rollup = _tables()[0]
+            session.execute(rollup.delete().where(rollup.c.tag_id.in_(tags)))
+
+
+__all__ = ['RollupExtension', 'month_of', 'rollup_buckets',
+           'refresh_rollup', 'rebuild_rollup']
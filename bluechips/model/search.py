@@ -0,0 +1,231 @@
+"""
+Full-text search over expenditure and transfer descriptions.
+
+The search index lives behind a backend, chosen with the search.backend
+config option:
+
+``fts5``
+    An SQLite FTS5 table, ranked by relevance. Used by default when
+    the database is SQLite and FTS5 is compiled in.
+
+``like``
+    No index at all; descriptions are matched with LIKE and the
+    newest matches come first. Used by default everywhere else.
+
+Anything else is taken as ``module:Class`` naming a SearchBackend
+subclass, so other databases' full-text indexes can be plugged in.
+
+SearchExtension keeps the index up to date as expenditures and
+transfers are written. An existing database's index can be built (or
+rebuilt) with ``paster rebuild-search-index``.
+"""
+
+import sqlalchemy as sa
+from sqlalchemy.orm import attributes, class_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from bluechips.model.expenditure import Expenditure
+from bluechips.model.transfer import Transfer
+
+# The classes whose descriptions are searchable
+searchable = (Expenditure, Transfer)
+
+def _searchable_class(obj):
+    for cls in searchable:
+        if isinstance(obj, cls):
+            return cls
+    return None
+
+
+class SearchBackend(object):
+    """
+    Base class for search backends.
+
+    The default implementations do nothing, for backends which don't
+    keep an index.
+    """
+    def create(self, bind):
+        "Create the index, if it isn't there already."
+        pass
+
+    def update(self, session, cls, id, description):
+        "Add or replace the entry for one expenditure or transfer."
+        pass
+
+    def remove(self, session, cls, id):
+        "Drop the entry for one expenditure or transfer."
+        pass
+
+    def rebuild(self, session):
+        "Reindex every expenditure and transfer from scratch."
+        pass
+
+    def search(self, session, cls, terms, offset=0, limit=None):
+        """
+        Return the IDs of the instances of ``cls`` whose descriptions
+        contain all of ``terms`` (a list of words), best match first.
+        """
+        raise NotImplementedError
+
+
+class LikeBackend(SearchBackend):
+    """
+    Search without an index, by matching each term with LIKE. Slow on
+    big books, but works on any database.
+    """
+    def search(self, session, cls, terms, offset=0, limit=None):
+        table = class_mapper(cls).local_table
+        query = sa.select([table.c.id],
+                          sa.and_(*[table.c.description.like(
+                        u'%%%s%%' % _escape_like(term), escape='\\')
+                                    for term in terms]),
+                          order_by=[table.c.date.desc(),
+                                    table.c.entered_time.desc(),
+                                    table.c.id.desc()],
+                          offset=offset, limit=limit)
+        return [id for (id,) in session.execute(query)]
+
+def _escape_like(term):
+    for c in ('\\', '%', '_'):
+        term = term.replace(c, '\\' + c)
+    return term
+
+
+class FTS5Backend(SearchBackend):
+    """
+    Search an SQLite FTS5 index, ranked by BM25.
+
+    Expenditures and transfers share one table; an expenditure's row ID
+    is twice its ID, and a transfer's is one more than that, so
+    entries can be updated without a separate mapping table.
+    """
+    table = 'search_index'
+    kinds = {Expenditure: 0, Transfer: 1}
+
+    def __init__(self):
+        self._exists = None
+
+    @classmethod
+    def supported(cls, bind):
+        "Can ``bind`` create FTS5 tables?"
+        if bind.name != 'sqlite':
+            return False
+        try:
+            bind.execute('CREATE VIRTUAL TABLE temp.fts5_check '
+                         'USING fts5(x)')
+            bind.execute('DROP TABLE temp.fts5_check')
+        except sa.exc.DBAPIError:
+            return False
+        return True
+
+    def _ready(self, session):
+        # Books set up before search existed won't have the table until
+        # rebuild-search-index is run; until then, writes skip it
+        if not self._exists:
+            self._exists = bool(session.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = :name",
+                    dict(name=self.table)).fetchall())
+        return self._exists
+
+    def _rowid(self, cls, id):
+        return id * 2 + self.kinds[cls]
+
+    def create(self, bind):
+        bind.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s '
+                     'USING fts5(description)' % self.table)
+        self._exists = True
+
+    def update(self, session, cls, id, description):
+        if not self._ready(session):
+            return
+        self.remove(session, cls, id)
+        if description:
+            session.execute('INSERT INTO %s (rowid, description) '
+                            'VALUES (:rowid, :description)' % self.table,
+                            dict(rowid=self._rowid(cls, id),
+                                 description=description))
+
+    def remove(self, session, cls, id):
+        if not self._ready(session):
+            return
+        session.execute('DELETE FROM %s WHERE rowid = :rowid' % self.table,
+                        dict(rowid=self._rowid(cls, id)))
+
+    def rebuild(self, session):
+        self.create(session)
+        session.execute('DELETE FROM %s' % self.table)
+        for cls, kind in self.kinds.iteritems():
+            table = class_mapper(cls).local_table
+            session.execute('INSERT INTO %s (rowid, description) '
+                            'SELECT id * 2 + %d, description FROM %s '
+                            "WHERE description IS NOT NULL "
+                            "AND description != ''" %
+                            (self.table, kind, table.name))
+
+    def search(self, session, cls, terms, offset=0, limit=None):
+        if not self._ready(session):
+            return LikeBackend().search(session, cls, terms, offset, limit)
+        # Quote each term so punctuation isn't taken as FTS5 syntax, and
+        # match on prefixes so "plumb" finds "plumber"
+        match = u' '.join(u'"%s"*' % term.replace(u'"', u'""')
+                          for term in terms)
+        query = ('SELECT rowid FROM %s WHERE %s MATCH :match '
+                 'AND rowid %% 2 = :kind ORDER BY rank '
+                 'LIMIT :limit OFFSET :offset' % (self.table, self.table))
+        return [rowid // 2 for (rowid,) in session.execute(
+                query, dict(match=match, kind=self.kinds[cls],
+                            limit=limit is None and -1 or limit,
+                            offset=offset))]
+
+
+backends = {'fts5': FTS5Backend,
+            'like': LikeBackend}
+
+def get_backend(name, engine):
+    """
+    Return a search backend for ``engine``, by name (see above). With
+    no name, use FTS5 if it's available.
+    """
+    if not name:
+        if FTS5Backend.supported(engine):
+            return FTS5Backend()
+        return LikeBackend()
+    elif name in backends:
+        return backends[name]()
+    else:
+        module, cls = name.split(':', 1)
+        return getattr(__import__(module, fromlist=[cls]), cls)()
+
+
+class SearchExtension(SessionExtension):
+    """
+    Session extension which updates the search index for every
+    expenditure and transfer written in a flush.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def after_flush(self, session, flush_context):
+        for obj in session.deleted:
+            cls = _searchable_class(obj)
+            if cls is not None:
+                self.backend.remove(session, cls,
+                                    attributes.instance_state(obj).key[1][0])
+        for obj in session.new:
+            cls = _searchable_class(obj)
+            if cls is not None:
+                self.backend.update(session, cls, obj.id, obj.description)
+        for obj in session.dirty:
+            cls = _searchable_class(obj)
+            if (cls is not None and
+                attributes.get_history(obj, 'description').has_changes()):
+                self.backend.update(session, cls, obj.id, obj.description)
+
+
+def search_terms(query):
+    "Split a search box's contents into terms."
+    return query.split()
+
+
+__all__ = ['SearchBackend', 'LikeBackend', 'FTS5Backend', 'get_backend',
+           'SearchExtension', 'search_terms']
@@ -1,3 +1,5 @@
+import sqlalchemy as sa
+
 from bluechips.model import meta
 
 class Tag(object):
@@ -16,5 +18,22 @@ def create_tag(name):
 
     return t
 
+def prune_tags(session, tag_ids):
+    """
+    Delete whichever of the tags with the given IDs are no longer on
+    any expenditure, in one statement.
+
+    Pass the tags an edit might have left unused; the changes to
+    tag_to_expense_map must have been flushed first.
+    """
+    if not tag_ids:
+        return
+    tables = meta.metadata.tables
+    tags, tag_map = tables['tags'], tables['tag_to_expense_map']
+    session.execute(tags.delete().where(sa.and_(
+                tags.c.id.in_(tag_ids),
+                ~sa.exists([tag_map.c.tag_id],
+                           tag_map.c.tag_id == tags.c.id))))
+
 
-__all__ = ['Tag']
+__all__ = ['Tag', 'prune_tags']
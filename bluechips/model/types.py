@@ -7,9 +7,6 @@ from decimal import Decimal, InvalidOperation
 
 import sqlalchemy as sa
 from formencode import validators, Invalid
-from bluechips.lib.subclass import SmartSubclass
-
-from weakref import WeakValueDictionary
 
 def localeconv():
     "Manually install en_US for systems that don't have it."
@@ -35,6 +32,109 @@ def localeconv():
 locale.localeconv = localeconv
 
 
+class CurrencyFormatter(object):
+    """
+    Format integral numbers of cents the way ``locale.currency(cents /
+    100., grouping=True)`` would, using integer arithmetic only.
+
+    The locale conventions are read once, when the formatter is
+    created, and turned into a prefix and suffix for each sign.
+    """
+    def __init__(self, conv):
+        if conv['frac_digits'] != 2:
+            raise ValueError("Currency amounts have exactly two decimal "
+                             "places, but the locale wants %d" %
+                             conv['frac_digits'])
+        self.decimal_point = conv['mon_decimal_point']
+        self.thousands_sep = conv['mon_thousands_sep']
+        
+        self.group_sizes = []
+        self.repeat_last_group = False
+        for size in conv['mon_grouping']:
+            if size == locale.CHAR_MAX:
+                break
+            elif size == 0:
+                self.repeat_last_group = bool(self.group_sizes)
+                break
+            self.group_sizes.append(size)
+        # [3, 3, 0] means the same thing as [3, 0]
+        while (self.repeat_last_group and len(self.group_sizes) > 1 and
+               self.group_sizes[-1] == self.group_sizes[-2]):
+            self.group_sizes.pop()
+        
+        self.positive = self._affixes(conv, 'p', conv['positive_sign'])
+        self.negative = self._affixes(conv, 'n', conv['negative_sign'])
+    
+    @staticmethod
+    def _affixes(conv, prefix, sign):
+        """
+        Work out what goes either side of the number, following the
+        same steps as locale.currency.
+        """
+        # '<' and '>' mark where the sign goes for sign_posn 3 and 4
+        s = '<\0>'
+        symbol = conv['currency_symbol']
+        space = conv[prefix + '_sep_by_space'] and ' ' or ''
+        if conv[prefix + '_cs_precedes']:
+            s = symbol + space + s
+        else:
+            s = s + space + symbol
+        
+        sign_posn = conv[prefix + '_sign_posn']
+        if sign_posn == 0:
+            s = '(' + s + ')'
+        elif sign_posn == 2:
+            s = s + sign
+        elif sign_posn == 3:
+            s = s.replace('<', sign)
+        elif sign_posn == 4:
+            s = s.replace('>', sign)
+        else:
+            s = sign + s
+        
+        return tuple(s.replace('<', '').replace('>', '').split('\0'))
+    
+    def _group(self, dollars):
+        sizes = self.group_sizes
+        if not sizes or not self.thousands_sep:
+            return str(dollars)
+        elif sizes == [3] and self.repeat_last_group:
+            # The common case, which the builtin formatting can do
+            grouped = format(dollars, ',')
+            if self.thousands_sep != ',':
+                grouped = grouped.replace(',', self.thousands_sep)
+            return grouped
+        
+        digits = str(dollars)
+        
+        groups = []
+        i = 0
+        end = len(digits)
+        while i < len(sizes) or self.repeat_last_group:
+            size = sizes[min(i, len(sizes) - 1)]
+            if end <= size:
+                break
+            groups.append(digits[end - size:end])
+            end -= size
+            i += 1
+        groups.append(digits[:end])
+        groups.reverse()
+        return self.thousands_sep.join(groups)
+    
+    def __call__(self, cents):
+        cents = int(cents)
+        if cents < 0:
+            prefix, suffix = self.negative
+            dollars, cents = divmod(-cents, 100)
+        else:
+            prefix, suffix = self.positive
+            dollars, cents = divmod(cents, 100)
+        return '%s%s%s%02d%s' % (prefix, self._group(dollars),
+                                 self.decimal_point, cents, suffix)
+
+format_currency = CurrencyFormatter(locale.localeconv())
+
+
 class CurrencyValidator(validators.FancyValidator):
     "A validator to convert to Currency objects."
     messages = {'amount': "Please enter a valid currency amount",
@@ -59,46 +159,42 @@ class CurrencyValidator(validators.FancyValidator):
                 return Currency(int(ret * 100))
 
 
+_new = object.__new__
+
 class Currency(object):
     """
     Store currency values as an integral number of cents
+
+    Currency behaves like an int, except that the result of arithmetic
+    with a Currency on either side is another Currency. The other
+    operand is converted with int() first, except in multiplication
+    and division, where only the result is truncated.
     """
-    __metaclass__ = SmartSubclass(int)
-    __old_values__ = WeakValueDictionary()
+    __slots__ = ('value',)
+    
     def __new__(cls, value):
         if value is None:
             value = 0
         elif isinstance(value, str):
-            value = int(float(value) * 100)
+            value = int(Decimal(value) * 100)
         else:
             value = int(value)
         
-        if value not in cls.__old_values__:
-            new_object = super(cls, cls).__new__(cls)
-            new_object.value = value
-            cls.__old_values__[value] = new_object
-            return new_object
-        else:
-            return cls.__old_values__[value]
+        self = _new(cls)
+        self.value = value
+        return self
     
     def __int__(self):
-        """
-        If I don't define this, SmartSubclass will return
-        Currency(int(self.value))
-        """
         return self.value
+    __index__ = __int__
     def __float__(self):
-        """
-        If I don't define this, SmartSubclass will return
-        Currency(float(self.value))
-        """
         return float(self.value)
     def __long__(self):
-        """
-        If I don't define this, SmartSubclass will return
-        Currency(long(self.value))
-        """
         return long(self.value)
+    def __nonzero__(self):
+        return self.value != 0
+    def __hash__(self):
+        return hash(self.value)
     
     def __cmp__(self, other):
         """
@@ -108,37 +204,72 @@ class Currency(object):
         if other == '':
             return 1
         else:
-            return self.value.__cmp__(int(other))
+            return cmp(self.value, int(other))
     
+    # The arithmetic below is written out longhand, rather than in
+    # terms of Currency(), because it's on the hot path of every total
+    # in the app.
+    def __add__(self, other):
+        result = _new(Currency)
+        result.value = self.value + int(other)
+        return result
+    __radd__ = __add__
+    def __sub__(self, other):
+        result = _new(Currency)
+        result.value = self.value - int(other)
+        return result
+    def __rsub__(self, other):
+        result = _new(Currency)
+        result.value = int(other) - self.value
+        return result
     def __mul__(self, other):
-        """
-        If I don't define this, SmartSubclass will convert the other
-        argument to an int
-        """
-        return Currency(self.value * other)
-    def __rmul__(self, other):
-        """
-        If I don't define this, SmartSubclass will convert the other
-        argument to an int
-        """
-        return self.__mul__(other)
+        result = _new(Currency)
+        result.value = int(self.value * other)
+        return result
+    __rmul__ = __mul__
     def __div__(self, other):
-        """
-        If I don't define this, SmartSubclass will convert the other
-        argument to an int
-        """
-        return Currency(self.value / other)
-    def __truediv__(self, other):
-        """
-        If I don't define this, SmartSubclass will convert the other
-        argument to an int
-        """
-        return Currency(self.value / other)
+        result = _new(Currency)
+        result.value = int(self.value / other)
+        return result
+    __truediv__ = __div__
+    def __rdiv__(self, other):
+        result = _new(Currency)
+        result.value = int(other) / self.value
+        return result
+    __rtruediv__ = __rdiv__
+    def __floordiv__(self, other):
+        result = _new(Currency)
+        result.value = self.value // int(other)
+        return result
+    def __rfloordiv__(self, other):
+        result = _new(Currency)
+        result.value = int(other) // self.value
+        return result
+    def __mod__(self, other):
+        result = _new(Currency)
+        result.value = self.value % int(other)
+        return result
+    def __rmod__(self, other):
+        result = _new(Currency)
+        result.value = int(other) % self.value
+        return result
+    def __pow__(self, other):
+        return Currency(self.value ** int(other))
+    def __neg__(self):
+        result = _new(Currency)
+        result.value = -self.value
+        return result
+    def __pos__(self):
+        return self
+    def __abs__(self):
+        result = _new(Currency)
+        result.value = abs(self.value)
+        return result
     
     def __repr__(self):
         return '%s("%s")' % (self.__class__.__name__, str(self))
     def __str__(self):
-        return locale.currency(self.value / 100., grouping=True)
+        return format_currency(self.value)
 
 
 class DBCurrency(sa.types.TypeDecorator):
@@ -1,3 +1,5 @@
+from bluechips.lib.passwords import hash_password, check_password
+
 class User(object):
     def __init__(self, username, name=u"", resident=True):
         self.username = username
@@ -10,4 +12,11 @@ class User(object):
     def __str__(self):
         return self.name
 
+    def set_password(self, password):
+        "Store a salted hash of ``password``."
+        self.password = hash_password(password)
+
+    def check_password(self, password):
+        return check_password(password, self.password)
+
 __all__ = ['User']
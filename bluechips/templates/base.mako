@@ -85,7 +85,26 @@
 </%def>
 
 <%def name="listExpenditures(es, total=None, share=None)">
+  ## es holds (expenditure, my share, involved) rows, as returned by
+  ## bluechips.lib.totals.with_shares
   <table class="list">
+    ${expenditureHeader()}
+    % for e, my_share, involved in es:
+      ${expenditureRow(e, my_share, involved)}
+    % endfor
+    % if total is not None and share is not None:
+      <tr class="user-involved">
+        <td class="total" colspan=3></td>
+	<td class="total">${h.format_currency(total)}</td>
+	<td class="total">${h.format_currency(share)}</td>
+	<td class="total"></td>
+      </tr>
+
+    % endif
+  </table>
+</%def>
+
+<%def name="expenditureHeader()">
     <tr>
       <th class="date">Date</th>
       <th class="user">Spender</th>
@@ -94,9 +113,11 @@
       <th class="share">My Share</th>
       <th class="editlink"></th>
     </tr>
-    % for e in es:
+</%def>
+
+<%def name="expenditureRow(e, my_share, involved)">
       <%
-        if e.involves(request.environ['user']):
+        if involved:
           klass = 'user-involved'
         else:
           klass = 'user-not-involved'
@@ -105,25 +126,22 @@
         <td class="date">${e.date}</td>
         <td class="user">${formatUser(e.spender)}</td>
         <td class="description">${e.description}</td>
-        <td class="amount">${e.amount}</td>
-        <td class="share">${e.share(request.environ['user'])}</td>
+        <td class="amount">${h.format_currency(e.amount)}</td>
+        <td class="share">${h.format_currency(my_share)}</td>
         <td class="editlink">${h.link_to('Edit', h.url_for(controller='spend', action='edit', id=e.id))}</td>
       </tr>
-    % endfor
-    % if total is not None and share is not None:
-      <tr class="user-involved">
-        <td class="total" colspan=3></td>
-	<td class="total">${total}</td>
-	<td class="total">${share}</td>
-	<td class="total"></td>
-      </tr>
-
-    % endif
-  </table>
 </%def>
 
 <%def name="listTransfers(ts)">
   <table class="list">
+    ${transferHeader()}
+    % for t in ts:
+      ${transferRow(t)}
+    % endfor
+  </table>
+</%def>
+
+<%def name="transferHeader()">
     <tr>
       <th class="date">Date</th>
       <th class="user">From</th>
@@ -132,7 +150,9 @@
       <th class="amount">Amount</th>
       <th class="editlink"></th>
     </tr>
-    % for t in ts:
+</%def>
+
+<%def name="transferRow(t)">
       <%
         if t.involves(request.environ['user']):
           klass = 'user-involved'
@@ -144,11 +164,22 @@
         <td class="user">${formatUser(t.debtor)}</td>
         <td class="user">${formatUser(t.creditor)}</td>
         <td class="description">${t.description}</td>
-        <td class="amount">${t.amount}</td>
+        <td class="amount">${h.format_currency(t.amount)}</td>
         <td class="editlink">${h.link_to('Edit', h.url_for(controller='transfer', action='edit', id=t.id))}</td>
       </tr>
-    % endfor
-  </table>
+</%def>
+
+<%def name="pager(page, name)">
+  % if page.newer or page.older:
+    <p class="pager">
+      % if page.newer:
+        ${h.link_to(h.literal('&larr; Newer'), h.page_url(name, 'before', page.newer))}
+      % endif
+      % if page.older:
+        ${h.link_to(h.literal('Older &rarr;'), h.page_url(name, 'after', page.older))}
+      % endif
+    </p>
+  % endif
 </%def>
 
 <%def name="listTags()">
@@ -0,0 +1,29 @@
+<%inherit file="/base.mako"/>
+<%namespace file="/base.mako" import="expenditureHeader, expenditureRow, transferHeader, transferRow"/>
+
+## The rows are filled in as they're read from the database; see
+## bluechips.lib.base.render_stream
+
+<h2>Group Expenditures</h2>
+<table class="list">
+  ${expenditureHeader()}
+  ${stream('expenditures')}
+</table>
+
+<h2>Transfers</h2>
+<table class="list">
+  ${transferHeader()}
+  ${stream('transfers')}
+</table>
+
+<%def name="expenditures(rows)">
+  % for e, my_share, involved in rows:
+    ${expenditureRow(e, my_share, involved)}
+  % endfor
+</%def>
+
+<%def name="transfers(rows)">
+  % for t in rows:
+    ${transferRow(t)}
+  % endfor
+</%def>
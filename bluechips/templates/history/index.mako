@@ -1,10 +1,22 @@
 <%inherit file="/base.mako"/>
 
+${h.form(h.url_for(controller='search', action='index'), method='get')}
+  <p>
+    ${h.text('q')}
+    ${h.submit(None, 'Search')}
+  </p>
+${h.end_form()}
+
 <h2>Tags</h2>
 ${self.listTags()}
+<p>${h.link_to('Spending by tag and month', h.url_for(controller='report', action='index'))}</p>
 
 <h2>Group Expenditures</h2>
 ${self.listExpenditures(c.expenditures)}
+${self.pager(c.expenditures, 'expenditures')}
 
 <h2>Transfers</h2>
 ${self.listTransfers(c.transfers)}
+${self.pager(c.transfers, 'transfers')}
+
+<p>${h.link_to('Show the full history on one page', h.url_for(controller='history', action='full'))}</p>
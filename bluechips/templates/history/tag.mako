@@ -5,3 +5,4 @@ ${self.listTags()}
 
 <h2>Expenditures tagged with ${c.tag.name}</h2>
 ${self.listExpenditures(c.expenditures, total=c.total, share=c.share)}
+${self.pager(c.expenditures, 'expenditures')}
@@ -18,7 +18,7 @@ ${self.tabs('status')}
         <tr>
           <td>${transfer[0].name}</td>
           <td>${transfer[1].name}</td>
-          <td class="amount">${transfer[2]}</td>
+          <td class="amount">${h.format_currency(transfer[2])}</td>
         </tr>
       % endfor
       % if c.net != 0:
@@ -30,7 +30,7 @@ ${self.tabs('status')}
               You owe the group:
             % endif
           </th>
-          <th class="amount">${abs(c.net)}</th>
+          <th class="amount">${h.format_currency(abs(c.net))}</th>
         </tr>
       % endif
     </table>
@@ -0,0 +1,43 @@
+<%inherit file="/base.mako"/>
+
+% if len(c.years) > 1:
+  <p>
+    % for year in c.years:
+      % if year == c.year:
+        <strong>${year}</strong>
+      % else:
+        ${h.link_to(year, h.url_for(controller='report', action='index', year=year))}
+      % endif
+    % endfor
+  </p>
+% endif
+
+% if not c.months:
+  <p>Nothing tagged was spent in ${c.year}.</p>
+% endif
+
+% for month, tags in c.months:
+  <h2>${month.strftime('%B %Y')}</h2>
+  <table class="list">
+    <tr>
+      <th class="description">Tag</th>
+      <th class="amount">Total</th>
+      % for user in c.users:
+        <th class="share">${user.name}</th>
+      % endfor
+    </tr>
+    % for tag in tags:
+      <tr>
+        <td class="description">${tag['name']}</td>
+        <td class="amount">${h.format_currency(tag['total'])}</td>
+        % for user in c.users:
+          % if user.id in tag['shares']:
+            <td class="share">${h.format_currency(tag['shares'][user.id])}</td>
+          % else:
+            <td class="share"></td>
+          % endif
+        % endfor
+      </tr>
+    % endfor
+  </table>
+% endfor
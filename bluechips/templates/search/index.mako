@@ -0,0 +1,26 @@
+<%inherit file="/base.mako"/>
+
+${h.form(h.url_for(controller='search', action='index'), method='get')}
+  <p>
+    ${h.text('q', c.query)}
+    ${h.submit(None, 'Search')}
+  </p>
+${h.end_form()}
+
+% if c.query:
+  <h2>Group Expenditures</h2>
+  % if c.expenditures:
+    ${self.listExpenditures(c.expenditures)}
+    ${self.pager(c.expenditures, 'expenditures')}
+  % else:
+    <p>No expenditures match.</p>
+  % endif
+
+  <h2>Transfers</h2>
+  % if c.transfers:
+    ${self.listTransfers(c.transfers)}
+    ${self.pager(c.transfers, 'transfers')}
+  % else:
+    <p>No transfers match.</p>
+  % endif
+% endif
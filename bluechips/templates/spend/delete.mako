@@ -11,7 +11,7 @@
     </tr>
     <tr>
       <th><label for="amount">Amount</label></th>
-      <td>${c.expenditure.amount}</td>
+      <td>${h.format_currency(c.expenditure.amount)}</td>
     </tr>
     <tr>
       <th><label for="date">Date</label></th>
@@ -55,4 +55,7 @@
     </tr>
   </table>
 </form>
+% if not c.expenditure.id:
+<p>Lots to enter? <a href="${h.url_for(controller='spend', action='upload')}">Import them from a file</a>.</p>
+% endif
 ${h.javascript_link('%s/js/calculator.js' % request.script_name)}
@@ -0,0 +1,37 @@
+<%inherit file="/base.mako"/>
+
+<p>Import a batch of expenditures from a CSV file or a bank or card statement in OFX format. Nothing is imported unless every row is valid.</p>
+
+<p>A CSV file needs a header row naming its columns: <tt>date</tt> (MM/DD/YYYY or YYYY-MM-DD), <tt>amount</tt>, <tt>description</tt>, and optionally <tt>spender</tt> (a username) and <tt>tags</tt>. To split an expenditure other than evenly among residents, add a column for each user, named after their username, holding their share.</p>
+
+% if c.errors:
+  <ul class="errors">
+    % for line_num, error in c.errors:
+      % for field, message in sorted(error.items()):
+        <li>Line ${line_num}: ${field}: ${message}</li>
+      % endfor
+    % endfor
+  </ul>
+% endif
+
+<form action="${h.url_for(controller='spend', action='import_file')}" method="post" enctype="multipart/form-data">
+  ${h.auth_token_hidden_field()}
+  <table class="form">
+    <tr>
+      <th><label for="file">File</label></th>
+      <td>${h.file('file')}</td>
+    </tr>
+    <tr>
+      <th><label for="format">Format</label></th>
+      <td>${h.select('format', 'csv', [('csv', 'CSV'), ('ofx', 'OFX')])}</td>
+    </tr>
+    <tr>
+      <th><label for="spender_id">Spender</label></th>
+      <td>${h.select('spender_id', c.spender_id, c.users)} <small>(unless the file says otherwise)</small></td>
+    </tr>
+    <tr>
+      <td></td>
+      <td>${h.submit(None, 'Import', class_="submitbutton")}</td>
+    </tr>
+  </table>
+</form>
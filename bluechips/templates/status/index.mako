@@ -8,6 +8,15 @@
   % else:
     <p>To balance the books, the following transfers need to be made:</p>
 
+    <p class="settle-strategy">
+      % if c.settle_strategy == 'minimal':
+        Showing the fewest transfers we could find.
+        ${h.link_to('Show the simple plan', h.url_for(controller='status', action='index', settle='greedy'))}
+      % else:
+        ${h.link_to('Show the fewest transfers', h.url_for(controller='status', action='index', settle='minimal'))}
+      % endif
+    </p>
+
     <table id="balance">
       <tr>
         <th>From</th>
@@ -18,7 +27,7 @@
         <tr>
           <td>${transfer[0].name}</td>
           <td>${transfer[1].name}</td>
-          <td class="amount">${transfer[2]}</td>
+          <td class="amount">${h.format_currency(transfer[2])}</td>
         </tr>
       % endfor
       % if c.net != 0:
@@ -30,7 +39,7 @@
               You owe the group:
             % endif
           </th>
-          <th class="amount">${abs(c.net)}</th>
+          <th class="amount">${h.format_currency(abs(c.net))}</th>
         </tr>
       % endif
     </table>
@@ -46,11 +55,11 @@
       <th class="scope">Everyone</th>
       <th class="scope">My Share</th>
     </tr>
-    % for period in ('Total', 'Past year', 'Year to date', 'Month to date', 'Last month'):
+    % for period, start, end in c.periods:
       <tr>
         <th>${period}</th>
         % for scope in ('all', 'mine'):
-          <td>${c.totals[period][scope]}</td>
+          <td>${h.format_currency(c.totals[period][scope])}</td>
         % endfor
       </tr>
     % endfor
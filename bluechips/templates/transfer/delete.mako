@@ -15,7 +15,7 @@
     </tr>
     <tr>
       <th><label for="amount">Amount</label></th>
-      <td>${c.transfer.amount}</td>
+      <td>${h.format_currency(c.transfer.amount)}</td>
     </tr>
     <tr>
       <th><label for="date">Date</label></th>
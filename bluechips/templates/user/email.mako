@@ -11,5 +11,11 @@
       <td>${h.text('new_email', request.environ['user'].email, size=48)}</td>
       <td><input type="submit" value="Update" /></td>
     </tr>
+    <tr>
+      <th></th>
+      <td colspan="2">
+        ${h.checkbox('digest', checked=request.environ['user'].digest, label='Send me a summary of the changes every so often, instead of an email for each one')}
+      </td>
+    </tr>
   </table>
 </form>
@@ -23,7 +23,7 @@ import random
 
 __all__ = ['url_for', 'TestController',
            'createUsers', 'createExpenditures',
-           'deleteUsers', 'deleteExpenditures']
+           'deleteUsers', 'deleteExpenditures', 'count_statements']
 
 sample_users = [u'Alice', u'Bob', u'Charlie', u'Dave', u'Eve']
 
@@ -76,3 +76,24 @@ def deleteUsers():
 
 def deleteExpenditures():
     map(meta.Session.delete, meta.Session.query(bluechips.model.Expenditure))
+
+def count_statements(func, *args, **kwargs):
+    """
+    Call ``func``, returning its result along with a list of the SQL
+    statements it ran.
+    """
+    statements = []
+    dialect = meta.engine.dialect
+    def record(name):
+        original = getattr(dialect, name)
+        def do_execute(cursor, statement, parameters, context=None):
+            statements.append(statement)
+            return original(cursor, statement, parameters, context=context)
+        setattr(dialect, name, do_execute)
+    record('do_execute')
+    record('do_executemany')
+    try:
+        return func(*args, **kwargs), statements
+    finally:
+        del dialect.do_execute
+        del dialect.do_executemany
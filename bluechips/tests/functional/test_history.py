@@ -1,7 +1,184 @@
+import simplejson
+
+from pylons import config
+
 from bluechips.tests import *
+from bluechips import model
+from bluechips.lib import helpers as h
+from bluechips.model import meta
 
 class TestHistoryController(TestController):
 
     def test_index(self):
         response = self.app.get(url_for(controller='history'))
         # Test response...
+
+    def test_shares(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        other = meta.Session.query(model.User).\
+                filter_by(username=u'ben').one()
+        e = model.Expenditure(user, 1234, u'Test expenditure')
+        meta.Session.add(e)
+        e.split({user: 1, other: 1})
+        e.tags.add(u'test')
+        meta.Session.commit()
+        tag_id = e._tags.copy().pop().id
+
+        response = self.app.get(url_for(controller='history'))
+        response.mustcontain('Test expenditure', '$12.34', '$6.17')
+        response = self.app.get(url_for(controller='history',
+                                        action='tag', id=tag_id))
+        response.mustcontain('Test expenditure', '$12.34', '$6.17')
+        response = self.app.get(url_for(controller='status'))
+        response.mustcontain('Test expenditure', '$6.17')
+
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.delete(meta.Session.query(model.Expenditure).get(e.id))
+        meta.Session.commit()
+
+    def test_tag_amounts_formatted(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        e = model.Expenditure(user, 1234, u'Test expenditure')
+        meta.Session.add(e)
+        e.split({user: 1})
+        e.tags.add(u'test')
+        meta.Session.commit()
+        tag_id = e._tags.copy().pop().id
+
+        formatted = []
+        format_currency = h.format_currency
+        def record(cents):
+            formatted.append(int(cents))
+            return format_currency(cents)
+        h.format_currency = record
+        try:
+            response = self.app.get(url_for(controller='history',
+                                            action='tag', id=tag_id))
+        finally:
+            h.format_currency = format_currency
+        response.mustcontain('$12.34')
+        # The amount and my share, in the row and the totals
+        assert formatted.count(1234) == 4, formatted
+
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.delete(meta.Session.query(model.Expenditure).get(e.id))
+        meta.Session.commit()
+
+    def test_retag_changes_etag(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        e = model.Expenditure(user, 1234, u'Test expenditure')
+        meta.Session.add(e)
+        e.split({user: 1})
+        meta.Session.commit()
+        e_id = e.id
+
+        response = self.app.get(url_for(controller='history'))
+        etag = response.header('ETag')
+        self.app.get(url_for(controller='history'),
+                     headers={'If-None-Match': etag}, status=304)
+
+        e = meta.Session.query(model.Expenditure).get(e_id)
+        e.tags.add(u'test')
+        meta.Session.commit()
+        response = self.app.get(url_for(controller='history'),
+                                headers={'If-None-Match': etag})
+        response.mustcontain('test')
+        self.assertNotEqual(response.header('ETag'), etag)
+
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.delete(meta.Session.query(model.Expenditure).get(e_id))
+        meta.Session.commit()
+
+    def test_missing_tag(self):
+        self.app.get(url_for(controller='history', action='tag', id=12345),
+                     status=404)
+        self.app.get(url_for(controller='history', action='tag', id='bogus'),
+                     status=404)
+
+    def test_paging(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        page_size = int(config['history.page_size'])
+        ids = []
+        for i in xrange(page_size + 1):
+            e = model.Expenditure(user, 100, u'Paged expenditure %d' % i)
+            meta.Session.add(e)
+            e.split({user: 1})
+            meta.Session.commit()
+            ids.append(e.id)
+
+        try:
+            response = self.app.get(url_for(controller='history'))
+            response.mustcontain('Paged expenditure %d' % page_size)
+            assert 'Paged expenditure 0' not in response
+            response = response.click('Older', index=0)
+            response.mustcontain('Paged expenditure 0')
+            assert 'Paged expenditure %d' % page_size not in response
+            response = response.click('Newer', index=0)
+            response.mustcontain('Paged expenditure %d' % page_size)
+
+            self.app.get(url_for(controller='history'),
+                         params={'expenditures_after': 'garbage'},
+                         status=400)
+        finally:
+            for id in ids:
+                meta.Session.delete(
+                    meta.Session.query(model.Expenditure).get(id))
+            meta.Session.commit()
+
+    def test_full(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        page_size = int(config['history.page_size'])
+        ids = []
+        for i in xrange(page_size + 1):
+            e = model.Expenditure(user, 100, u'Full expenditure %d' % i)
+            meta.Session.add(e)
+            e.split({user: 1})
+            meta.Session.commit()
+            ids.append(e.id)
+
+        try:
+            response = self.app.get(url_for(controller='history',
+                                            action='full'))
+            self.assertEqual(response.header('Content-Type'),
+                             'text/html; charset=utf-8')
+            for i in xrange(page_size + 1):
+                response.mustcontain('Full expenditure %d' % i)
+            assert 'Older' not in response
+            assert '</html>' in response
+        finally:
+            for id in ids:
+                meta.Session.delete(
+                    meta.Session.query(model.Expenditure).get(id))
+            meta.Session.commit()
+
+    def test_balances(self):
+        response = self.app.get(url_for(controller='history',
+                                        action='balances'))
+        self.assertEqual(response.header('Content-Type'), 'application/json')
+        users = meta.Session.query(model.User).count()
+        self.assertEqual(len(simplejson.loads(response.body)['users']), users)
+
+    def test_user_balances(self):
+        user = meta.Session.query(model.User).first()
+        response = self.app.get(url_for(controller='history',
+                                        action='balances',
+                                        id=user.id))
+        data = simplejson.loads(response.body)
+        self.assertEqual([u['id'] for u in data['users']],
+                         [user.id])
+
+    def test_missing_user_balances(self):
+        self.app.get(url_for(controller='history', action='balances',
+                             id=12345),
+                     status=404)
+        self.app.get(url_for(controller='history', action='balances',
+                             id='bogus'),
+                     status=404)
@@ -0,0 +1,34 @@
+from datetime import date
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+
+class TestReportController(TestController):
+
+    def test_index(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        e = model.Expenditure(user, 4200, u'Pizza')
+        e.date = date(2009, 6, 5)
+        meta.Session.add(e)
+        e.split({user: 1})
+        e.tags.add(u'takeout')
+        meta.Session.commit()
+        id = e.id
+
+        try:
+            response = self.app.get(url_for(controller='report'),
+                                    params={'year': '2009'})
+            response.mustcontain('June 2009', 'takeout', '$42.00',
+                                 'Charlie Root')
+            response = self.app.get(url_for(controller='report'),
+                                    params={'year': '1999'})
+            response.mustcontain('Nothing tagged was spent in 1999')
+        finally:
+            meta.Session.execute(model.tag_to_expense_map.delete())
+            meta.Session.execute(model.tags.delete())
+            meta.Session.execute(model.tag_month_rollup.delete())
+            meta.Session.expire_all()
+            meta.Session.delete(meta.Session.query(model.Expenditure).get(id))
+            meta.Session.commit()
@@ -0,0 +1,60 @@
+from pylons import config
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+
+class TestSearchController(TestController):
+
+    def test_index(self):
+        response = self.app.get(url_for(controller='search'))
+        response.mustcontain('Search')
+
+    def test_search(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        e = model.Expenditure(user, 4200, u'Plumber visit')
+        meta.Session.add(e)
+        e.split({user: 1})
+        meta.Session.commit()
+
+        try:
+            response = self.app.get(url_for(controller='search'),
+                                    params={'q': 'plumb'})
+            response.mustcontain('Plumber visit', '$42.00',
+                                 'No transfers match')
+            response = self.app.get(url_for(controller='search'),
+                                    params={'q': 'electrician'})
+            response.mustcontain('No expenditures match')
+            self.app.get(url_for(controller='search'),
+                         params={'q': 'plumb', 'expenditures_after': 'x'},
+                         status=400)
+        finally:
+            meta.Session.delete(meta.Session.query(model.Expenditure).get(e.id))
+            meta.Session.commit()
+
+    def test_paging(self):
+        user = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        page_size = int(config['history.page_size'])
+        ids = []
+        for i in xrange(page_size + 1):
+            e = model.Expenditure(user, 100, u'Gutter cleaning %d' % i)
+            meta.Session.add(e)
+            e.split({user: 1})
+            meta.Session.commit()
+            ids.append(e.id)
+
+        try:
+            response = self.app.get(url_for(controller='search'),
+                                    params={'q': 'gutter'})
+            assert response.body.count('Gutter cleaning') == page_size
+            response = response.click('Older', index=0)
+            assert response.body.count('Gutter cleaning') == 1
+            response = response.click('Newer', index=0)
+            assert response.body.count('Gutter cleaning') == page_size
+        finally:
+            for id in ids:
+                meta.Session.delete(
+                    meta.Session.query(model.Expenditure).get(id))
+            meta.Session.commit()
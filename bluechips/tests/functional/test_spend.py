@@ -9,7 +9,7 @@ from bluechips import model
 from bluechips.model import meta
 from bluechips.model.types import Currency
 
-from bluechips.controllers.spend import ExpenditureSchema
+from bluechips.lib.schemas import ExpenditureSchema
 
 class TestSpendController(TestController):
 
@@ -92,6 +92,31 @@ class TestSpendController(TestController):
         response = response.form.submit('delete').follow()
         response.mustcontain('Expenditure', 'deleted')
 
+    def test_unused_tags_removed(self):
+        user = meta.Session.query(model.User).\
+                filter_by(name=u'Charlie Root').one()
+        e = model.Expenditure(user, 1000, u'Tagged', None)
+        e.even_split()
+        e.tags |= set([u'cake', u'dessert'])
+        meta.Session.add(e)
+        meta.Session.commit()
+        e_id = e.id
+
+        response = self.app.get(url_for(controller='spend',
+                                        action='edit',
+                                        id=e_id))
+        form = response.form
+        form['tags'] = u'cake'
+        form.submit().follow()
+        self.assertEqual([tag.name for tag in meta.Session.query(model.Tag)],
+                         [u'cake'])
+
+        response = self.app.get(url_for(controller='spend',
+                                        action='delete',
+                                        id=e_id))
+        response.form.submit('delete').follow()
+        self.assertEqual(meta.Session.query(model.Tag).count(), 0)
+
     def test_delete_nonexistent(self):
         self.app.get(url_for(controller='spend',
                              action='delete',
@@ -169,6 +194,45 @@ class TestSpendController(TestController):
         except Invalid:
             pass
 
+    def test_import(self):
+        response = self.app.get(url_for(controller='spend',
+                                        action='upload'))
+        response.mustcontain('Import Expenditures')
+        token = response.form[token_key].value
+
+        csv = ("date,amount,description,spender\n"
+               "2009-03-01,12.00,Groceries,root\n"
+               "2009-03-02,20.00,Pizza,ben\n")
+        response = self.app.post(url_for(controller='spend',
+                                         action='import_file'),
+                                 params={token_key: token,
+                                         'format': 'csv',
+                                         'spender_id': '1'},
+                                 upload_files=[('file', 'march.csv', csv)])
+        messages = response.req.environ['mailer.messages']
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].Subject,
+                         'BlueChips: 2 expenditures imported')
+        response = response.follow()
+        response.mustcontain('2 expenditures imported.')
+        self.assertEqual(meta.Session.query(model.Expenditure).count(), 2)
+
+    def test_import_bad_row(self):
+        response = self.app.get(url_for(controller='spend',
+                                        action='upload'))
+        token = response.form[token_key].value
+
+        csv = ("date,amount,description\n"
+               "2009-03-01,lots,Groceries\n")
+        response = self.app.post(url_for(controller='spend',
+                                         action='import_file'),
+                                 params={token_key: token,
+                                         'format': 'csv',
+                                         'spender_id': '1'},
+                                 upload_files=[('file', 'march.csv', csv)])
+        response.mustcontain('Line 2: amount')
+        self.assertEqual(meta.Session.query(model.Expenditure).count(), 0)
+
     def setUp(self):
         self.sample_params = {
             'spender_id': '1',
@@ -1,7 +1,144 @@
 from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.lib.totals import settle_strategies
 
 class TestStatusController(TestController):
 
     def test_index(self):
         response = self.app.get(url_for(controller='status'))
         # Test response...
+
+    def test_minimal_settle(self):
+        # The same books as TestMinimalSettle.test_fewer_transfers:
+        # greedy matching needs 4 transfers, but Ben and Gotta can
+        # settle up on their own
+        users = dict((user.username, user) for user in
+                     meta.Session.query(model.User))
+        eve = model.User(u'eve', u'Eve', True)
+        meta.Session.add(eve)
+        transfers = [model.Transfer(users[u'gotta'], users[u'root'], 300),
+                     model.Transfer(users[u'rich'], users[u'root'], 100),
+                     model.Transfer(users[u'rich'], users[u'ben'], 100),
+                     model.Transfer(eve, users[u'ben'], 200)]
+        meta.Session.add_all(transfers)
+        meta.Session.commit()
+        try:
+            response = self.app.get(url_for(controller='status'))
+            self.assertEqual(len(response.c.settle), 4)
+            self.assertEqual(response.c.settle_strategy, 'greedy')
+
+            response = self.app.get(url_for(controller='status',
+                                            settle='minimal'))
+            self.assertEqual(response.c.settle_strategy, 'minimal')
+            self.assertEqual(
+                sorted((f.username, t.username, int(amount))
+                       for f, t, amount in response.c.settle),
+                [(u'ben', u'gotta', 300),
+                 (u'root', u'eve', 200),
+                 (u'root', u'rich', 200)])
+            response.mustcontain('Showing the fewest transfers')
+        finally:
+            for t in transfers:
+                meta.Session.delete(t)
+            meta.Session.delete(eve)
+            meta.Session.commit()
+
+    def test_unknown_settle_strategy(self):
+        response = self.app.get(url_for(controller='status',
+                                        settle='bogus'))
+        self.assertEqual(response.c.settle_strategy, 'greedy')
+
+    def test_settlement_cache(self):
+        users = meta.Session.query(model.User).all()
+        t = model.Transfer(users[0], users[1], 1234)
+        meta.Session.add(t)
+        meta.Session.commit()
+
+        response = self.app.get(url_for(controller='status'))
+        stats = response.g.cache_stats
+        misses = stats['settlement']['misses']
+        hits = stats['settlement']['hits']
+
+        self.app.get(url_for(controller='status'))
+        self.assertEqual(stats['settlement']['misses'], misses)
+        self.assertEqual(stats['settlement']['hits'], hits + 1)
+
+        meta.Session.delete(t)
+        meta.Session.commit()
+        response = self.app.get(url_for(controller='status'))
+        self.assertEqual(stats['settlement']['misses'], misses + 1)
+        # New settlements replace old ones, rather than piling up
+        cache = response.g.cache.get_cache_region('settlement', 'ledger')
+        assert set(cache.namespace.keys()) <= set(settle_strategies)
+
+        response = self.app.get(url_for(controller='status',
+                                        action='cache'))
+        response.mustcontain('settlement: %d hits, %d misses' %
+                             (hits + 1, misses + 1))
+        response.mustcontain('users: ')
+
+    def test_ledger_version_read_once(self):
+        self.app.get(url_for(controller='status'))
+        response, statements = count_statements(
+            self.app.get, url_for(controller='status'))
+        self.assertEqual(len([s for s in statements
+                              if 'ledger.version' in s]), 1)
+
+    def test_conditional_get(self):
+        response = self.app.get(url_for(controller='status'))
+        etag = response.header('ETag')
+        self.app.get(url_for(controller='status'),
+                     headers={'If-None-Match': etag},
+                     status=304)
+
+        users = meta.Session.query(model.User).all()
+        t = model.Transfer(users[0], users[1], 1234)
+        meta.Session.add(t)
+        meta.Session.commit()
+        t_id = t.id
+        response = self.app.get(url_for(controller='status'),
+                                headers={'If-None-Match': etag})
+        self.assertNotEqual(response.header('ETag'), etag)
+
+        meta.Session.delete(meta.Session.query(model.Transfer).get(t_id))
+        meta.Session.commit()
+
+    def test_conditional_get_mobile(self):
+        response = self.app.get(url_for(controller='status'))
+        etag = response.header('ETag')
+        ua = 'Mozilla/5.0 (iPhone; U; CPU like Mac OS X; en)'
+        response = self.app.get(url_for(controller='status'),
+                                headers={'If-None-Match': etag,
+                                         'User-Agent': ua})
+        self.assertNotEqual(response.header('ETag'), etag)
+
+    def test_conditional_get_new_session(self):
+        # The mobile pages embed the session's form token, so a page
+        # from an old session mustn't be reused
+        ua = 'Mozilla/5.0 (iPhone; U; CPU like Mac OS X; en)'
+        self.app.get(url_for(controller='status'),
+                     headers={'User-Agent': ua})
+        response = self.app.get(url_for(controller='status'),
+                                headers={'User-Agent': ua})
+        etag = response.header('ETag')
+        self.app.get(url_for(controller='status'),
+                     headers={'If-None-Match': etag, 'User-Agent': ua},
+                     status=304)
+        self.app.cookies.clear()
+        response = self.app.get(url_for(controller='status'),
+                                headers={'If-None-Match': etag,
+                                         'User-Agent': ua},
+                                status=200)
+        self.assertNotEqual(response.header('ETag'), etag)
+
+    def test_conditional_get_no_session(self):
+        # Working out the ETag doesn't start a session
+        self.app.cookies.clear()
+        response = self.app.get(url_for(controller='status'))
+        self.app.cookies.clear()
+        response = self.app.get(url_for(controller='status'),
+                                headers={'If-None-Match':
+                                             response.header('ETag')},
+                                status=304)
+        self.assertEqual(response.all_headers('Set-Cookie'), [])
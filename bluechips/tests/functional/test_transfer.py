@@ -40,6 +40,61 @@ class TestTransferController(TestController):
         assert t.date == today
         assert t.description == u'A test transfer from Rich to Ben'
 
+    def test_notification_queued(self):
+        user_root = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        user_ben = meta.Session.query(model.User).\
+                filter_by(username=u'ben').one()
+        root_email = user_root.email
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.commit()
+        response = self.app.get(url_for(controller='transfer'))
+        form = response.form
+        form['debtor_id'] = user_root.id
+        form['creditor_id'] = user_ben.id
+        form['amount'] = '10.00'
+        response = form.submit()
+
+        messages = response.req.environ['mailer.messages']
+        self.assertEqual(len(messages), 1)
+        queued = meta.Session.execute(model.outbox.select()).fetchall()
+        self.assertEqual([(row.recipients, row.subject) for row in queued],
+                         [(root_email, messages[0].Subject)])
+
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.delete(meta.Session.query(model.Transfer).\
+                                order_by(model.Transfer.id.desc()).first())
+        meta.Session.commit()
+
+    def test_digest_queued(self):
+        user_root = meta.Session.query(model.User).\
+                filter_by(username=u'root').one()
+        user_ben = meta.Session.query(model.User).\
+                filter_by(username=u'ben').one()
+        user_root.digest = True
+        meta.Session.commit()
+        root_id, ben_id = user_root.id, user_ben.id
+
+        response = self.app.get(url_for(controller='transfer'))
+        form = response.form
+        form['debtor_id'] = root_id
+        form['creditor_id'] = ben_id
+        form['amount'] = '10.00'
+        response = form.submit()
+
+        assert 'mailer.messages' not in response.req.environ
+        pending = meta.Session.execute(
+            model.pending_notifications.select()).fetchall()
+        self.assertEqual([(row.user_id, row.summary) for row in pending],
+                         [(root_id, u'Transfer of $10.00 from Charlie Root '
+                           u'to Ben Bitdiddle created.')])
+
+        meta.Session.execute(model.pending_notifications.delete())
+        meta.Session.query(model.User).get(root_id).digest = False
+        meta.Session.delete(meta.Session.query(model.Transfer).\
+                                order_by(model.Transfer.id.desc()).first())
+        meta.Session.commit()
+
     def test_edit_and_delete(self):
         user_rich = meta.Session.query(model.User).\
                 filter_by(name=u'Rich Scheme').one()
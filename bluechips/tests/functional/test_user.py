@@ -35,3 +35,24 @@ class TestUserController(TestController):
                               action='update'),
                       {'new_email': 'malicious@example.com'},
                       status=403)
+
+    def test_digest(self):
+        response = self.app.get(url_for(controller='user', action='email'))
+        form = response.form
+        form['new_email'] = 'charlie@example.com'
+        form['digest'] = True
+        form.submit().follow()
+
+        user = meta.Session.query(model.User).\
+                filter_by(username=unicode(config['fake_username'])).one()
+        assert user.digest
+
+        response = self.app.get(url_for(controller='user', action='email'))
+        form = response.form
+        assert form['digest'].checked
+        form['digest'] = False
+        form.submit().follow()
+
+        user = meta.Session.query(model.User).\
+                filter_by(username=unicode(config['fake_username'])).one()
+        assert not user.digest
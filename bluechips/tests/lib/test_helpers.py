@@ -44,3 +44,6 @@ class TestHelpers(TestCase):
 
     def test_grab_amount(self):
         assert h.grab(None, 'amount') == 0
+
+    def test_format_currency(self):
+        assert h.format_currency(123456) == '$1,234.56'
@@ -0,0 +1,158 @@
+from unittest import TestCase
+from StringIO import StringIO
+from datetime import date
+from pylons import config
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model.types import Currency
+from bluechips.lib import importer
+
+sample_csv = """date,amount,description,spender,tags,root,ben
+2009-03-01,12.00,Groceries,root,"food, weekly",1,2
+03/02/2009,10.00,Pizza,ben,food,1,1
+"""
+
+sample_ofx = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20090305120000
+<TRNAMT>-45.67
+<NAME>HARDWARE STORE
+<MEMO>Shelves
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20090306<TRNAMT>5.00<NAME>REFUND</STMTTRN>
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+class TestParsers(TestCase):
+    def test_csv(self):
+        rows = list(importer.parse_csv(StringIO(sample_csv)))
+        self.assertEqual([line_num for line_num, row in rows], [2, 3])
+        self.assertEqual(rows[0][1]['tags'], u'food, weekly')
+        self.assertEqual(rows[1][1]['ben'], u'1')
+
+    def test_ofx(self):
+        rows = list(importer.parse_ofx(StringIO(sample_ofx)))
+        self.assertEqual(rows, [(7, {'amount': u'45.67',
+                                     'date': u'2009-03-05',
+                                     'description':
+                                         u'HARDWARE STORE - Shelves'}),
+                                (14, {'amount': u'-5.00',
+                                      'date': u'2009-03-06',
+                                      'description': u'REFUND'})])
+
+
+class TestImport(TestCase):
+    def setUp(self):
+        self.root = meta.Session.query(model.User).\
+            filter_by(username=u'root').one()
+        self.ben = meta.Session.query(model.User).\
+            filter_by(username=u'ben').one()
+
+    def tearDown(self):
+        # Expenditures cascade deletes to their tags, which goes wrong
+        # when tags are shared, so get rid of the tags first
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.expire_all()
+        deleteExpenditures()
+        meta.Session.commit()
+
+    def test_csv(self):
+        expenditures = importer.import_expenditures(
+            importer.parse_csv(StringIO(sample_csv)), batch_size=1)
+        self.assertEqual(len(expenditures), 2)
+
+        groceries, pizza = expenditures
+        self.assertEqual(groceries.spender, self.root)
+        self.assertEqual(groceries.date, date(2009, 3, 1))
+        self.assertEqual(groceries.share(self.ben), Currency('8.00'))
+        self.assertEqual(set(groceries.tags), set([u'food', u'weekly']))
+        self.assertEqual(pizza.spender, self.ben)
+        self.assertEqual(pizza.share(self.root), Currency('5.00'))
+        self.assertEqual(meta.Session.query(model.Tag).\
+                             filter_by(name=u'food').count(), 1)
+
+    def test_ofx_even_split(self):
+        expenditures = importer.import_expenditures(
+            importer.parse_ofx(StringIO(sample_ofx)), self.root)
+        hardware, refund = expenditures
+        self.assertEqual(hardware.amount, Currency('45.67'))
+        self.assertEqual(refund.amount, Currency('-5.00'))
+        residents = meta.Session.query(model.User).\
+            filter_by(resident=True).count()
+        self.assertEqual(len(hardware.splits), residents)
+        self.assertEqual(sum(sp.share for sp in hardware.splits),
+                         hardware.amount)
+
+    def test_send_digest(self):
+        # As from paster import-expenditures, with no request around
+        expenditures = importer.import_expenditures(
+            importer.parse_csv(StringIO(sample_csv)))
+        importer.send_digest(config['pylons.app_globals'], expenditures)
+        meta.Session.commit()
+        subjects = [subject for (subject,) in meta.Session.execute(
+                model.outbox.select().with_only_columns(
+                    [model.outbox.c.subject]))]
+        self.assertEqual(subjects,
+                         [u'BlueChips: 2 expenditures imported'])
+
+    def test_send_digest_statements(self):
+        # Loading each expenditure's spender and splits shouldn't take
+        # a query per expenditure
+        counts = []
+        for csv in (sample_csv, sample_csv + sample_csv.split('\n', 1)[1]):
+            expenditures = importer.import_expenditures(
+                importer.parse_csv(StringIO(csv)))
+            result, statements = count_statements(
+                importer.send_digest, config['pylons.app_globals'],
+                expenditures)
+            meta.Session.rollback()
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_rows_streamed(self):
+        def rows():
+            for line_num, row in importer.parse_csv(StringIO(sample_csv)):
+                # Each batch is saved before the next row is read
+                self.assertEqual(meta.Session.query(model.Expenditure).\
+                                     count(), line_num - 2)
+                yield line_num, row
+        importer.import_expenditures(rows(), batch_size=1)
+        self.assertEqual(meta.Session.query(model.Expenditure).count(), 2)
+
+    def test_bad_row_after_batch(self):
+        bad = sample_csv + "2009-03-03,zero,Oops,root,,1,1\n"
+        try:
+            importer.import_expenditures(importer.parse_csv(StringIO(bad)),
+                                         batch_size=1)
+        except importer.InvalidImport, e:
+            self.assertEqual([line_num for line_num, error in e.errors],
+                             [4])
+        else:
+            raise AssertionError
+        self.assertEqual(meta.Session.query(model.Expenditure).count(), 0)
+        self.assertEqual(meta.Session.query(model.Tag).count(), 0)
+
+    def test_bad_rows(self):
+        bad = sample_csv + "2009-03-03,zero,Oops,root,,1,1\n" + \
+            "2009-03-04,1.00,Nobody,nobody,,1,1\n"
+        try:
+            importer.import_expenditures(importer.parse_csv(StringIO(bad)))
+        except importer.InvalidImport, e:
+            self.assertEqual([line_num for line_num, error in e.errors],
+                             [4, 5])
+            assert 'amount' in e.errors[0][1]
+            assert 'spender' in e.errors[1][1]
+        else:
+            raise AssertionError
+        self.assertEqual(meta.Session.query(model.Expenditure).count(), 0)
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from pylons import config
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.lib import notifications
+from bluechips.lib.totals import debts
+
+
+class TestDigests(TestCase):
+    def setUp(self):
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.commit()
+        self.root = meta.Session.query(model.User).\
+            filter_by(username=u'root').one()
+        self.ben = meta.Session.query(model.User).\
+            filter_by(username=u'ben').one()
+
+    def tearDown(self):
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.execute(model.pending_notifications.delete())
+        meta.Session.commit()
+
+    def queued(self):
+        return meta.Session.execute(model.outbox.select()).fetchall()
+
+    def send(self, now):
+        return notifications.send_digests(
+            meta.Session, config['pylons.app_globals'].mako_lookup,
+            u'root@localhost', 3600, now)
+
+    def test_digest(self):
+        for i in range(3):
+            notifications.queue(meta.Session, [self.root, self.ben],
+                                u'Change %d' % i)
+        meta.Session.commit()
+
+        now = datetime.utcnow()
+        self.assertEqual(self.send(now + timedelta(minutes=30)), 0)
+        self.assertEqual(self.queued(), [])
+
+        # Ben has no email address, so his changes are just dropped
+        self.assertEqual(self.send(now + timedelta(hours=1)), 1)
+        meta.Session.commit()
+        digest, = self.queued()
+        self.assertEqual(digest.recipients, self.root.email)
+        self.assertEqual(digest.subject, u'BlueChips: 3 changes')
+        for i in range(3):
+            assert u'Change %d' % i in digest.message
+        balance = debts()[self.root]
+        if balance > 0:
+            assert u'You owe the group %s' % balance in digest.message
+        elif balance < 0:
+            assert u'The group owes you %s' % abs(balance) in digest.message
+        else:
+            assert u'settled up' in digest.message
+
+        self.assertEqual(meta.Session.execute(
+                model.pending_notifications.select()).fetchall(), [])
+        self.assertEqual(self.send(now + timedelta(hours=2)), 0)
+
+    def test_single_change(self):
+        notifications.queue(meta.Session, [self.root], u'Only change')
+        meta.Session.commit()
+        self.assertEqual(self.send(datetime.utcnow() + timedelta(hours=1)),
+                         1)
+        meta.Session.commit()
+        digest, = self.queued()
+        self.assertEqual(digest.subject, u'BlueChips: 1 change')
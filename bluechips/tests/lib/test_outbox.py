@@ -0,0 +1,160 @@
+import asyncore
+import smtpd
+import smtplib
+import socket
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from mailer import Message
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.lib import outbox
+
+
+class StandInServer(smtpd.SMTPServer):
+    "An SMTP server which keeps what it's sent."
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+class FailingTransport(object):
+    def __init__(self, error):
+        self.error = error
+        self.attempts = 0
+
+    def send(self, sender, recipients, message):
+        self.attempts += 1
+        raise self.error
+
+    def close(self):
+        pass
+
+
+def message(to=u'ben@example.com', subject=u'Test'):
+    msg = Message(From=u'root@localhost', To=to)
+    msg.Subject = subject
+    msg.Body = u'Testing'
+    return msg
+
+
+class TestOutbox(TestCase):
+    def setUp(self):
+        # Earlier tests leave their notifications behind
+        self.tearDown()
+
+    def tearDown(self):
+        meta.Session.execute(model.outbox.delete())
+        meta.Session.commit()
+
+    def rows(self):
+        return meta.Session.execute(model.outbox.select().\
+                                        order_by(model.outbox.c.id)).\
+                                        fetchall()
+
+    def test_enqueue_in_transaction(self):
+        outbox.enqueue(meta.Session, message())
+        meta.Session.rollback()
+        self.assertEqual(self.rows(), [])
+
+        outbox.enqueue(meta.Session, message([u'a@example.com',
+                                              u'b@example.com']))
+        meta.Session.commit()
+        row, = self.rows()
+        self.assertEqual(row.status, u'pending')
+        self.assertEqual(row.recipients, u'a@example.com\nb@example.com')
+        self.assertEqual(row.subject, u'Test')
+
+    def test_send(self):
+        server = StandInServer()
+        thread = threading.Thread(target=asyncore.loop,
+                                  kwargs=dict(timeout=0.05))
+        thread.start()
+        try:
+            for i in range(3):
+                outbox.enqueue(meta.Session, message(subject=u'Test %d' % i))
+            meta.Session.commit()
+            worker = outbox.OutboxWorker(
+                outbox.SMTPTransport('127.0.0.1', server.port), batch_size=2)
+            self.assertEqual(worker.drain(), 3)
+        finally:
+            server.close()
+            thread.join()
+
+        self.assertEqual(len(server.messages), 3)
+        self.assertEqual(server.connections, 1)
+        mailfrom, rcpttos, data = server.messages[0]
+        self.assertEqual(rcpttos, ['ben@example.com'])
+        assert 'Subject: Test 0' in data
+        self.assertEqual(self.rows(), [])
+
+    def test_retry(self):
+        outbox.enqueue(meta.Session, message())
+        outbox.enqueue(meta.Session, message())
+        meta.Session.commit()
+        now = datetime.utcnow()
+        transport = FailingTransport(socket.error('Connection refused'))
+        worker = outbox.OutboxWorker(transport, max_attempts=3,
+                                     retry_delay=60)
+
+        self.assertEqual(worker.drain(now), 0)
+        # The connection failed, so the second message wasn't tried
+        self.assertEqual(transport.attempts, 1)
+        first, second = self.rows()
+        self.assertEqual((first.status, first.attempts), (u'pending', 1))
+        self.assertEqual(first.next_attempt, now + timedelta(seconds=60))
+        self.assertEqual(second.attempts, 0)
+        self.assertEqual(second.next_attempt, first.next_attempt)
+        assert 'Connection refused' in first.last_error
+
+        # Not due yet
+        worker.drain(now + timedelta(seconds=30))
+        self.assertEqual(transport.attempts, 1)
+
+        worker.drain(now + timedelta(seconds=60))
+        first, second = self.rows()
+        self.assertEqual(first.attempts, 2)
+        self.assertEqual(first.next_attempt, now + timedelta(seconds=180))
+
+        worker.drain(now + timedelta(seconds=180))
+        first, second = self.rows()
+        self.assertEqual((first.status, first.attempts), (u'dead', 3))
+
+        self.assertEqual(outbox.retry_dead(meta.Session), 1)
+        meta.Session.commit()
+        first, second = self.rows()
+        self.assertEqual((first.status, first.attempts), (u'pending', 0))
+
+    def test_rejected(self):
+        outbox.enqueue(meta.Session, message())
+        outbox.enqueue(meta.Session, message())
+        meta.Session.commit()
+        transport = FailingTransport(smtplib.SMTPRecipientsRefused(
+                {'ben@example.com': (550, 'No such user')}))
+        outbox.OutboxWorker(transport).drain()
+        self.assertEqual(transport.attempts, 2)
+        self.assertEqual([row.status for row in self.rows()],
+                         [u'dead', u'dead'])
+
+    def test_stale_claim(self):
+        outbox.enqueue(meta.Session, message())
+        meta.Session.commit()
+        now = datetime.utcnow()
+        meta.Session.execute(model.outbox.update().values(
+                status=u'sending', next_attempt=now - timedelta(hours=1)))
+        meta.Session.commit()
+        worker = outbox.OutboxWorker(outbox.LogTransport())
+        self.assertEqual(worker.drain(now), 1)
+        self.assertEqual(self.rows(), [])
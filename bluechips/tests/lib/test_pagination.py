@@ -0,0 +1,77 @@
+from unittest import TestCase
+from datetime import date, datetime
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.lib import pagination
+
+class TestKeysetPage(TestCase):
+    def setUp(self):
+        users = meta.Session.query(model.User).all()
+        entered = [(date(2009, 1, 1), datetime(2009, 1, 1, 12)),
+                   (date(2009, 1, 1), datetime(2009, 1, 1, 12)),
+                   (date(2009, 1, 1), None),
+                   (date(2009, 1, 1), datetime(2009, 1, 2, 9, 30, 0, 5)),
+                   (date(2009, 2, 1), None),
+                   (date(2009, 2, 1), datetime(2009, 2, 1)),
+                   (date(2008, 12, 31), datetime(2009, 1, 5))]
+        ts = []
+        for d, time in entered:
+            t = model.Transfer(users[0], users[1], 100)
+            t.date = d
+            meta.Session.add(t)
+            ts.append((t, time))
+        meta.Session.commit()
+        for t, time in ts:
+            meta.Session.execute(model.transfers.update().\
+                                     where(model.transfers.c.id == t.id).\
+                                     values(entered_time=time))
+        meta.Session.commit()
+        self.ids = [t.id for t, time in ts]
+
+        self.columns = [model.transfers.c.date,
+                        model.transfers.c.entered_time,
+                        model.transfers.c.id]
+        self.query = meta.Session.query(model.Transfer).\
+            filter(model.Transfer.id.in_(self.ids))
+        self.expected = [t.id for t in self.query.order_by(None).\
+                             order_by(*[c.desc() for c in self.columns])]
+
+    def tearDown(self):
+        for t in self.query:
+            meta.Session.delete(t)
+        meta.Session.commit()
+
+    def test_forwards(self):
+        seen = []
+        page = pagination.keyset_page(self.query, self.columns,
+                                      page_size=3)
+        self.assertEqual(page.newer, None)
+        while True:
+            seen.extend(t.id for t in page)
+            if page.older is None:
+                break
+            page = pagination.keyset_page(self.query, self.columns,
+                                          after=page.older, page_size=3)
+        self.assertEqual(seen, self.expected)
+
+    def test_backwards(self):
+        pages = []
+        page = pagination.keyset_page(self.query, self.columns,
+                                      page_size=2)
+        while page.older is not None:
+            page = pagination.keyset_page(self.query, self.columns,
+                                          after=page.older, page_size=2)
+        while True:
+            pages.insert(0, [t.id for t in page])
+            if page.newer is None:
+                break
+            page = pagination.keyset_page(self.query, self.columns,
+                                          before=page.newer, page_size=2)
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(len(pages[0]), 2)
+
+    def test_bad_cursor(self):
+        self.assertRaises(ValueError, pagination.keyset_page,
+                          self.query, self.columns, after='garbage')
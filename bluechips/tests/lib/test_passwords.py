@@ -0,0 +1,30 @@
+from unittest import TestCase
+from bluechips.lib import passwords
+
+class TestPasswords(TestCase):
+    def test_hash(self):
+        stored = passwords.hash_password(u'secret', iterations=1000)
+        assert stored.startswith(u'pbkdf2_sha256$1000$')
+        assert len(stored) <= 128
+        assert stored != passwords.hash_password(u'secret', iterations=1000)
+        assert passwords.check_password(u'secret', stored)
+        assert not passwords.check_password(u'Secret', stored)
+        assert passwords.needs_rehash(stored)
+        assert not passwords.needs_rehash(passwords.hash_password(u'secret'))
+
+    def test_unicode(self):
+        stored = passwords.hash_password(u'\xfcber', iterations=1000)
+        assert passwords.check_password(u'\xfcber', stored)
+
+    def test_plain_text(self):
+        assert passwords.check_password(u'secret', u'secret')
+        assert not passwords.check_password(u'secret', u'other')
+        assert passwords.needs_rehash(u'secret')
+
+    def test_no_password(self):
+        assert not passwords.check_password(u'', None)
+        assert not passwords.check_password(u'', u'')
+
+    def test_malformed(self):
+        assert not passwords.check_password(u'secret', u'pbkdf2_sha256$x')
+        assert passwords.needs_rehash(u'pbkdf2_sha256$x')
@@ -1,5 +1,10 @@
 from unittest import TestCase
+from bluechips.tests import *
+from bluechips import model
 from bluechips.lib import permissions
+from bluechips.lib.passwords import hash_password, is_hashed
+from bluechips.model import meta
+from bluechips.model.ledger import bump_version, current_version
 
 class TestReorderingSettle(TestCase):
     def test_authenticate(self):
@@ -7,3 +12,91 @@ class TestReorderingSettle(TestCase):
         assert not permissions.authenticate({}, u'root', u'blah')
         assert not permissions.authenticate({}, u'blah', u'charliepass')
         assert not permissions.authenticate({}, u'blah', u'blah')
+
+    def test_rehash(self):
+        assert permissions.authenticate({}, u'root', u'charliepass')
+        root = meta.directory.by_username(meta.Session, u'root')
+        assert is_hashed(root.password)
+        assert root.check_password(u'charliepass')
+
+    def test_rehash_keeps_ledger_version(self):
+        # Nothing on any page changes, so cached pages are still good
+        root = meta.directory.by_username(meta.Session, u'root')
+        root.password = u'charliepass'
+        meta.Session.commit()
+        version = current_version(meta.Session)
+        assert permissions.authenticate({}, u'root', u'charliepass')
+        assert is_hashed(root.password)
+        self.assertEqual(current_version(meta.Session), version)
+
+
+class TestCredentialCache(TestCase):
+    def setUp(self):
+        self.checked = []
+        def check(environ, username, password):
+            self.checked.append(username)
+            return permissions.authenticate(environ, username, password)
+        self.cache = permissions.CredentialCache(check, size=2)
+
+    def tearDown(self):
+        meta.directory.check_interval = 1
+        root = meta.directory.by_username(meta.Session, u'root')
+        root.password = u'charliepass'
+        meta.Session.commit()
+
+    def test_cached(self):
+        assert self.cache({}, u'root', u'charliepass')
+        assert self.cache({}, u'root', u'charliepass')
+        self.assertEqual(self.checked, [u'root'])
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+        assert not self.cache({}, u'root', u'blah')
+        assert not self.cache({}, u'root', u'blah')
+        self.assertEqual(len(self.checked), 3)
+
+    def test_hit_runs_no_statements(self):
+        assert self.cache({}, u'root', u'charliepass')
+        result, statements = count_statements(self.cache, {}, u'root',
+                                               u'charliepass')
+        assert result
+        self.assertEqual(statements, [])
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+    def test_expiry(self):
+        self.cache.ttl = -1
+        assert self.cache({}, u'root', u'charliepass')
+        assert self.cache({}, u'root', u'charliepass')
+        self.assertEqual(len(self.checked), 2)
+
+    def test_size(self):
+        assert self.cache({}, u'root', u'charliepass')
+        root = meta.directory.by_username(meta.Session, u'root')
+        self.cache._remember('a', root.password)
+        self.cache._remember('b', root.password)
+        assert self.cache({}, u'root', u'charliepass')
+        self.assertEqual(len(self.checked), 2)
+
+    def test_password_change(self):
+        assert self.cache({}, u'root', u'charliepass')
+        root = meta.directory.by_username(meta.Session, u'root')
+        root.set_password(u'newpass')
+        meta.Session.commit()
+        assert not self.cache({}, u'root', u'charliepass')
+        assert self.cache({}, u'root', u'newpass')
+
+    def test_password_changed_elsewhere(self):
+        # Other processes' changes are noticed once the directory next
+        # checks for them
+        meta.directory.check_interval = 0
+        assert self.cache({}, u'root', u'charliepass')
+        # As another process would, without this one's extensions
+        conn = meta.engine.connect()
+        trans = conn.begin()
+        conn.execute(model.users.update().\
+                         where(model.users.c.username == u'root').\
+                         values(password=hash_password(u'newpass')))
+        bump_version(conn, 'users_version')
+        trans.commit()
+        conn.close()
+        assert not self.cache({}, u'root', u'charliepass')
+        assert self.cache({}, u'root', u'newpass')
@@ -1,5 +1,15 @@
 from unittest import TestCase
+from datetime import date
+from decimal import Decimal
+
+import sqlalchemy as sa
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model.types import Currency
 from bluechips.lib import totals
+from bluechips.model.ledger import bump_version, current_version
 
 class TestReorderingSettle(TestCase):
     def test_transfer_minimized(self):
@@ -30,6 +40,21 @@ class TestReorderingSettle(TestCase):
         assert transfers == [('Bob', 'Charlie', 50),
                              ('Bob', 'Alice', 50)]
 
+    def test_settle_ties(self):
+        """
+        Test that ties are broken the same way the original
+        re-sort-every-iteration implementation broke them.
+        """
+        transfers = totals.settle({'Alice': 30,
+                                   'Bob': 30,
+                                   'Charlie': -20,
+                                   'Dave': -20,
+                                   'Eve': -20})
+        self.assertEqual(transfers, [('Bob', 'Charlie', 20),
+                                     ('Alice', 'Eve', 20),
+                                     ('Alice', 'Dave', 10),
+                                     ('Bob', 'Dave', 10)])
+
     def test_settle_uneven_positive(self):
         try:
             transfers = totals.settle({'Alice': -50,
@@ -45,3 +70,315 @@ class TestReorderingSettle(TestCase):
                                        'Charlie': 50})
         except totals.DirtyBooks:
             pass
+
+class TestMinimalSettle(TestCase):
+    def assertSettles(self, debts, transfers):
+        balances = dict(debts)
+        for debtor, creditor, amount in transfers:
+            balances[debtor] -= amount
+            balances[creditor] += amount
+        assert all(amount == 0 for amount in balances.itervalues())
+
+    def test_fewer_transfers(self):
+        """
+        Test that groups who can settle among themselves are found.
+
+        Greedy matching needs 4 transfers here, but Bob and Charlie can
+        settle up on their own, leaving 2 more for everyone else.
+        """
+        debts = {'Alice': 4,
+                 'Bob': 3,
+                 'Charlie': -3,
+                 'Dave': -2,
+                 'Eve': -2}
+        self.assertEqual(len(totals.settle(debts)), 4)
+        transfers = totals.settle_minimal(debts)
+        self.assertEqual(len(transfers), 3)
+        assert ('Bob', 'Charlie', 3) in transfers
+        self.assertSettles(debts, transfers)
+
+    def test_never_worse_than_greedy(self):
+        debts = {'Alice': 100,
+                 'Bob': -85,
+                 'Charlie': 35,
+                 'Dave': -35,
+                 'Eve': -15}
+        transfers = totals.settle_minimal(debts)
+        self.assertEqual(len(transfers), 3)
+        self.assertSettles(debts, transfers)
+
+    def test_groups_within_half(self):
+        """
+        Test that a group which settles up on its own is found when
+        it's entirely in one half of the meet-in-the-middle search.
+
+        People 1-4 and 5-8 each owe each other nothing overall, but no
+        pair or triple does, so 6 transfers are enough.
+        """
+        debts = dict(enumerate([-51, 16, -27, 62, 48, -2, 26, -72], 1))
+        transfers = totals.settle_minimal(debts, time_budget=5)
+        self.assertEqual(len(transfers), 6)
+        self.assertSettles(debts, transfers)
+
+    def test_out_of_time(self):
+        debts = {'Alice': 4,
+                 'Bob': 3,
+                 'Charlie': -3,
+                 'Dave': -2,
+                 'Eve': -2}
+        transfers = totals.settle_minimal(debts, time_budget=-1)
+        self.assertEqual(transfers, totals.settle(debts))
+
+    def test_settle_even(self):
+        self.assertEqual(totals.settle_minimal({'Alice': 0, 'Bob': 0}), [])
+
+class TestBalances(TestCase):
+    def setUp(self):
+        self.users = meta.Session.query(model.User).all()
+
+    def tearDown(self):
+        deleteExpenditures()
+        map(meta.Session.delete, meta.Session.query(model.Transfer))
+        meta.Session.execute(model.balance_checkpoints.delete())
+        meta.Session.commit()
+
+    def spend(self, spender, amount, when=None):
+        e = model.Expenditure(spender, amount)
+        if when is not None:
+            e.date = when
+        meta.Session.add(e)
+        split_dict = dict((u, Decimal(1)) for u in self.users)
+        split_text_dict = dict((u, u'1') for u in self.users)
+        e.split(split_dict, split_text_dict)
+        meta.Session.commit()
+        return e
+
+    def assertConsistent(self):
+        self.assertEqual(totals.verify_balances(), {})
+        computed = totals.compute_balances()
+        for user, balance in totals.debts().iteritems():
+            self.assertEqual(balance, computed[user.id])
+
+    def test_new_expenditures(self):
+        self.spend(self.users[0], Currency('100.00'))
+        self.spend(self.users[1], Currency('33.33'))
+        self.assertConsistent()
+
+    def test_edit_expenditure(self):
+        e = self.spend(self.users[0], Currency('100.00'))
+        e.amount = Currency('12.34')
+        e.spender = self.users[-1]
+        e.split(dict((u, Decimal(1)) for u in self.users[:2]),
+                dict((u, u'1') for u in self.users[:2]))
+        meta.Session.commit()
+        self.assertConsistent()
+
+    def test_delete_expenditure(self):
+        e = self.spend(self.users[0], Currency('100.00'))
+        meta.Session.delete(e)
+        meta.Session.commit()
+        self.assertConsistent()
+
+    def test_transfers(self):
+        t = model.Transfer(self.users[0], self.users[1], Currency('10.00'))
+        meta.Session.add(t)
+        meta.Session.commit()
+        self.assertConsistent()
+
+        t.amount = Currency('25.00')
+        t.creditor = self.users[2]
+        meta.Session.commit()
+        self.assertConsistent()
+
+        meta.Session.delete(t)
+        meta.Session.commit()
+        self.assertConsistent()
+
+    def test_compute_balances_by_id(self):
+        self.spend(self.users[0], Currency('100.00'))
+        self.spend(self.users[1], Currency('33.33'))
+        balances = totals.compute_balances()
+        self.assertEqual(sorted(balances.keys()),
+                         sorted(u.id for u in self.users))
+        self.assertEqual(sum(balances.values()), 0)
+
+    def test_as_of(self):
+        self.spend(self.users[0], Currency('100.00'), date(2009, 1, 15))
+        self.spend(self.users[1], Currency('50.00'), date(2009, 2, 15))
+        self.spend(self.users[2], Currency('20.00'), date(2009, 3, 15))
+
+        expected = totals.compute_balances(through=date(2009, 2, 28))
+        self.assertEqual(expected[self.users[1].id], Currency('-12.50'))
+        for user, balance in totals.debts(date(2009, 2, 28)).iteritems():
+            self.assertEqual(balance, expected[user.id])
+
+        # The same answers should come out once there are checkpoints
+        totals.create_checkpoint(date(2009, 1, 31))
+        totals.create_checkpoint(date(2009, 2, 28))
+        meta.Session.commit()
+        for user, balance in totals.debts(date(2009, 2, 28)).iteritems():
+            self.assertEqual(balance, expected[user.id])
+        later = totals.compute_balances()
+        for user, balance in totals.debts(date(2009, 3, 31)).iteritems():
+            self.assertEqual(balance, later[user.id])
+
+    def test_checkpoints_invalidated(self):
+        self.spend(self.users[0], Currency('100.00'), date(2009, 1, 15))
+        e = self.spend(self.users[1], Currency('50.00'), date(2009, 3, 15))
+        totals.create_checkpoint(date(2009, 1, 31))
+        totals.create_checkpoint(date(2009, 3, 31))
+        meta.Session.commit()
+
+        e.date = date(2009, 2, 1)
+        e.amount = Currency('60.00')
+        meta.Session.commit()
+        remaining = [d for (d,) in meta.Session.execute(
+                sa.select([model.balance_checkpoints.c.date]).distinct())]
+        self.assertEqual(remaining, [date(2009, 1, 31)])
+
+        expected = totals.compute_balances(through=date(2009, 3, 31))
+        for user, balance in totals.debts(date(2009, 3, 31)).iteritems():
+            self.assertEqual(balance, expected[user.id])
+
+    def test_bump_version_race(self):
+        ledger = model.ledger
+        meta.Session.execute(ledger.delete())
+        class Racing(object):
+            "Another process creates the ledger row just after we look"
+            first = True
+            def execute(self, clause):
+                result = meta.Session.execute(clause)
+                if self.first:
+                    self.first = False
+                    meta.Session.execute(ledger.insert().values(
+                            id=1, epoch=u'other', version=5))
+                return result
+        bump_version(Racing())
+        self.assertEqual(current_version(meta.Session), (u'other', 6))
+        meta.Session.rollback()
+
+    def test_rebuild(self):
+        self.spend(self.users[0], Currency('100.00'))
+        meta.Session.execute(model.balances.delete())
+        meta.Session.commit()
+        assert totals.verify_balances() != {}
+
+        totals.rebuild_balances()
+        meta.Session.commit()
+        self.assertConsistent()
+
+    def test_balance_history(self):
+        self.spend(self.users[0], Currency('100.00'), date(2009, 1, 15))
+        self.spend(self.users[1], Currency('40.00'), date(2009, 1, 15))
+        t = model.Transfer(self.users[0], self.users[1], Currency('10.00'))
+        t.date = date(2009, 2, 1)
+        meta.Session.add(t)
+        meta.Session.commit()
+
+        history = list(totals.balance_history(chunk_size=2))
+        self.assertEqual([d for d, _, _ in history],
+                         sorted(d for d, _, _ in history))
+        self.assertEqual(len([h for h in history
+                              if h[0] == date(2009, 1, 15)]),
+                         len(self.users))
+
+        final = dict((user_id, balance) for _, user_id, balance in history)
+        self.assertEqual(final, totals.compute_balances())
+
+        mine = list(totals.balance_history(user_id=self.users[0].id))
+        self.assertEqual(mine, [h for h in history
+                                if h[1] == self.users[0].id])
+
+
+class TestWithShares(TestCase):
+    def setUp(self):
+        self.users = meta.Session.query(model.User).all()
+        e = model.Expenditure(self.users[0], Currency('10.00'))
+        meta.Session.add(e)
+        e.split(dict([(self.users[0], Decimal(1)),
+                      (self.users[1], Decimal(3))]))
+        e = model.Expenditure(self.users[2], Currency('5.00'))
+        meta.Session.add(e)
+        e.split(dict([(self.users[1], Decimal(1))]))
+        meta.Session.commit()
+
+    def tearDown(self):
+        deleteExpenditures()
+        meta.Session.commit()
+
+    def test_matches_objects(self):
+        for user in self.users:
+            rows = totals.with_shares(
+                meta.Session.query(model.Expenditure), user).all()
+            self.assertEqual(len(rows), 2)
+            for e, share, involved in rows:
+                self.assertEqual(share, e.share(user))
+                self.assertEqual(bool(involved), e.involves(user))
+
+    def test_only_involved(self):
+        rows = totals.with_shares(meta.Session.query(model.Expenditure),
+                                  self.users[0], only_involved=True).all()
+        self.assertEqual([e.spender for e, share, involved in rows],
+                         [self.users[0]])
+        self.assertEqual(rows[0][1], Currency('2.50'))
+
+class TestTagTotals(TestCase):
+    def setUp(self):
+        self.users = meta.Session.query(model.User).all()
+        e = model.Expenditure(self.users[0], Currency('10.00'))
+        meta.Session.add(e)
+        e.split(dict([(self.users[0], Decimal(1)),
+                      (self.users[1], Decimal(3))]))
+        e.tags.update([u'food', u'fun'])
+        e = model.Expenditure(self.users[2], Currency('5.00'))
+        meta.Session.add(e)
+        e.split(dict([(self.users[1], Decimal(1))]))
+        e.tags.add(u'food')
+        meta.Session.commit()
+        self.tags = dict((tag.name, tag.id)
+                         for tag in meta.Session.query(model.Tag))
+
+    def tearDown(self):
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.expire_all()
+        deleteExpenditures()
+        meta.Session.commit()
+
+    def test_tag_totals(self):
+        food, fun = self.tags[u'food'], self.tags[u'fun']
+        self.assertEqual(totals.tag_totals(self.users[1]),
+                         {food: (Currency('15.00'), Currency('12.50')),
+                          fun: (Currency('10.00'), Currency('7.50'))})
+        self.assertEqual(totals.tag_totals(self.users[2], [food]),
+                         {food: (Currency('15.00'), Currency(0))})
+
+class TestPeriodTotals(TestCase):
+    def setUp(self):
+        self.users = meta.Session.query(model.User).all()
+        for amount, d, shares in ((1000, date(2009, 1, 15), (1, 1)),
+                                  (600, date(2009, 2, 1), (0, 1)),
+                                  (300, date(2009, 3, 31), (2, 1))):
+            e = model.Expenditure(self.users[0], amount)
+            e.date = d
+            meta.Session.add(e)
+            e.split(dict(zip(self.users[:2], map(Decimal, shares))))
+        meta.Session.commit()
+
+    def tearDown(self):
+        deleteExpenditures()
+        meta.Session.commit()
+
+    def test_period_totals(self):
+        periods = [('Total', None, None),
+                   ('From February', date(2009, 2, 1), None),
+                   ('February', date(2009, 2, 1), date(2009, 3, 1)),
+                   ('Before February', None, date(2009, 2, 1))]
+        result = totals.period_totals(periods, self.users[0])
+        self.assertEqual(result,
+                         {'Total': {'all': 1900, 'mine': 700},
+                          'From February': {'all': 900, 'mine': 200},
+                          'February': {'all': 600, 'mine': 0},
+                          'Before February': {'all': 1000, 'mine': 500}})
+        result = totals.period_totals(periods, self.users[2])
+        self.assertEqual(result['Total'], {'all': 1900, 'mine': 0})
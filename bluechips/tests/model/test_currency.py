@@ -1,3 +1,5 @@
+import locale
+from decimal import Decimal
 from unittest import TestCase
 from bluechips.model import types
 
@@ -17,3 +19,72 @@ class TestCurrency(TestCase):
         val = long(self.c)
         assert val == 1234
         assert type(val) == long
+
+    def test_currency_exact_parsing(self):
+        assert int(types.Currency('0.29')) == 29
+        assert int(types.Currency('-0.29')) == -29
+        assert int(types.Currency('12.345')) == 1234
+
+    def test_currency_arithmetic(self):
+        for result in (self.c + 1, 1 + self.c, self.c - 1, 1 - self.c,
+                       self.c * 2, 2 * self.c, self.c / 2, -self.c,
+                       abs(-self.c), sum([self.c, self.c])):
+            assert isinstance(result, types.Currency)
+        assert self.c + 1 == 1235
+        assert 2000 - self.c == 766
+        assert self.c * Decimal('0.5') == 617
+        assert Decimal('0.5') * self.c == 617
+        assert self.c / 3 == 411
+
+    def test_currency_empty_string(self):
+        assert self.c != ''
+        assert self.c > ''
+
+    def test_currency_hash(self):
+        assert {types.Currency(1234): True}[1234]
+        assert not types.Currency(0)
+
+    def test_currency_str(self):
+        assert str(types.Currency(-123456)) == '-$1,234.56'
+        assert repr(self.c) == 'Currency("$12.34")'
+
+
+class TestCurrencyFormatter(TestCase):
+    def assertMatchesLocale(self, **changes):
+        conv = locale.localeconv()
+        conv.update(changes)
+        formatter = types.CurrencyFormatter(conv)
+        old_localeconv = locale.localeconv
+        locale.localeconv = lambda: conv
+        try:
+            for cents in (0, 1, -1, 99, -100, 12345, -123456, 100000000,
+                          -98765432101):
+                self.assertEqual(formatter(cents),
+                                 locale.currency(cents / 100.,
+                                                 grouping=True))
+        finally:
+            locale.localeconv = old_localeconv
+
+    def test_default(self):
+        self.assertMatchesLocale()
+
+    def test_sign_positions(self):
+        for posn in range(5):
+            self.assertMatchesLocale(n_sign_posn=posn, p_sign_posn=posn,
+                                     positive_sign='+')
+
+    def test_symbol_placement(self):
+        self.assertMatchesLocale(p_cs_precedes=0, n_cs_precedes=0,
+                                 p_sep_by_space=1, n_sep_by_space=1)
+
+    def test_grouping(self):
+        self.assertMatchesLocale(mon_grouping=[3, 2, 0])
+        self.assertMatchesLocale(mon_grouping=[3, locale.CHAR_MAX])
+        self.assertMatchesLocale(mon_grouping=[])
+        self.assertMatchesLocale(mon_thousands_sep='')
+        self.assertMatchesLocale(mon_thousands_sep='.',
+                                 mon_decimal_point=',')
+
+    def test_accepts_currency(self):
+        self.assertEqual(types.format_currency(types.Currency('-1234.5')),
+                         '-$1,234.50')
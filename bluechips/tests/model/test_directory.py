@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model.ledger import bump_version
+
+class TestUserDirectory(TestCase):
+    def setUp(self):
+        self.directory = meta.directory
+        self.directory.invalidate()
+
+    def tearDown(self):
+        self.directory.check_interval = 1
+        meta.Session.rollback()
+        for user in meta.Session.query(model.User).filter_by(username=u'chaz'):
+            meta.Session.delete(user)
+        meta.Session.commit()
+
+    def test_loads_once(self):
+        misses = self.directory.stats['misses']
+        hits = self.directory.stats['hits']
+        users = self.directory.all(meta.Session)
+        self.directory.get(meta.Session, users[0].id)
+        self.assertEqual(self.directory.stats['misses'], misses + 1)
+        self.assertEqual(self.directory.stats['hits'], hits + 1)
+
+    def test_session_members(self):
+        users = self.directory.all(meta.Session)
+        self.assertEqual(users,
+                         meta.Session.query(model.User).\
+                             order_by(model.User.id).all())
+        root = self.directory.by_username(meta.Session, u'root')
+        self.assert_(root in users)
+        self.assertEqual(self.directory.get(meta.Session, -1), None)
+
+    def test_unflushed_changes_kept(self):
+        root = self.directory.by_username(meta.Session, u'root')
+        root.name = u'Changed'
+        self.assertEqual(self.directory.get(meta.Session, root.id).name,
+                         u'Changed')
+
+    def test_invalidated_on_commit(self):
+        self.directory.all(meta.Session)
+        meta.Session.add(model.User(u'chaz', u'Charles Root', False))
+        meta.Session.flush()
+        meta.Session.remove()
+        self.assertEqual(self.directory.by_username(meta.Session, u'chaz'),
+                         None)
+
+        meta.Session.add(model.User(u'chaz', u'Charles Root', False))
+        meta.Session.commit()
+        chaz = self.directory.by_username(meta.Session, u'chaz')
+        self.assertEqual(chaz.name, u'Charles Root')
+        self.assert_(chaz not in self.directory.residents(meta.Session))
+
+    def test_reloaded_on_users_version_change(self):
+        # Another process adding a user doesn't go through this
+        # process's extensions, but it does bump users_version
+        self.directory.all(meta.Session)
+        conn = meta.engine.connect()
+        trans = conn.begin()
+        conn.execute(model.users.insert().values(username=u'chaz',
+                                                 name=u'Charles Root',
+                                                 resident=True))
+        bump_version(conn, 'users_version')
+        trans.commit()
+        conn.close()
+
+        chaz = self.directory.by_username(meta.Session, u'chaz')
+        self.assertEqual(chaz.name, u'Charles Root')
+        self.assert_(chaz in self.directory.residents(meta.Session))
+
+    def test_checked_once_per_interval(self):
+        self.directory.all(meta.Session)
+        result, statements = count_statements(
+            self.directory.by_username, meta.Session, u'root')
+        self.assertEqual(statements, [])
+
+        self.directory.check_interval = 0
+        result, statements = count_statements(
+            self.directory.by_username, meta.Session, u'root')
+        self.assertEqual(len(statements), 1)
+        assert 'users_version' in statements[0]
+
+    def test_kept_when_books_change(self):
+        self.directory.check_interval = 0
+        self.directory.all(meta.Session)
+        misses = self.directory.stats['misses']
+        bump_version(meta.Session)
+        meta.Session.commit()
+        self.directory.all(meta.Session)
+        self.assertEqual(self.directory.stats['misses'], misses)
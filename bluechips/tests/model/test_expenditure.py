@@ -37,6 +37,28 @@ class TestExpenditure(TestCase):
         split_dict[self.u] = Decimal(1)
         self.e.split(split_dict)
 
+    def test_resplit_keeps_unchanged_rows(self):
+        self.e.even_split()
+        meta.Session.commit()
+        ids = dict((sp.user, sp.id) for sp in self.e.splits)
+
+        self.e.even_split()
+        meta.Session.commit()
+        self.assertEqual(dict((sp.user, sp.id) for sp in self.e.splits), ids)
+
+        users = meta.Session.query(model.User).all()
+        split_dict = dict((user, Decimal(1)) for user in users)
+        split_dict[users[0]] = Decimal(0)
+        split_dict[users[1]] = Decimal(2)
+        self.e.split(split_dict)
+        meta.Session.commit()
+        shares = dict((sp.user, sp) for sp in self.e.splits)
+        assert users[0] not in shares
+        self.assertEqual(shares[users[1]].id, ids[users[1]])
+        self.assertEqual(shares[users[1]].share, Currency('177.95'))
+        self.assertEqual(sum(sp.share for sp in self.e.splits),
+                         self.e.amount)
+
     def _two_way_split_test(self, amount, min, max):
         e2 = model.Expenditure(self.u, amount,
                               u'testing splits')
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from datetime import date
+
+import sqlalchemy as sa
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model import rollup
+from bluechips.model.types import Currency
+
+class TestRollup(TestCase):
+    def setUp(self):
+        # Other tests clear out tags behind the rollup's back
+        rollup.rebuild_rollup(meta.Session)
+        self.users = meta.Session.query(model.User).all()[:2]
+        self.e = model.Expenditure(self.users[0], 1000, u'Groceries')
+        self.e.date = date(2010, 3, 15)
+        meta.Session.add(self.e)
+        self.e.split({self.users[0]: 1, self.users[1]: 1})
+        self.e.tags.add(u'food')
+        meta.Session.commit()
+
+    def tearDown(self):
+        meta.Session.execute(model.tag_to_expense_map.delete())
+        meta.Session.execute(model.tags.delete())
+        meta.Session.execute(model.tag_month_rollup.delete())
+        meta.Session.expire_all()
+        deleteExpenditures()
+        meta.Session.commit()
+
+    def stored(self):
+        t = model.tag_month_rollup
+        return dict(((tag_id, month, user_id), (share, paid))
+                    for tag_id, month, user_id, share, paid in
+                    meta.Session.execute(sa.select(
+                    [t.c.tag_id, t.c.month, t.c.user_id, t.c.share,
+                     t.c.paid])))
+
+    def assertConsistent(self):
+        stored = self.stored()
+        rollup.rebuild_rollup(meta.Session)
+        self.assertEqual(stored, self.stored())
+        return stored
+
+    def tag_id(self, name):
+        return meta.Session.query(model.Tag).filter_by(name=name).one().id
+
+    def test_created(self):
+        food = self.tag_id(u'food')
+        u0, u1 = [u.id for u in self.users]
+        self.assertEqual(self.assertConsistent(),
+                         {(food, date(2010, 3, 1), u0): (500, 1000),
+                          (food, date(2010, 3, 1), u1): (500, 0)})
+
+    def test_amount_and_date(self):
+        self.e.amount = Currency(3000)
+        self.e.split({self.users[0]: 1, self.users[1]: 2})
+        self.e.date = date(2010, 4, 2)
+        meta.Session.commit()
+        stored = self.assertConsistent()
+        self.assertEqual(set(month for tag_id, month, user_id in stored),
+                         set([date(2010, 4, 1)]))
+        self.assertEqual(sum(share for share, paid in stored.values()),
+                         3000)
+
+    def test_tags(self):
+        self.e.tags.clear()
+        self.e.tags.add(u'fun')
+        meta.Session.commit()
+        fun = self.tag_id(u'fun')
+        stored = self.assertConsistent()
+        self.assertEqual(set(tag_id for tag_id, month, user_id in stored),
+                         set([fun]))
+
+    def test_destroy(self):
+        meta.Session.delete(self.e)
+        meta.Session.commit()
+        self.assertEqual(self.assertConsistent(), {})
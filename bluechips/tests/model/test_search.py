@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model import search
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.user = meta.Session.query(model.User).first()
+        self.e = model.Expenditure(self.user, 5000, u'Plumber for the sink')
+        meta.Session.add(self.e)
+        self.e.split({self.user: 1})
+        self.e2 = model.Expenditure(self.user, 1000,
+                                    u'Sink cleaner; 100% organic')
+        meta.Session.add(self.e2)
+        self.e2.split({self.user: 1})
+        self.t = model.Transfer(self.user, self.user, 100)
+        self.t.description = u'Paying back the plumber'
+        meta.Session.add(self.t)
+        meta.Session.commit()
+
+    def tearDown(self):
+        deleteExpenditures()
+        for t in meta.Session.query(model.Transfer):
+            meta.Session.delete(t)
+        meta.Session.commit()
+
+    def search(self, backend, cls, text):
+        return backend.search(meta.Session, cls, search.search_terms(text))
+
+    def test_fts5_in_use(self):
+        assert isinstance(meta.search, search.FTS5Backend)
+
+    def test_backends(self):
+        for backend in (meta.search, search.LikeBackend()):
+            self.assertEqual(self.search(backend, model.Expenditure,
+                                         u'plumb'),
+                             [self.e.id])
+            self.assertEqual(sorted(self.search(backend, model.Expenditure,
+                                                u'sink')),
+                             sorted([self.e.id, self.e2.id]))
+            self.assertEqual(self.search(backend, model.Expenditure,
+                                         u'sink organic'),
+                             [self.e2.id])
+            self.assertEqual(self.search(backend, model.Expenditure,
+                                         u'100%'),
+                             [self.e2.id])
+            self.assertEqual(self.search(backend, model.Transfer,
+                                         u'plumber'),
+                             [self.t.id])
+            self.assertEqual(self.search(backend, model.Expenditure,
+                                         u'"quoted'),
+                             [])
+
+    def test_kept_in_sync(self):
+        self.e.description = u'Electrician'
+        meta.Session.commit()
+        self.assertEqual(self.search(meta.search, model.Expenditure,
+                                     u'plumber'), [])
+        self.assertEqual(self.search(meta.search, model.Expenditure,
+                                     u'electrician'), [self.e.id])
+
+        meta.Session.delete(self.e2)
+        meta.Session.commit()
+        self.assertEqual(self.search(meta.search, model.Expenditure,
+                                     u'sink'), [])
+
+    def test_rebuild(self):
+        meta.Session.execute('DELETE FROM search_index')
+        self.assertEqual(self.search(meta.search, model.Transfer,
+                                     u'plumber'), [])
+        meta.search.rebuild(meta.Session)
+        self.assertEqual(self.search(meta.search, model.Transfer,
+                                     u'plumber'), [self.t.id])
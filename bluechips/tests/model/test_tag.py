@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model.tag import prune_tags
+
+class TestPruneTags(TestCase):
+    def setUp(self):
+        user = meta.Session.query(model.User).first()
+        self.e1 = model.Expenditure(user, 1000, u'One')
+        self.e2 = model.Expenditure(user, 2000, u'Two')
+        for e in (self.e1, self.e2):
+            meta.Session.add(e)
+            e.even_split()
+        self.e1.tags |= set([u'shared', u'only-one'])
+        self.e2.tags |= set([u'shared'])
+        meta.Session.commit()
+
+    def tearDown(self):
+        for e in meta.Session.query(model.Expenditure):
+            meta.Session.delete(e)
+        meta.Session.flush()
+        prune_tags(meta.Session,
+                   [tag.id for tag in meta.Session.query(model.Tag)])
+        meta.Session.commit()
+
+    def tag_names(self):
+        return sorted(tag.name for tag in meta.Session.query(model.Tag))
+
+    def test_prune(self):
+        ids = [tag.id for tag in self.e1._tags]
+        self.e1.tags.clear()
+        meta.Session.flush()
+        prune_tags(meta.Session, ids)
+        meta.Session.commit()
+        self.assertEqual(self.tag_names(), [u'shared'])
+
+    def test_only_given_tags(self):
+        unused = model.Tag(u'unused')
+        meta.Session.add(unused)
+        meta.Session.flush()
+        prune_tags(meta.Session, [])
+        prune_tags(meta.Session, [tag.id for tag in self.e1._tags])
+        meta.Session.commit()
+        self.assertEqual(self.tag_names(), [u'only-one', u'shared', u'unused'])
@@ -0,0 +1,86 @@
+from unittest import TestCase
+from bluechips.tests import *
+from bluechips import model
+from bluechips.model import meta
+from bluechips.model.types import Currency
+from bluechips.lib.allocation import largest_remainder
+from decimal import Decimal
+from fractions import Fraction
+import random
+
+class TestLargestRemainder(TestCase):
+    def test_exact(self):
+        self.assertEqual(largest_remainder(100, [('a', 1), ('b', 3)]),
+                         [('a', Currency(25)), ('b', Currency(75))])
+
+    def test_remainders(self):
+        """
+        Test that leftover pennies go to the largest remainders
+        """
+        # Exact shares are 14.2857..., 28.5714... and 57.1428...
+        self.assertEqual(largest_remainder(100, [('a', 1), ('b', 2),
+                                                 ('c', 4)]),
+                         [('a', Currency(14)), ('b', Currency(29)),
+                          ('c', Currency(57))])
+
+    def test_negative(self):
+        self.assertEqual(largest_remainder(-100, [('a', 1), ('b', 2)]),
+                         [('a', Currency(-33)), ('b', Currency(-67))])
+
+    def test_pennies_go_somewhere(self):
+        rng = random.Random(0)
+        for i in xrange(50):
+            weights = [(j, Decimal(rng.randint(0, 1000)) / 7)
+                       for j in xrange(rng.randint(1, 200))]
+            weights.append(('last', Decimal(1)))
+            amount = rng.randint(-100000, 100000)
+            shares = largest_remainder(amount, weights)
+            self.assertEqual(sum(share for key, share in shares), amount)
+            total = sum(Fraction(w) for k, w in weights)
+            for (key, weight), (share_key, share) in zip(weights, shares):
+                self.assertEqual(key, share_key)
+                exact = amount * Fraction(weight) / total
+                self.assert_(abs(int(share) - exact) < 1)
+
+    def test_seeded(self):
+        weights = [(i, 1) for i in xrange(200)]
+        self.assertEqual(largest_remainder(1234567, weights, seed=42),
+                         largest_remainder(1234567, weights, seed=42))
+
+    def test_ties_are_spread(self):
+        weights = [(i, 1) for i in xrange(3)]
+        winners = set()
+        for seed in xrange(50):
+            shares = dict(largest_remainder(1, weights, seed=seed))
+            winners.update(key for key, share in shares.iteritems() if share)
+        self.assertEqual(winners, set(xrange(3)))
+
+    def test_zero_total(self):
+        self.assertRaises(ValueError, largest_remainder, 100, [('a', 0)])
+
+
+class TestSplitSeeded(TestCase):
+    def setUp(self):
+        createUsers(3)
+
+    def tearDown(self):
+        deleteExpenditures()
+        deleteUsers()
+        meta.Session.commit()
+
+    def shares(self, e):
+        return sorted((s.user.id, s.share) for s in e.splits)
+
+    def test_reproducible(self):
+        users = meta.Session.query(model.User).all()
+        e = model.Expenditure(users[0], Currency("100.00"))
+        meta.Session.add(e)
+        e.even_split(seed=1)
+        meta.Session.commit()
+        first = self.shares(e)
+
+        e.even_split(seed=1)
+        meta.Session.commit()
+        meta.Session.refresh(e)
+        self.assertEqual(self.shares(e), first)
+        self.assertEqual(sum(share for user, share in first), e.amount)
@@ -5,6 +5,26 @@ from bluechips.config.environment import load_environment
 
 log = logging.getLogger(__name__)
 
+def existing_indexes(engine, table):
+    """
+    Return the names of the indexes on ``table``, or None if we don't
+    know how to find out for this database.
+    """
+    import sqlalchemy as sa
+    name = engine.dialect.name
+    if name == 'sqlite':
+        query = sa.text("SELECT name FROM sqlite_master "
+                        "WHERE type = 'index' AND tbl_name = :table")
+    elif name == 'postgres':
+        query = sa.text("SELECT indexname FROM pg_indexes "
+                        "WHERE tablename = :table")
+    elif name == 'mysql':
+        return set(row['Key_name'] for row in
+                   engine.execute('SHOW INDEX FROM %s' % table.name))
+    else:
+        return None
+    return set(row[0] for row in engine.execute(query, table=table.name))
+
 def setup_app(command, conf, vars):
     """Place any commands to setup bluechips here"""
     load_environment(conf.global_conf, conf.local_conf)
@@ -15,3 +35,40 @@ def setup_app(command, conf, vars):
 
     # Create the tables if they aren't there already
     meta.metadata.create_all(checkfirst=True)
+
+    # create_all skips tables which already exist, so add any columns
+    # added since they were created. (Columns added to existing tables
+    # have to be nullable for this to work.)
+    import sqlalchemy as sa
+    for table in meta.metadata.sorted_tables:
+        existing = sa.Table(table.name, sa.MetaData(), autoload=True,
+                            autoload_with=meta.engine)
+        for column in table.columns:
+            if column.name not in existing.c:
+                log.info('Adding column %s.%s', table.name, column.name)
+                meta.engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                        table.name, column.name,
+                        column.type.dialect_impl(meta.engine.dialect).\
+                            get_col_spec()))
+
+    # Make sure indexes added since the tables were created are there too
+    for table in meta.metadata.sorted_tables:
+        existing = existing_indexes(meta.engine, table)
+        for index in table.indexes:
+            if existing is None:
+                log.warning("Can't tell whether index %s exists; not "
+                            "creating it", index.name)
+            elif index.name not in existing:
+                log.info('Adding index %s', index.name)
+                index.create(bind=meta.engine)
+
+    # Bring the balances and rollup tables and search index up to date,
+    # in case they were just created for an existing set of books. The
+    # search index isn't a regular table (and may not be a table at
+    # all), so the backend sets it up
+    from bluechips.lib.totals import rebuild_balances
+    from bluechips.model.rollup import rebuild_rollup
+    rebuild_balances()
+    rebuild_rollup(meta.Session)
+    meta.search.rebuild(meta.Session)
+    meta.Session.commit()
@@ -43,5 +43,13 @@ setup(
 
     [paste.app_install]
     main = pylons.util:PylonsInstaller
+
+    [paste.paster_command]
+    rebuild-balances = bluechips.commands:RebuildBalancesCommand
+    checkpoint-balances = bluechips.commands:CheckpointBalancesCommand
+    import-expenditures = bluechips.commands:ImportExpendituresCommand
+    rebuild-search-index = bluechips.commands:RebuildSearchIndexCommand
+    rebuild-rollup = bluechips.commands:RebuildRollupCommand
+    send-mail = bluechips.commands:SendMailCommand
     """,
 )